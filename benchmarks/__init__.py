@@ -0,0 +1,29 @@
+"""Performance benchmarks for django-historical-currencies.
+
+These aren't run as part of the test suite. runbenchmarks.py runs the
+suite in benchmarks.suite. The other modules are standalone investigations,
+that can be executed with python -m benchmarks.<name>.
+"""
+
+import os
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """Create a throw-away database (like the test runner does)"""
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
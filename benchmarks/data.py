@@ -0,0 +1,115 @@
+import datetime
+import json
+import random
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+
+from historical_currencies.models import ExchangeRate
+
+BASE_CURRENCIES = ["EUR", "USD", "GBP"]
+CURRENCIES = [
+    "AUD", "BRL", "CAD", "CHF", "CNY", "CZK", "DKK", "EUR", "GBP", "HKD",
+    "HUF", "IDR", "ILS", "INR", "ISK", "JPY", "KRW", "MXN", "MYR", "NOK",
+    "NZD", "PHP", "PLN", "RON", "SEK", "SGD", "THB", "TRY", "USD", "ZAR",
+]  # fmt: skip
+LAST_DATE = datetime.date(2023, 12, 29)
+
+
+def iter_dates(last_date=LAST_DATE):
+    """Weekdays, backwards from last_date"""
+    date = last_date
+    while True:
+        if date.weekday() < 5:
+            yield date
+        date -= datetime.timedelta(days=1)
+
+
+def iter_rates(rows, base_currencies=BASE_CURRENCIES, seed=0, last_date=LAST_DATE):
+    """Generate rows synthetic ExchangeRates, newest first, from last_date.
+
+    Every base currency has a rate for every other currency, every weekday.
+    """
+    rng = random.Random(seed)
+    pairs = [
+        (base_currency, currency)
+        for base_currency in base_currencies
+        for currency in CURRENCIES
+        if currency != base_currency
+    ]
+    levels = {pair: rng.uniform(0.01, 100) for pair in pairs}
+    generated = 0
+    for date in iter_dates(last_date):
+        for pair in pairs:
+            if generated >= rows:
+                return
+            base_currency, currency = pair
+            levels[pair] *= rng.uniform(0.99, 1.01)
+            yield ExchangeRate(
+                date=date,
+                base_currency=base_currency,
+                currency=currency,
+                rate=Decimal(levels[pair]).quantize(Decimal("0.00001")),
+            )
+            generated += 1
+
+
+def populate(
+    rows, base_currencies=BASE_CURRENCIES, batch_size=5000, last_date=LAST_DATE
+):
+    """Fill the ExchangeRate table with rows synthetic rates"""
+    rates = iter_rates(rows, base_currencies, last_date=last_date)
+    while True:
+        batch = list(islice(rates, batch_size))
+        if not batch:
+            break
+        ExchangeRate.objects.bulk_create(batch)
+
+
+def write_ecb_xml(f, days, last_date=LAST_DATE):
+    """Write a synthetic eurofxref-hist.xml, with days of rates, to f"""
+    rng = random.Random(0)
+    currencies = [currency for currency in CURRENCIES if currency != "EUR"]
+    f.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" '
+        'xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">\n'
+        "\t<gesmes:subject>Reference rates</gesmes:subject>\n"
+        "\t<Cube>\n"
+    )
+    for date in islice(iter_dates(last_date), days):
+        f.write(f'\t\t<Cube time="{date.isoformat()}">\n')
+        for currency in currencies:
+            f.write(
+                f'\t\t\t<Cube currency="{currency}" '
+                f'rate="{rng.uniform(0.01, 100):.4f}"/>\n'
+            )
+        f.write("\t\t</Cube>\n")
+    f.write("\t</Cube>\n</gesmes:Envelope>\n")
+
+
+def write_oxr_fixtures(directory, days, base_currency="USD"):
+    """Write synthetic OpenExchangeRates.org API responses for days, under
+    directory/api/, to be served by a local HTTP server
+    """
+    rng = random.Random(0)
+    api = Path(directory) / "api"
+    (api / "historical").mkdir(parents=True)
+    (api / "usage.json").write_text(
+        json.dumps(
+            {
+                "data": {
+                    "plan": {"features": {"base": False, "time-series": False}},
+                    "usage": {"requests_remaining": len(days) + 1},
+                }
+            }
+        )
+    )
+    for day in days:
+        rates = {
+            currency: 1 if currency == base_currency else rng.uniform(0.01, 100)
+            for currency in CURRENCIES
+        }
+        (api / "historical" / f"{day.isoformat()}.json").write_text(
+            json.dumps({"base": base_currency, "rates": rates})
+        )
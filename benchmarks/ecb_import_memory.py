@@ -0,0 +1,103 @@
+"""Measure peak memory use of the ECB importer, against a local file.
+
+Usage: python -m benchmarks.ecb_import_memory [--days N] [--fixture PATH]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from io import StringIO
+from pathlib import Path
+from urllib.request import urlopen
+
+from benchmarks import benchmark_database, setup_django
+
+
+def parse_whole_file(url):
+    """The previous, non-streaming, parser, for comparison.
+
+    bulk_create() without a batch_size builds a list of every ExchangeRate.
+    """
+    from historical_currencies.models import ExchangeRate
+    from historical_currencies.providers import ECB_NAMESPACE
+
+    with urlopen(url) as f:
+        root = ET.parse(f).getroot()
+    return [
+        ExchangeRate(
+            date=day.get("time"),
+            base_currency="EUR",
+            currency=rate.get("currency"),
+            rate=rate.get("rate"),
+        )
+        for day in root.iterfind(
+            "./eurofxref:Cube/eurofxref:Cube[@time]", ECB_NAMESPACE
+        )
+        for rate in day.iterfind("eurofxref:Cube", ECB_NAMESPACE)
+    ]
+
+
+def stream_file(url):
+    from historical_currencies.providers import ECBProvider
+
+    for rate in ECBProvider(url).iter_rates():
+        pass
+
+
+def import_file(url, batch_size):
+    from django.core.management import call_command
+
+    call_command(
+        "import_ecb_exchangerates",
+        "--url",
+        url,
+        "--batch-size",
+        str(batch_size),
+        stdout=StringIO(),
+    )
+
+
+def measure(name, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}: peak {peak / 2**20:.1f} MiB, {elapsed:.2f} s")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--days", type=int, default=6000, help="Days of rates to generate")
+    p.add_argument("--fixture", type=Path, help="Use an existing XML file")
+    p.add_argument("--batch-size", type=int, default=1000)
+    args = p.parse_args()
+
+    setup_django()
+    from benchmarks.data import write_ecb_xml
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fixture = args.fixture
+        if fixture is None:
+            fixture = Path(tmpdir) / "eurofxref-hist.xml"
+            with fixture.open("w") as f:
+                write_ecb_xml(f, args.days)
+        url = fixture.resolve().as_uri()
+        print(f"Fixture: {fixture} ({fixture.stat().st_size / 2**20:.1f} MiB)")
+
+        measure("ET.parse (previous)", parse_whole_file, url)
+        measure("iterparse", stream_file, url)
+        with benchmark_database():
+            measure(
+                f"import (--batch-size {args.batch_size})",
+                import_file,
+                url,
+                args.batch_size,
+            )
+
+
+if __name__ == "__main__":
+    main()
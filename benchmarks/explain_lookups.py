@@ -0,0 +1,78 @@
+"""Compare query plans and timings for latest rate lookups, with and
+without the (base_currency, currency, date) index.
+
+Usage: python -m benchmarks.explain_lookups [--rows N]
+"""
+
+import argparse
+import datetime
+import timeit
+
+from benchmarks import benchmark_database, setup_django
+
+
+def lookup_querysets(date):
+    from django.db.models import Q
+
+    from historical_currencies.exchange import _rates_in_window, _triangulated_rates
+    from historical_currencies.models import ExchangeRate
+
+    oldest = date - datetime.timedelta(days=30)
+    window = ExchangeRate.objects.filter(date__lte=date, date__gte=oldest)
+    return {
+        "direct (OR)": window.filter(
+            Q(currency="JPY", base_currency="USD")
+            | Q(currency="USD", base_currency="JPY")
+        ).order_by("-date")[:1],
+        "direct (pair)": _rates_in_window("USD", ["JPY"], oldest, date)[:1],
+        "triangulated (OR)": window.filter(
+            Q(currency="JPY", base_currency="EUR")
+            | Q(currency="ZAR", base_currency="EUR")
+        ).order_by("-date"),
+        "triangulated (pair)": _rates_in_window("EUR", ["JPY", "ZAR"], oldest, date),
+        "triangulated (self-join)": _triangulated_rates("JPY", "ZAR", oldest, date),
+    }
+
+
+def report(querysets, repeat):
+    for name, queryset in querysets.items():
+        seconds = min(
+            timeit.repeat(lambda: list(queryset.all()), number=1, repeat=repeat)
+        )
+        print(f"## {name}: {seconds * 1000:.3f} ms")
+        print(queryset.explain())
+        print()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rows", type=int, default=100_000, help="Rows to generate")
+    p.add_argument("--repeat", type=int, default=20, help="Timing repetitions")
+    args = p.parse_args()
+
+    setup_django()
+    from benchmarks.data import LAST_DATE, populate
+    from historical_currencies.models import ExchangeRate
+
+    with benchmark_database() as connection:
+        print(f"Populating {args.rows} rows on {connection.vendor}...")
+        populate(args.rows)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        date = LAST_DATE - datetime.timedelta(days=180)
+        querysets = lookup_querysets(date)
+
+        print("# With (base_currency, currency, -date) index\n")
+        report(querysets, args.repeat)
+
+        (index,) = ExchangeRate._meta.indexes
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(ExchangeRate, index)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        print("# Without index\n")
+        report(querysets, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
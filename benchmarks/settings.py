@@ -0,0 +1,13 @@
+import os
+
+from tests.test_settings import *  # noqa: F401,F403
+
+# Set BENCHMARK_DATABASE=postgresql to benchmark against PostgreSQL,
+# configured by the standard libpq environment variables (PGHOST, etc.)
+if os.environ.get("BENCHMARK_DATABASE") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("PGDATABASE", "historical_currencies"),
+        }
+    }
@@ -0,0 +1,433 @@
+"""The benchmark suite run by runbenchmarks.py.
+
+Each benchmark is a function registered with @benchmark, taking a Context
+and returning a Run: the number of operations, and a callable that performs
+them. The harness times the callable, then calls it once more to count
+queries and measure peak memory.
+"""
+
+import datetime
+import functools
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from decimal import Decimal
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from itertools import cycle, islice
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+# Pairs with a direct rate, and pairs that can only be converted by
+# triangulation through a base currency
+DIRECT_PAIRS = [("EUR", "USD"), ("USD", "JPY"), ("GBP", "ZAR"), ("EUR", "CHF")]
+TRIANGULATED_PAIRS = [("JPY", "ZAR"), ("CHF", "SEK"), ("AUD", "NZD"), ("INR", "KRW")]
+
+
+@dataclass
+class Context:
+    rows: int
+    date: datetime.date
+    tmpdir: Path
+
+
+@dataclass
+class Run:
+    operations: int
+    func: Callable[[], None]
+
+
+@dataclass
+class Result:
+    name: str
+    rows: int
+    operations: int
+    seconds: float
+    queries: int
+    peak_memory: int
+
+    @property
+    def ops_per_second(self) -> float:
+        return self.operations / self.seconds if self.seconds else float("inf")
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "rows": self.rows,
+            "operations": self.operations,
+            "seconds": self.seconds,
+            "ops_per_second": self.ops_per_second,
+            "queries": self.queries,
+            "peak_memory": self.peak_memory,
+        }
+
+
+def benchmark(func: Callable) -> Callable:
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(name: str, context: Context, repeat: int) -> Result:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    run = BENCHMARKS[name](context)
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        run.func()
+        timings.append(time.perf_counter() - start)
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            run.func()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return Result(
+        name=name,
+        rows=context.rows,
+        operations=run.operations,
+        seconds=min(timings),
+        queries=len(queries),
+        peak_memory=peak,
+    )
+
+
+def clear_caches():
+    from historical_currencies.exchange import invalidate_caches
+
+    invalidate_caches()
+
+
+def rolled_back(func: Callable) -> Callable:
+    """Run func in a transaction, rolled back afterwards"""
+
+    @functools.wraps(func)
+    def wrapper():
+        from django.db import transaction
+
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+
+    return wrapper
+
+
+@benchmark
+def latest_rate_direct(context: Context) -> Run:
+    from historical_currencies.exchange import latest_rate
+
+    pairs = list(islice(cycle(DIRECT_PAIRS), 100))
+
+    def run():
+        for currency_from, currency_to in pairs:
+            latest_rate.cache_clear()
+            latest_rate(currency_from, currency_to, context.date)
+
+    return Run(len(pairs), run)
+
+
+@benchmark
+def latest_rate_triangulated(context: Context) -> Run:
+    from historical_currencies.exchange import latest_rate
+
+    pairs = list(islice(cycle(TRIANGULATED_PAIRS), 100))
+
+    def run():
+        for currency_from, currency_to in pairs:
+            latest_rate.cache_clear()
+            latest_rate(currency_from, currency_to, context.date)
+
+    return Run(len(pairs), run)
+
+
+@benchmark
+def latest_rate_cached(context: Context) -> Run:
+    from historical_currencies.exchange import latest_rate
+
+    pairs = list(islice(cycle(DIRECT_PAIRS + TRIANGULATED_PAIRS), 10_000))
+    clear_caches()
+    for currency_from, currency_to in pairs:
+        latest_rate(currency_from, currency_to, context.date)
+
+    def run():
+        for currency_from, currency_to in pairs:
+            latest_rate(currency_from, currency_to, context.date)
+
+    return Run(len(pairs), run)
+
+
+def report_dates(context: Context, days: int) -> List[datetime.date]:
+    """Up to days dates, ending at context.date, that have rates"""
+    from django.db.models import Min
+
+    from historical_currencies.models import ExchangeRate
+
+    oldest = ExchangeRate.objects.aggregate(oldest=Min("date"))["oldest"]
+    days = min((context.date - oldest).days + 1, days)
+    return [context.date - datetime.timedelta(days=i) for i in range(days)][::-1]
+
+
+def daily_report(context: Context, interval_cache: bool) -> Run:
+    from django.test.utils import override_settings
+
+    from historical_currencies.exchange import latest_rate
+
+    dates = report_dates(context, 90)
+
+    def run():
+        clear_caches()
+        with override_settings(EXCHANGE_RATE_INTERVAL_CACHE=interval_cache):
+            for date in dates:
+                for currency_from, currency_to in DIRECT_PAIRS + TRIANGULATED_PAIRS:
+                    latest_rate(currency_from, currency_to, date)
+
+    return Run(len(dates) * len(DIRECT_PAIRS + TRIANGULATED_PAIRS), run)
+
+
+@benchmark
+def latest_rate_daily_report(context: Context) -> Run:
+    return daily_report(context, interval_cache=False)
+
+
+@benchmark
+def latest_rate_daily_report_intervals(context: Context) -> Run:
+    return daily_report(context, interval_cache=True)
+
+
+@benchmark
+def rate_series(context: Context) -> Run:
+    from historical_currencies.exchange import rate_series
+
+    dates = report_dates(context, 365)
+
+    def run():
+        for currency_from, currency_to in DIRECT_PAIRS + TRIANGULATED_PAIRS:
+            list(rate_series(currency_from, currency_to, dates[0], dates[-1]))
+
+    return Run(len(dates) * len(DIRECT_PAIRS + TRIANGULATED_PAIRS), run)
+
+
+@benchmark
+def iter_available_rates(context: Context) -> Run:
+    from historical_currencies.exchange import _iter_available_rates
+
+    pairs = list(islice(cycle(DIRECT_PAIRS + TRIANGULATED_PAIRS), 100))
+
+    def run():
+        for currency_from, currency_to in pairs:
+            list(_iter_available_rates(currency_from, currency_to, context.date))
+
+    return Run(len(pairs), run)
+
+
+@benchmark
+def exchange_many(context: Context) -> Run:
+    from historical_currencies import exchange
+
+    pairs = cycle(DIRECT_PAIRS + TRIANGULATED_PAIRS)
+    items = [
+        (
+            Decimal(i),
+            *next(pairs),
+            context.date - datetime.timedelta(days=i % 7),
+        )
+        for i in range(1000)
+    ]
+
+    def run():
+        clear_caches()
+        exchange.exchange_many(items)
+
+    return Run(len(items), run)
+
+
+@benchmark
+def import_ecb(context: Context) -> Run:
+    from django.core.management import call_command
+
+    from benchmarks.data import CURRENCIES, write_ecb_xml
+
+    days = 250
+    fixture = context.tmpdir / "eurofxref-hist.xml"
+    if not fixture.exists():
+        with fixture.open("w") as f:
+            write_ecb_xml(f, days)
+    url = fixture.as_uri()
+
+    @rolled_back
+    def run():
+        call_command("import_ecb_exchangerates", "--url", url, stdout=StringIO())
+
+    return Run(days * (len(CURRENCIES) - 1), run)
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@benchmark
+def import_oxr(context: Context) -> Run:
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    from benchmarks.data import CURRENCIES, write_oxr_fixtures
+
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    days = [yesterday - datetime.timedelta(days=i) for i in range(30)]
+    directory = context.tmpdir / "oxr"
+    if not directory.exists():
+        write_oxr_fixtures(directory, days)
+
+    @rolled_back
+    def run():
+        handler = functools.partial(QuietHTTPRequestHandler, directory=directory)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            port = server.server_address[1]
+            with override_settings(
+                OPEN_EXCHANGE_RATES_API_URL=f"http://127.0.0.1:{port}/api/",
+                OPEN_EXCHANGE_RATES_APP_ID="benchmark",
+                OPEN_EXCHANGE_RATES_BASE_CURRENCY="USD",
+            ):
+                call_command(
+                    "import_openexchangerates",
+                    "--since",
+                    days[-1].isoformat(),
+                    "--concurrency",
+                    "4",
+                    stdout=StringIO(),
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    return Run(len(days) * len(CURRENCIES), run)
+
+
+AMOUNTS = [
+    (Decimal(i) / 7, currency)
+    for i, currency in zip(range(10_000), cycle(["USD", "EUR", "GBP", "JPY", "ZAR"]))
+]
+
+
+@benchmark
+def render_amount(context: Context) -> Run:
+    from historical_currencies.formatting import render_amount
+
+    def run():
+        for amount, currency in AMOUNTS:
+            render_amount(amount, currency)
+
+    return Run(len(AMOUNTS), run)
+
+
+@benchmark
+def render_amounts(context: Context) -> Run:
+    from historical_currencies.formatting import render_amounts
+
+    def run():
+        render_amounts(AMOUNTS)
+
+    return Run(len(AMOUNTS), run)
+
+
+def render_template(template_code: str, rows: int = 1000) -> Callable[[], None]:
+    from django.template import Context as TemplateContext, Template
+
+    template = Template("{% load currency_format %}" + template_code)
+    currencies = cycle(["USD", "EUR", "GBP", "JPY", "ZAR", "CHF"])
+    context = TemplateContext(
+        {"amounts": [(Decimal(i) / 7, next(currencies)) for i in range(rows)]}
+    )
+
+    def run():
+        clear_caches()
+        template.render(context)
+
+    return run
+
+
+@benchmark
+def render_currency_filter(context: Context) -> Run:
+    return Run(
+        1000,
+        render_template("{% for amount in amounts %}{{ amount|currency }}{% endfor %}"),
+    )
+
+
+@benchmark
+def render_exchange_filter(context: Context) -> Run:
+    return Run(
+        1000,
+        render_template(
+            '{% for amount in amounts %}{{ amount|exchange:"EUR" }}{% endfor %}'
+        ),
+    )
+
+
+@benchmark
+def render_exchange_filter_prefetched(context: Context) -> Run:
+    return Run(
+        1000,
+        render_template(
+            "{% prefetch_rates %}"
+            '{% for amount in amounts %}{{ amount|exchange:"EUR" }}{% endfor %}'
+            "{% endprefetch_rates %}"
+        ),
+    )
+
+
+@benchmark
+def render_currency_choices_options(context: Context) -> Run:
+    from django.template import Context as TemplateContext, Template
+
+    template = Template(
+        "{% load currency_choices %}"
+        "{% for code in codes %}{% currency_choices_options selected=code %}"
+        "{% endfor %}"
+    )
+    template_context = TemplateContext({"codes": ["USD", "EUR", "GBP", "ZAR"] * 25})
+
+    def run():
+        template.render(template_context)
+
+    return Run(100, run)
+
+
+def run_suite(rows: int, names: List[str], repeat: int, log=print) -> List[Result]:
+    """Populate a throw-away database with rows rates, and run names"""
+    from django.db import connection
+
+    from benchmarks import benchmark_database
+    from benchmarks.data import populate
+
+    # exchange() and the template filters convert at today's rates
+    date = datetime.date.today()
+    results = []
+    with benchmark_database(), tempfile.TemporaryDirectory() as tmpdir:
+        log(f"Populating {rows} rows on {connection.vendor}...")
+        populate(rows, last_date=date)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        context = Context(rows=rows, date=date, tmpdir=Path(tmpdir))
+        for name in names:
+            result = measure(name, context, repeat)
+            log(
+                f"{name} [{rows}]: {result.ops_per_second:,.0f} ops/s, "
+                f"{result.queries} queries, "
+                f"peak {result.peak_memory / 2**20:.1f} MiB"
+            )
+            results.append(result)
+    return results
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CurrenciesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "historical_currencies"
+
+    def ready(self):
+        # Connect signal receivers
+        import historical_currencies.exchange  # noqa: F401
@@ -0,0 +1,122 @@
+"""Vectorized currency conversion, for NumPy arrays and pandas columns.
+
+Requires NumPy. Install django-historical-currencies[numpy].
+"""
+
+import datetime
+from decimal import Decimal
+from typing import Any
+
+from historical_currencies.exchange import (
+    TWOPLACES,
+    _fetch_rate_table,
+    _no_rate_available,
+)
+from historical_currencies.ratetable import get_rate_table
+
+import numpy as np
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def _to_decimal(value: Any) -> Decimal:
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, (float, np.floating)):
+        return Decimal(repr(float(value)))
+    return Decimal(int(value))
+
+
+_to_decimals = np.frompyfunc(_to_decimal, 1, 1)
+_quantize = np.frompyfunc(lambda amount: amount.quantize(TWOPLACES), 1, 1)
+
+
+def exchange_array(
+    amounts: Any,
+    currencies_from: Any,
+    currencies_to: Any,
+    dates: Any = None,
+    exact: bool = True,
+    raise_exceptions: bool = True,
+) -> np.ndarray:
+    """Exchange arrays of amounts of currencies_from to currencies_to as of
+    dates.
+
+    Each argument can be an array (or anything array-like, such as a pandas
+    Series), or a single value to use for every amount. dates defaults to
+    today.
+
+    Rates are resolved once per distinct (currency_from, currency_to, date),
+    from a single query, with the same rules as
+    historical_currencies.exchange.latest_rate.
+
+    If exact is True, returns an object array of Decimals, quantized like
+    historical_currencies.exchange.exchange. Otherwise, the conversion is
+    done in floating point, returning a float64 array rounded to 2 decimal
+    places.
+
+    If raise_exceptions is False, amounts that can't be exchanged produce
+    None (exact) or NaN, rather than raising ExchangeRateUnavailable.
+    """
+    if dates is None:
+        dates = datetime.date.today()
+    amounts = np.asarray(amounts)
+    currencies_from = np.asarray(currencies_from, dtype="U3")
+    currencies_to = np.asarray(currencies_to, dtype="U3")
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    amounts, currencies_from, currencies_to, days = np.broadcast_arrays(
+        amounts, currencies_from, currencies_to, days
+    )
+    if amounts.ndim != 1:
+        amounts, currencies_from, currencies_to, days = (
+            array.ravel() for array in (amounts, currencies_from, currencies_to, days)
+        )
+    if not len(amounts):
+        return np.array([], dtype=object if exact else np.float64)
+
+    # Factorize (currency_from, currency_to, date) into distinct conversions
+    codes, code_index = np.unique(
+        np.concatenate([currencies_from, currencies_to]), return_inverse=True
+    )
+    code_index = code_index.reshape(2, -1).astype(np.int64)
+    first_day = days.min()
+    span = int(days.max() - first_day) + 1
+    keys = (code_index[0] * len(codes) + code_index[1]) * span + (days - first_day)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    conversions = [
+        (
+            str(codes[key // span // len(codes)]),
+            str(codes[key // span % len(codes)]),
+            datetime.date.fromordinal(int(key % span + first_day) + EPOCH_ORDINAL),
+        )
+        for key in unique_keys.tolist()
+    ]
+
+    table = get_rate_table()
+    if table is None:
+        table = _fetch_rate_table(conversions)
+
+    rates: list = []
+    for conversion in conversions:
+        rate = table.latest_rate(*conversion)
+        rates.append(None if rate is None else rate[1])
+
+    missing = np.array([rate is None for rate in rates], dtype=bool)
+    if raise_exceptions and missing.any():
+        # Report the first missing conversion, in input order
+        first = int(np.flatnonzero(missing[inverse])[0])
+        raise _no_rate_available(*conversions[inverse[first]])
+
+    if exact:
+        rate_array = np.array(rates, dtype=object)[inverse]
+        result = np.full(len(amounts), None, dtype=object)
+        available = ~missing[inverse]
+        result[available] = _quantize(
+            _to_decimals(amounts[available]) * rate_array[available]
+        )
+        return result
+
+    float_rates = np.array(
+        [np.nan if rate is None else float(rate) for rate in rates], dtype=np.float64
+    )
+    return np.round(amounts.astype(np.float64) * float_rates[inverse], 2)
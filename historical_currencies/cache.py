@@ -0,0 +1,547 @@
+import asyncio
+import datetime
+import inspect
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, namedtuple
+from contextvars import ContextVar
+from functools import update_wrapper
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from uuid import uuid4
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django.core.cache import caches
+
+from historical_currencies import instrumentation
+
+CacheInfo = namedtuple(
+    "CacheInfo",
+    ["hits", "shared_hits", "misses", "coalesced", "maxsize", "currsize", "version"],
+)
+
+DEFAULT_CACHE_SIZE = 128
+DEFAULT_INTERVAL_CACHE_SIZE = 4096
+DEFAULT_SHARED_CACHE_VERSION_CHECK = 10
+DEFAULT_LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+RESOLUTION_ARGUMENTS = ("currency_from", "currency_to", "date")
+
+# Whether the result of the RateCache call in progress is stored in the
+# shared cache
+_share_result: "ContextVar[bool]" = ContextVar("share_result", default=True)
+
+
+def skip_shared_cache() -> None:
+    """Don't store the result of the RateCache call in progress in the
+    shared cache, e.g. because it was answered from a cache in this process.
+    """
+    _share_result.set(False)
+
+
+class SharedCache:
+    """A cache shared between processes, on Django's cache framework.
+
+    Keys include a data version, stored in the cache itself. Invalidating
+    the cache replaces the data version, orphaning all existing entries.
+    """
+
+    version_key = "historical_currencies:version"
+
+    def __init__(self, alias: str) -> None:
+        self.cache = caches[alias]
+
+    def version(self) -> str:
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, uuid4().hex, timeout=None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def invalidate(self) -> None:
+        self.cache.set(self.version_key, uuid4().hex, timeout=None)
+
+    def make_key(self, version: str, name: str, key: Tuple) -> str:
+        return ":".join(["historical_currencies", name, version, *map(str, key)])
+
+    def get(self, key: str) -> Any:
+        return self.cache.get(key, _MISSING)
+
+    def set(self, key: str, value: Any) -> None:
+        self.cache.set(key, value)
+
+    async def aversion(self) -> str:
+        version = await self.cache.aget(self.version_key)
+        if version is None:
+            await self.cache.aadd(self.version_key, uuid4().hex, timeout=None)
+            version = await self.cache.aget(self.version_key)
+        return version
+
+    async def aget(self, key: str) -> Any:
+        return await self.cache.aget(key, _MISSING)
+
+    async def aset(self, key: str, value: Any) -> None:
+        await self.cache.aset(key, value)
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """The SharedCache, if enabled by settings.EXCHANGE_RATE_SHARED_CACHE"""
+    alias = getattr(settings, "EXCHANGE_RATE_SHARED_CACHE", None)
+    if alias is None:
+        return None
+    return SharedCache(alias)
+
+
+def invalidate_shared_cache() -> None:
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.invalidate()
+
+
+class _Flight:
+    """A call in progress, that concurrent callers can wait for"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class RateIntervals:
+    """Cached values, each valid for an interval of dates.
+
+    A lookup for any date within an interval is a hit. Intervals for the
+    same key must not overlap. Up to settings.EXCHANGE_RATE_INTERVAL_CACHE_SIZE
+    intervals are held, discarding the least recently used. Like RateCache,
+    values computed under a previous version are discarded.
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self.hits = 0
+        self._starts: Dict[Hashable, List[datetime.date]] = {}
+        # (key, start) -> (end, value)
+        self._intervals: "OrderedDict[Tuple[Hashable, datetime.date], Tuple]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        return getattr(
+            settings, "EXCHANGE_RATE_INTERVAL_CACHE_SIZE", DEFAULT_INTERVAL_CACHE_SIZE
+        )
+
+    def get(self, key: Hashable, date: datetime.date) -> Any:
+        """The value cached for key, over an interval including date, or None"""
+        with self._lock:
+            starts = self._starts.get(key)
+            if not starts:
+                return None
+            i = bisect_right(starts, date) - 1
+            if i < 0:
+                return None
+            interval = (key, starts[i])
+            end, value = self._intervals[interval]
+            if date > end:
+                return None
+            self._intervals.move_to_end(interval)
+            self.hits += 1
+            return value
+
+    def add(
+        self,
+        version: int,
+        key: Hashable,
+        start: datetime.date,
+        end: datetime.date,
+        value: Any,
+    ) -> None:
+        with self._lock:
+            if version != self.version:
+                return
+            interval = (key, start)
+            if interval not in self._intervals:
+                insort(self._starts.setdefault(key, []), start)
+            self._intervals[interval] = (end, value)
+            self._intervals.move_to_end(interval)
+            maxsize = self.maxsize
+            if maxsize is not None:
+                while len(self._intervals) > maxsize:
+                    (old_key, old_start), expired = self._intervals.popitem(last=False)
+                    starts = self._starts[old_key]
+                    del starts[bisect_left(starts, old_start)]
+                    if not starts:
+                        del self._starts[old_key]
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._starts.clear()
+            self._intervals.clear()
+            self.hits = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._starts.clear()
+            self._intervals.clear()
+
+
+class RateCache:
+    """A versioned LRU cache, for exchange rate lookups.
+
+    Similar to functools.lru_cache, but the size is configured by
+    settings.EXCHANGE_RATE_CACHE_SIZE (None for unbounded), and the cache
+    can be invalidated, incrementing its version. Results computed under a
+    previous version are discarded, rather than cached.
+
+    If settings.EXCHANGE_RATE_SHARED_CACHE names a Django cache, it is used
+    as a second level cache, shared between processes. The local cache (and
+    anything registered with on_shared_change()) is invalidated when the
+    shared cache's data version changes, which is checked at most every
+    EXCHANGE_RATE_SHARED_CACHE_VERSION_CHECK seconds.
+
+    intervals is a RateIntervals, which the wrapped function may use to
+    cache values by date interval. It is cleared along with the cache. The
+    wrapped function can call skip_shared_cache() to keep a result out of
+    the shared cache.
+
+    Concurrent misses for the same arguments are coalesced into a single
+    call, in each process. With EXCHANGE_RATE_SHARED_CACHE_LOCK, a lock in
+    the shared cache coalesces them across processes, too.
+
+    If the wrapped function takes currency_from, currency_to and date
+    arguments, calls are instrumented (see
+    historical_currencies.instrumentation) when the rate_resolved or
+    rate_unavailable signals have receivers.
+    """
+
+    # Copied from func, by update_wrapper()
+    __name__: str
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+        self.version = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self.intervals = RateIntervals()
+        self._on_shared_change: Callable[[], None] = self.invalidate
+        self._lock = threading.Lock()
+        self._shared_version: Optional[str] = None
+        self._shared_version_checked = 0.0
+        self._flights: Dict[Tuple[int, Tuple], _Flight] = {}
+        self._in_flight: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+            WeakKeyDictionary()
+        )
+        self._signature = inspect.signature(func)
+        self._instrumented = set(RESOLUTION_ARGUMENTS) <= set(
+            self._signature.parameters
+        )
+        update_wrapper(self, func)
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        return getattr(settings, "EXCHANGE_RATE_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+
+    def __call__(self, *args, **kwargs):
+        if self._instrumented and instrumentation.enabled():
+            arguments = self._signature.bind(*args, **kwargs).arguments
+            with instrumentation.resolving(
+                self,
+                arguments["currency_from"],
+                arguments["currency_to"],
+                arguments["date"],
+            ):
+                return self._call(args, kwargs)
+        return self._call(args, kwargs)
+
+    def _call(self, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        key = args
+        if kwargs:
+            key += tuple(sorted(kwargs.items()))
+
+        shared = get_shared_cache()
+        if shared is not None:
+            shared_version = self._sync_shared_version(shared)
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                version = self.version
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                instrumentation.record(cache="hit")
+                return value
+
+        if shared is not None:
+            shared_key = shared.make_key(shared_version, self.__name__, key)
+            value = shared.get(shared_key)
+            if value is not _MISSING:
+                with self._lock:
+                    self.shared_hits += 1
+                instrumentation.record(cache="shared_hit")
+                self._store(version, key, value)
+                return value
+
+        # Concurrent misses for the same key wait for a single call
+        with self._lock:
+            leading = self._flights.get((version, key))
+            if leading is None:
+                flight = self._flights[(version, key)] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if leading is not None:
+            instrumentation.record(cache="coalesced")
+            return leading.wait()
+
+        instrumentation.record(cache="miss")
+        try:
+            if shared is not None and getattr(
+                settings, "EXCHANGE_RATE_SHARED_CACHE_LOCK", False
+            ):
+                value = self._call_locked(shared, shared_key, args, kwargs)
+            else:
+                value, share = self._compute(args, kwargs)
+                if shared is not None and share:
+                    shared.set(shared_key, value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            flight.value = value
+            self._store(version, key, value)
+        finally:
+            with self._lock:
+                del self._flights[(version, key)]
+            flight.done.set()
+        return value
+
+    def _call_locked(
+        self,
+        shared: SharedCache,
+        shared_key: str,
+        args: Tuple,
+        kwargs: Dict[str, Any],
+    ) -> Any:
+        """Call func, unless another process is already calling it for
+        shared_key, in which case, wait for its result in the shared cache.
+        """
+        timeout = getattr(
+            settings, "EXCHANGE_RATE_SHARED_CACHE_LOCK_TIMEOUT", DEFAULT_LOCK_TIMEOUT
+        )
+        lock_key = f"{shared_key}:lock"
+        deadline = time.monotonic() + timeout
+        locked = shared.cache.add(lock_key, 1, timeout=timeout)
+        while not locked:
+            # Poll until the other process has stored its result, released
+            # the lock (it failed), or timed out
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = shared.get(shared_key)
+            if value is not _MISSING:
+                return value
+            if time.monotonic() >= deadline:
+                break
+            locked = shared.cache.add(lock_key, 1, timeout=timeout)
+        try:
+            value, share = self._compute(args, kwargs)
+            if share:
+                shared.set(shared_key, value)
+        finally:
+            # After a timeout, the lock is still the other process's
+            if locked:
+                shared.cache.delete(lock_key)
+        return value
+
+    def _compute(self, args: Tuple, kwargs: Dict[str, Any]) -> Tuple[Any, bool]:
+        """Call func, returning its value, and whether to share it"""
+        token = _share_result.set(True)
+        try:
+            value = self.func(*args, **kwargs)
+            return value, _share_result.get()
+        finally:
+            _share_result.reset(token)
+
+    async def acall(self, afunc: Callable[..., Awaitable], *args: Any) -> Any:
+        """Call the cached function asynchronously, computing misses with
+        afunc, a coroutine function equivalent to the cached function.
+
+        Concurrent misses for the same arguments, on the same event loop,
+        share a single call of afunc.
+        """
+        if self._instrumented and instrumentation.enabled():
+            arguments = self._signature.bind(*args).arguments
+            # The async ORM runs queries in another thread, so they can't
+            # be counted here
+            with instrumentation.resolving(
+                self,
+                arguments["currency_from"],
+                arguments["currency_to"],
+                arguments["date"],
+                count_queries=False,
+            ):
+                return await self._acall(afunc, args)
+        return await self._acall(afunc, args)
+
+    async def _acall(self, afunc: Callable[..., Awaitable], args: Tuple) -> Any:
+        key = args
+
+        shared = get_shared_cache()
+        if shared is not None:
+            shared_version = await self._async_sync_shared_version(shared)
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                version = self.version
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                instrumentation.record(cache="hit")
+                return value
+
+        if shared is not None:
+            shared_key = shared.make_key(shared_version, self.__name__, key)
+            value = await shared.aget(shared_key)
+            if value is not _MISSING:
+                with self._lock:
+                    self.shared_hits += 1
+                instrumentation.record(cache="shared_hit")
+                self._store(version, key, value)
+                return value
+
+        in_flight = self._in_flight_calls()
+        future = in_flight.get((version, key))
+        if future is not None:
+            with self._lock:
+                self.coalesced += 1
+            instrumentation.record(cache="coalesced")
+        else:
+            with self._lock:
+                self.misses += 1
+            instrumentation.record(cache="miss")
+
+            async def compute():
+                _share_result.set(True)
+                value = await afunc(*args)
+                self._store(version, key, value)
+                if shared is not None and _share_result.get():
+                    await shared.aset(shared_key, value)
+                return value
+
+            future = in_flight[(version, key)] = asyncio.ensure_future(compute())
+            future.add_done_callback(lambda future: in_flight.pop((version, key), None))
+        # Cancelling one caller mustn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    def _in_flight_calls(self) -> Dict[Tuple[int, Tuple], "asyncio.Future[Any]"]:
+        """acall()s in progress on the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            in_flight = self._in_flight.get(loop)
+            if in_flight is None:
+                in_flight = self._in_flight[loop] = {}
+        return in_flight
+
+    def _store(self, version: int, key: Tuple, value: Any) -> None:
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = value
+            maxsize = self.maxsize
+            if maxsize is not None:
+                while len(self._entries) > maxsize:
+                    self._entries.popitem(last=False)
+
+    def _sync_shared_version(self, shared: SharedCache) -> str:
+        """Return the shared data version, invalidating if it has changed"""
+        shared_version = self._shared_version
+        if shared_version is None or self._shared_version_due():
+            shared_version = shared.version()
+            self._set_shared_version(shared_version)
+        return shared_version
+
+    async def _async_sync_shared_version(self, shared: SharedCache) -> str:
+        shared_version = self._shared_version
+        if shared_version is None or self._shared_version_due():
+            shared_version = await shared.aversion()
+            self._set_shared_version(shared_version)
+        return shared_version
+
+    def _shared_version_due(self) -> bool:
+        interval = getattr(
+            settings,
+            "EXCHANGE_RATE_SHARED_CACHE_VERSION_CHECK",
+            DEFAULT_SHARED_CACHE_VERSION_CHECK,
+        )
+        return time.monotonic() - self._shared_version_checked >= interval
+
+    def _set_shared_version(self, shared_version: str) -> None:
+        if shared_version != self._shared_version:
+            self._on_shared_change()
+            self._shared_version = shared_version
+        self._shared_version_checked = time.monotonic()
+
+    def on_shared_change(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Decorator, registering func to be called instead of invalidate()
+        when another process changes the shared data version.
+
+        func must invalidate this cache, and anything else in this process
+        derived from the data, before anything is recomputed from it.
+        """
+        self._on_shared_change = func
+        return func
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.shared_hits,
+                self.misses,
+                self.coalesced,
+                self.maxsize,
+                len(self._entries),
+                self.version,
+            )
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+            self.coalesced = 0
+            self._shared_version = None
+        self.intervals.cache_clear()
+
+    def invalidate(self) -> None:
+        """Discard all cached values, and any currently being computed"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._shared_version = None
+        self.intervals.invalidate()
+
+
+def rate_cache(func: Callable) -> RateCache:
+    """Decorator to wrap func in a RateCache"""
+    return RateCache(func)
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from iso4217 import Currency
 
 
@@ -18,6 +20,12 @@ def iter_choices(exclude_special=True):
         )
 
 
-def currency_choices(**kwargs):
+@lru_cache(maxsize=None)
+def sorted_choices(exclude_special=True):
+    """A tuple of currency choices, sorted, computed once"""
+    return tuple(sorted(iter_choices(exclude_special=exclude_special)))
+
+
+def currency_choices(exclude_special=True):
     """A list of CURRENCY: Descriptive Name for use in Django choices"""
-    return sorted(list(iter_choices(**kwargs)))
+    return list(sorted_choices(bool(exclude_special)))
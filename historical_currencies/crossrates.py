@@ -0,0 +1,238 @@
+"""Materialized cross rates, for configured currency pairs.
+
+settings.EXCHANGE_RATE_CROSS_PAIRS lists (currency_from, currency_to) pairs
+to materialize into CrossExchangeRate, so that latest_rate() can look them
+up directly, rather than triangulating. The table is refreshed by the
+materialize_cross_rates management command, and after each import.
+
+Writing ExchangeRates any other way marks the pairs stale from the oldest
+date written, and dates from then on are triangulated live until the next
+refresh.
+"""
+
+import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q, QuerySet, Subquery
+from django.dispatch import receiver
+from django.utils import timezone
+
+from historical_currencies.models import (
+    CrossExchangeRate,
+    CrossExchangeRateStatus,
+    ExchangeRate,
+)
+from historical_currencies.ratetable import RateTable
+from historical_currencies.signals import exchange_rates_updated
+
+Pair = Tuple[str, str]
+
+
+def get_cross_pairs() -> List[Pair]:
+    return [
+        (currency_from, currency_to)
+        for currency_from, currency_to in getattr(
+            settings, "EXCHANGE_RATE_CROSS_PAIRS", []
+        )
+    ]
+
+
+def refresh_cross_rates(
+    full: bool = False,
+    since: Optional[datetime.date] = None,
+) -> List[Tuple[Pair, int]]:
+    """Materialize rates for every configured pair, since the last refresh
+    (or from scratch, if full). Rates dated since (if specified) are
+    rematerialized, e.g. after they have been revised.
+
+    Returns the number of rows materialized for each pair.
+    """
+    newest = ExchangeRate.objects.aggregate(newest=Max("date"))["newest"]
+    if newest is None:
+        return []
+    return [
+        (pair, refresh_pair(*pair, newest, full=full, since=since))
+        for pair in get_cross_pairs()
+    ]
+
+
+def refresh_pair(
+    currency_from: str,
+    currency_to: str,
+    newest: datetime.date,
+    full: bool = False,
+    since: Optional[datetime.date] = None,
+) -> int:
+    with transaction.atomic():
+        status = (
+            CrossExchangeRateStatus.objects.select_for_update()
+            .filter(currency_from=currency_from, currency_to=currency_to)
+            .first()
+        )
+        source = ExchangeRate.objects.filter(
+            currency__in=[currency_from, currency_to], date__lte=newest
+        )
+        if full or status is None:
+            CrossExchangeRate.objects.filter(
+                currency_from=currency_from, currency_to=currency_to
+            ).delete()
+        else:
+            start = status.materialized_through + datetime.timedelta(days=1)
+            if status.stale_since is not None and status.stale_since < start:
+                start = status.stale_since
+            if since is not None and since < start:
+                start = since
+            if start <= status.materialized_through:
+                CrossExchangeRate.objects.filter(
+                    currency_from=currency_from,
+                    currency_to=currency_to,
+                    date__gte=start,
+                ).delete()
+            source = source.filter(date__gte=start)
+
+        # Rates dated each day are a pure function of that day's rows
+        table = RateTable.from_queryset(source)
+        cross_rates = []
+        for date in table.dates():
+            rate = table.latest_rate(currency_from, currency_to, date, max_age=0)
+            if rate is not None:
+                cross_rates.append(
+                    CrossExchangeRate(
+                        date=date,
+                        currency_from=currency_from,
+                        currency_to=currency_to,
+                        rate=rate[1],
+                    )
+                )
+        CrossExchangeRate.objects.bulk_create(cross_rates, batch_size=1000)
+
+        CrossExchangeRateStatus.objects.update_or_create(
+            currency_from=currency_from,
+            currency_to=currency_to,
+            defaults={
+                "materialized_through": newest,
+                "refreshed_at": timezone.now(),
+                "stale_since": None,
+            },
+        )
+    return len(cross_rates)
+
+
+def materialized_latest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Tuple[bool, Optional[Tuple[datetime.date, Decimal]]]:
+    """Look up the latest rate from the materialized cross rates.
+
+    Returns (materialized, rate). If the pair hasn't been materialized
+    through date (or through the newest ExchangeRate, for later dates),
+    materialized is False, and the rate must be found by live triangulation.
+    """
+    if (currency_from, currency_to) not in get_cross_pairs():
+        return False, None
+    status = _materialized_status(currency_from, currency_to, date).first()
+    return _materialized_result(status, date)
+
+
+async def amaterialized_latest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Tuple[bool, Optional[Tuple[datetime.date, Decimal]]]:
+    """Async materialized_latest_rate()"""
+    if (currency_from, currency_to) not in get_cross_pairs():
+        return False, None
+    status = await _materialized_status(currency_from, currency_to, date).afirst()
+    return _materialized_result(status, date)
+
+
+def _materialized_status(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> QuerySet:
+    oldest_acceptable_rate = date - datetime.timedelta(
+        days=settings.MAX_EXCHANGE_RATE_AGE
+    )
+    cross_rates = CrossExchangeRate.objects.filter(
+        currency_from=currency_from,
+        currency_to=currency_to,
+        date__lte=date,
+        date__gte=oldest_acceptable_rate,
+    ).order_by("-date")
+    return (
+        CrossExchangeRateStatus.objects.filter(
+            currency_from=currency_from,
+            currency_to=currency_to,
+        )
+        .annotate(
+            newest=Subquery(ExchangeRate.objects.order_by("-date").values("date")[:1]),
+            rate_date=Subquery(cross_rates.values("date")[:1]),
+            rate=Subquery(cross_rates.values("rate")[:1]),
+        )
+        .values("materialized_through", "stale_since", "newest", "rate_date", "rate")
+    )
+
+
+def _materialized_result(
+    status: Optional[Dict[str, Any]],
+    date: datetime.date,
+) -> Tuple[bool, Optional[Tuple[datetime.date, Decimal]]]:
+    if status is None or status["materialized_through"] < min(date, status["newest"]):
+        return False, None
+    if status["stale_since"] is not None and status["stale_since"] <= date:
+        return False, None
+    if status["rate_date"] is None:
+        return True, None
+    return True, (status["rate_date"], status["rate"])
+
+
+@receiver(exchange_rates_updated)
+def mark_stale(since: Optional[datetime.date] = None, **kwargs) -> None:
+    """Mark the materialized cross rates stale from since, the oldest date
+    of ExchangeRates written
+    """
+    if since is None or not get_cross_pairs():
+        return
+    CrossExchangeRateStatus.objects.filter(
+        Q(stale_since__isnull=True) | Q(stale_since__gt=since),
+        materialized_through__gte=since,
+    ).update(stale_since=since)
+
+
+def cross_rate_status() -> List[Dict[str, Any]]:
+    """The freshness of each configured pair's materialized cross rates.
+
+    lag is the number of days between the newest ExchangeRate and the
+    newest materialized rates, or None if the pair has never been
+    materialized. stale_since is the oldest date that ExchangeRates have
+    been written for since the last refresh, if any.
+    """
+    newest = ExchangeRate.objects.aggregate(newest=Max("date"))["newest"]
+    statuses = {
+        (status.currency_from, status.currency_to): status
+        for status in CrossExchangeRateStatus.objects.all()
+    }
+    report = []
+    for pair in get_cross_pairs():
+        status = statuses.get(pair)
+        lag = None
+        if status is not None:
+            lag = 0
+            if newest is not None:
+                lag = max((newest - status.materialized_through).days, 0)
+        report.append(
+            {
+                "currency_from": pair[0],
+                "currency_to": pair[1],
+                "materialized_through": status and status.materialized_through,
+                "refreshed_at": status and status.refreshed_at,
+                "stale_since": status and status.stale_since,
+                "lag": lag,
+            }
+        )
+    return report
@@ -1,23 +1,47 @@
 import datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
-from functools import lru_cache
-from typing import Iterator, List, Optional, Tuple
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import OuterRef, Q, QuerySet, Subquery
+from django.dispatch import receiver
 
+from historical_currencies import instrumentation
+from historical_currencies.cache import (
+    invalidate_shared_cache,
+    rate_cache,
+    skip_shared_cache,
+)
+from historical_currencies.crossrates import (
+    amaterialized_latest_rate,
+    materialized_latest_rate,
+)
 from historical_currencies.exceptions import ExchangeRateUnavailable
 from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import (
+    RateTable,
+    aget_rate_table,
+    clear_rate_table,
+    get_rate_table,
+)
+from historical_currencies.signals import exchange_rates_updated
 
 TWOPLACES = Decimal(10) ** -2
 
-try:
-    from functools import cache
-except ImportError:  # Python < 3.9
-    cache = lru_cache(maxsize=None)
 
-
-@lru_cache()
+@rate_cache
 def latest_rate(
     currency_from: str,
     currency_to: str,
@@ -28,22 +52,282 @@ def latest_rate(
     currency_from and currency_to must have a direct conversion available
     """
     if currency_from == currency_to:
+        instrumentation.record(method="identity")
         return (date, Decimal(1))
-    rates = list(_iter_available_rates(currency_from, currency_to, date))
-    rates.sort(reverse=True)
-    if not rates:
-        raise ExchangeRateUnavailable(
-            f"No exchange rate available between {currency_from} and {currency_to} for {date}"
+    if getattr(settings, "EXCHANGE_RATE_INTERVAL_CACHE", False):
+        rate = _find_latest_rate_interval(currency_from, currency_to, date)
+    else:
+        rate = _find_latest_rate(currency_from, currency_to, date)
+    if rate is None:
+        raise _no_rate_available(currency_from, currency_to, date)
+    return rate
+
+
+async def alatest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Tuple[datetime.date, Decimal]:
+    """Async latest_rate(), sharing its cache.
+
+    Concurrent lookups of the same rate share a single database fetch.
+    Requires Django >= 4.1.
+    """
+    return await latest_rate.acall(_alatest_rate, currency_from, currency_to, date)
+
+
+async def _alatest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Tuple[datetime.date, Decimal]:
+    if currency_from == currency_to:
+        instrumentation.record(method="identity")
+        return (date, Decimal(1))
+    if getattr(settings, "EXCHANGE_RATE_INTERVAL_CACHE", False):
+        rate = await _afind_latest_rate_interval(currency_from, currency_to, date)
+    else:
+        rate = await _afind_latest_rate(currency_from, currency_to, date)
+    if rate is None:
+        raise _no_rate_available(currency_from, currency_to, date)
+    return rate
+
+
+@receiver(exchange_rates_updated)
+def invalidate_caches(**kwargs) -> None:
+    """Invalidate all cached exchange rate data.
+
+    When rates are written inside a transaction, other connections keep
+    reading (and caching) the old rates until it commits, so invalidate
+    again on commit.
+    """
+    _invalidate_caches()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_invalidate_caches)
+
+
+def _invalidate_caches() -> None:
+    invalidate_shared_cache()
+    invalidate_local_caches()
+
+
+@latest_rate.on_shared_change
+def invalidate_local_caches() -> None:
+    """Invalidate the exchange rate data cached in this process.
+
+    Also called when another process invalidates the shared cache, so
+    nothing stale is recomputed and shared under the new version.
+    """
+    latest_rate.invalidate()
+    clear_rate_table()
+
+
+def _no_rate_available(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> ExchangeRateUnavailable:
+    return ExchangeRateUnavailable(
+        f"No exchange rate available between {currency_from} and {currency_to} for {date}"
+    )
+
+
+def _find_latest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Optional[Tuple[datetime.date, Decimal]]:
+    """Find the latest exchange rate, from the in-memory RateTable (if
+    enabled), materialized cross rates (if fresh) or the database.
+    """
+    table = get_rate_table()
+    if table is None:
+        materialized, materialized_rate = materialized_latest_rate(
+            currency_from, currency_to, date
+        )
+        if materialized:
+            instrumentation.record(source="materialized")
+            return materialized_rate
+        source = "database"
+        resolved = max(
+            _iter_resolved_rates(currency_from, currency_to, date),
+            key=lambda candidate: candidate[:2],
+            default=None,
+        )
+    else:
+        source = "rate_table"
+        resolved = table.resolve(currency_from, currency_to, date)
+    if resolved is None:
+        instrumentation.record(source=source)
+        return None
+    rate_date, rate, method = resolved
+    instrumentation.record(source=source, method=method)
+    return rate_date, rate
+
+
+async def _afind_latest_rate(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Optional[Tuple[datetime.date, Decimal]]:
+    """Async _find_latest_rate()"""
+    table = await aget_rate_table()
+    if table is None:
+        materialized, materialized_rate = await amaterialized_latest_rate(
+            currency_from, currency_to, date
         )
-    return rates[0]
+        if materialized:
+            instrumentation.record(source="materialized")
+            return materialized_rate
+        source = "database"
+        resolved = max(
+            [
+                candidate
+                async for candidate in _aiter_resolved_rates(
+                    currency_from, currency_to, date
+                )
+            ],
+            key=lambda candidate: candidate[:2],
+            default=None,
+        )
+    else:
+        source = "rate_table"
+        resolved = table.resolve(currency_from, currency_to, date)
+    if resolved is None:
+        instrumentation.record(source=source)
+        return None
+    rate_date, rate, method = resolved
+    instrumentation.record(source=source, method=method)
+    return rate_date, rate
 
 
-@cache
-def _possible_base_currencies() -> List[str]:
-    return [
-        rate["base_currency"]
-        for rate in ExchangeRate.objects.values("base_currency").distinct()
-    ]
+def _find_latest_rate_interval(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Optional[Tuple[datetime.date, Decimal]]:
+    """_find_latest_rate(), cached over the interval of dates that each rate
+    is the latest rate for.
+    """
+    intervals = latest_rate.intervals
+    rate = intervals.get((currency_from, currency_to), date)
+    if rate is not None:
+        # Cheaper than a round trip to the shared cache, for every date
+        skip_shared_cache()
+        instrumentation.record(source="interval")
+        return rate
+    version = intervals.version
+    rate = _find_latest_rate(currency_from, currency_to, date)
+    if rate is not None:
+        expires = _rate_expires(rate[0])
+        table = get_rate_table()
+        if table is not None:
+            next_date = table.next_date((currency_from, currency_to), date)
+        else:
+            next_date = _next_rate_dates(
+                currency_from, currency_to, date, expires
+            ).first()
+        intervals.add(
+            version,
+            (currency_from, currency_to),
+            rate[0],
+            _valid_until(expires, next_date),
+            rate,
+        )
+    return rate
+
+
+async def _afind_latest_rate_interval(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Optional[Tuple[datetime.date, Decimal]]:
+    """Async _find_latest_rate_interval()"""
+    intervals = latest_rate.intervals
+    rate = intervals.get((currency_from, currency_to), date)
+    if rate is not None:
+        skip_shared_cache()
+        instrumentation.record(source="interval")
+        return rate
+    version = intervals.version
+    rate = await _afind_latest_rate(currency_from, currency_to, date)
+    if rate is not None:
+        expires = _rate_expires(rate[0])
+        table = await aget_rate_table()
+        if table is not None:
+            next_date = table.next_date((currency_from, currency_to), date)
+        else:
+            next_date = await _next_rate_dates(
+                currency_from, currency_to, date, expires
+            ).afirst()
+        intervals.add(
+            version,
+            (currency_from, currency_to),
+            rate[0],
+            _valid_until(expires, next_date),
+            rate,
+        )
+    return rate
+
+
+def _rate_expires(rate_date: datetime.date) -> datetime.date:
+    """The last date that a rate from rate_date can be used for"""
+    return rate_date + datetime.timedelta(days=settings.MAX_EXCHANGE_RATE_AGE)
+
+
+def _next_rate_dates(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+    expires: datetime.date,
+) -> QuerySet:
+    """Dates after date, up to expires, with a rate for either currency.
+
+    Every rate that could be used to convert between them (direct, inverse,
+    or via a base currency) is a rate for one of the currencies.
+    """
+    return (
+        ExchangeRate.objects.filter(
+            currency__in=[currency_from, currency_to],
+            date__gt=date,
+            date__lte=expires,
+        )
+        .order_by("date")
+        .values_list("date", flat=True)
+    )
+
+
+def _valid_until(
+    expires: datetime.date, next_date: Optional[datetime.date]
+) -> datetime.date:
+    """The last date that the latest rate as of a date is still the latest
+    rate for: the day before the next rate for either currency, unless the
+    rate expires first.
+
+    No rate newer than the latest rate was available as of the date looked
+    up, so the rate is also the latest rate for every date from its own
+    date up to then.
+    """
+    if next_date is None or next_date > expires:
+        return expires
+    return next_date - datetime.timedelta(days=1)
+
+
+def _rates_in_window(
+    base_currency: str,
+    currencies: List[str],
+    oldest: datetime.date,
+    newest: datetime.date,
+) -> QuerySet:
+    """ExchangeRates from base_currency to currencies, between oldest and
+    newest, newest first.
+    """
+    return ExchangeRate.objects.filter(
+        base_currency=base_currency,
+        currency__in=currencies,
+        date__gte=oldest,
+        date__lte=newest,
+    ).order_by("-date")
 
 
 def _iter_available_rates(
@@ -55,55 +339,121 @@ def _iter_available_rates(
     currency_to as of date.
 
     Look for direct conversion, or indirect conversion via a single base
-    currency. Yield all the combinations we found.
+    currency. Yield the latest rate in each direction, and the latest
+    rates via each base currency, in a fixed number of queries.
+    """
+    for rate_date, rate, method in _iter_resolved_rates(
+        currency_from, currency_to, date
+    ):
+        yield rate_date, rate
+
+
+def _iter_resolved_rates(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> Iterator[Tuple[datetime.date, Decimal, str]]:
+    """_iter_available_rates(), with the method ("direct" or
+    "triangulated") of each rate.
     """
     oldest_acceptable_rate = date - datetime.timedelta(
         days=settings.MAX_EXCHANGE_RATE_AGE
     )
 
-    direct_rate = (
-        ExchangeRate.objects.filter(date__lte=date, date__gte=oldest_acceptable_rate)
-        .filter(
-            Q(currency=currency_from, base_currency=currency_to)
-            | Q(currency=currency_to, base_currency=currency_from)
+    # Each of these queries is a range scan over the
+    # (base_currency, currency, date) index
+    for base_currency, currency in (
+        (currency_from, currency_to),
+        (currency_to, currency_from),
+    ):
+        direct_rate = _rates_in_window(
+            base_currency, [currency], oldest_acceptable_rate, date
+        ).first()
+        if direct_rate:
+            yield _direct_rate(direct_rate, currency_to)
+
+    triangulated_rates = _triangulated_rates(
+        currency_from, currency_to, oldest_acceptable_rate, date
+    )
+    newest_date = None
+    for rate_date, rate_from, rate_to in triangulated_rates.iterator():
+        if newest_date is None:
+            newest_date = rate_date
+        elif rate_date != newest_date:
+            break
+        yield rate_date, rate_to / rate_from, "triangulated"
+
+
+async def _aiter_resolved_rates(
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+) -> AsyncIterator[Tuple[datetime.date, Decimal, str]]:
+    """Async _iter_resolved_rates()"""
+    oldest_acceptable_rate = date - datetime.timedelta(
+        days=settings.MAX_EXCHANGE_RATE_AGE
+    )
+
+    for base_currency, currency in (
+        (currency_from, currency_to),
+        (currency_to, currency_from),
+    ):
+        direct_rate = await _rates_in_window(
+            base_currency, [currency], oldest_acceptable_rate, date
+        ).afirst()
+        if direct_rate:
+            yield _direct_rate(direct_rate, currency_to)
+
+    triangulated_rates = _triangulated_rates(
+        currency_from, currency_to, oldest_acceptable_rate, date
+    )
+    newest_date = None
+    async for rate_date, rate_from, rate_to in triangulated_rates:
+        if newest_date is None:
+            newest_date = rate_date
+        elif rate_date != newest_date:
+            break
+        yield rate_date, rate_to / rate_from, "triangulated"
+
+
+def _direct_rate(
+    exchange_rate: ExchangeRate,
+    currency_to: str,
+) -> Tuple[datetime.date, Decimal, str]:
+    rate = exchange_rate.rate
+    if exchange_rate.base_currency == currency_to:
+        rate = 1 / rate
+    return exchange_rate.date, rate, "direct"
+
+
+def _triangulated_rates(
+    currency_from: str,
+    currency_to: str,
+    oldest: datetime.date,
+    newest: datetime.date,
+) -> QuerySet:
+    """(date, rate_from, rate_to) for every base currency and date between
+    oldest and newest that has rates for both currency_from and currency_to,
+    newest first.
+
+    This is a single query, joining the ExchangeRate table to itself.
+    """
+    rates_to = ExchangeRate.objects.filter(
+        base_currency=OuterRef("base_currency"),
+        currency=currency_to,
+        date=OuterRef("date"),
+    )
+    return (
+        ExchangeRate.objects.filter(
+            currency=currency_from,
+            date__gte=oldest,
+            date__lte=newest,
         )
+        .annotate(rate_to=Subquery(rates_to.values("rate")[:1]))
+        .filter(rate_to__isnull=False)
         .order_by("-date")
-        .first()
+        .values_list("date", "rate", "rate_to")
     )
-    if direct_rate:
-        rate = direct_rate.rate
-        if direct_rate.base_currency == currency_to:
-            rate = 1 / rate
-        yield direct_rate.date, rate
-
-    for base_currency in _possible_base_currencies():
-        rate_date = None
-        rate_from = None
-        rate_to = None
-        for ex_rate in (
-            ExchangeRate.objects.filter(
-                date__lte=date, date__gte=oldest_acceptable_rate
-            )
-            .filter(
-                Q(currency=currency_from, base_currency=base_currency)
-                | Q(currency=currency_to, base_currency=base_currency)
-            )
-            .order_by("-date")
-        ):
-            if rate_date != ex_rate.date:
-                rate_date = ex_rate.date
-                rate_from = ex_rate.rate if ex_rate.currency == currency_from else None
-                rate_to = ex_rate.rate if ex_rate.currency == currency_to else None
-            elif ex_rate.currency == currency_from and rate_to is not None:
-                rate_from = ex_rate.rate
-                assert rate_date is not None
-                yield rate_date, rate_to / rate_from
-                continue
-            elif ex_rate.currency == currency_to and rate_from is not None:
-                rate_to = ex_rate.rate
-                assert rate_date is not None
-                yield rate_date, rate_to / rate_from
-                continue
 
 
 def exchange(
@@ -120,8 +470,42 @@ def exchange(
         rate_date = date
         rate = Decimal(1)
     else:
-        rate_date, rate = latest_rate(currency_from, currency_to, date)
+        scope = _rate_scope.get()
+        if scope is not None and scope.date == date:
+            rate_date, rate = scope.latest_rate(currency_from, currency_to)
+        else:
+            rate_date, rate = latest_rate(currency_from, currency_to, date)
+
+    return _exchange_at(amount, currency_from, currency_to, date, rate_date, rate)
+
+
+async def aexchange(
+    amount: Decimal,
+    currency_from: str,
+    currency_to: str,
+    date: Optional[datetime.date] = None,
+) -> Decimal:
+    """Async exchange(), for async views. Requires Django >= 4.1."""
+    if date is None:
+        date = datetime.date.today()
+
+    if currency_from == currency_to:
+        rate_date = date
+        rate = Decimal(1)
+    else:
+        rate_date, rate = await alatest_rate(currency_from, currency_to, date)
+
+    return _exchange_at(amount, currency_from, currency_to, date, rate_date, rate)
+
 
+def _exchange_at(
+    amount: Decimal,
+    currency_from: str,
+    currency_to: str,
+    date: datetime.date,
+    rate_date: datetime.date,
+    rate: Decimal,
+) -> Decimal:
     amount *= rate
     if date - rate_date > datetime.timedelta(days=settings.MAX_EXCHANGE_RATE_AGE):
         raise ExchangeRateUnavailable(
@@ -130,3 +514,167 @@ def exchange(
         )
 
     return amount.quantize(TWOPLACES)
+
+
+class _RateScope:
+    """Exchange rates as of date, fetched on first use, in a single query"""
+
+    def __init__(self, date: datetime.date) -> None:
+        self.date = date
+        self._table: Optional[RateTable] = None
+
+    def latest_rate(
+        self, currency_from: str, currency_to: str
+    ) -> Tuple[datetime.date, Decimal]:
+        if self._table is None:
+            self._table = get_rate_table()
+        if self._table is None:
+            oldest_acceptable_rate = self.date - datetime.timedelta(
+                days=settings.MAX_EXCHANGE_RATE_AGE
+            )
+            self._table = RateTable.from_queryset(
+                ExchangeRate.objects.filter(
+                    date__lte=self.date, date__gte=oldest_acceptable_rate
+                )
+            )
+        rate = self._table.latest_rate(currency_from, currency_to, self.date)
+        if rate is None:
+            raise _no_rate_available(currency_from, currency_to, self.date)
+        return rate
+
+
+_rate_scope: "ContextVar[Optional[_RateScope]]" = ContextVar("rate_scope", default=None)
+
+
+@contextmanager
+def prefetch_rates(date: Optional[datetime.date] = None) -> Iterator[None]:
+    """Within this context, exchange() as of date (default: today) uses
+    rates fetched in a single query, on first use.
+
+    All the rates within MAX_EXCHANGE_RATE_AGE of date are fetched, so this
+    is best suited to rendering many conversions, e.g. a page of amounts
+    converted with the exchange template filter.
+
+    Can also be used as a decorator.
+    """
+    if date is None:
+        date = datetime.date.today()
+    token = _rate_scope.set(_RateScope(date))
+    try:
+        yield
+    finally:
+        _rate_scope.reset(token)
+
+
+ExchangeItem = Tuple[Decimal, str, str, Optional[datetime.date]]
+
+
+def exchange_many(
+    items: Iterable[ExchangeItem],
+    raise_exceptions: bool = True,
+) -> List[Union[Decimal, ExchangeRateUnavailable]]:
+    """Exchange many (amount, currency_from, currency_to, date) items.
+
+    Returns the exchanged amounts, in the same order as items. The rates
+    required are fetched in a single query, rather than one query per item.
+
+    If raise_exceptions is False, items that can't be exchanged produce
+    ExchangeRateUnavailable exceptions in the results, instead of raising
+    them.
+    """
+    today = datetime.date.today()
+    dated_items: List[Tuple[Decimal, str, str, datetime.date]] = [
+        (amount, currency_from, currency_to, today if date is None else date)
+        for amount, currency_from, currency_to, date in items
+    ]
+
+    table = get_rate_table()
+    if table is None:
+        table = _fetch_rate_table(
+            (currency_from, currency_to, date)
+            for amount, currency_from, currency_to, date in dated_items
+        )
+
+    rates: Dict[
+        Tuple[str, str, datetime.date], Optional[Tuple[datetime.date, Decimal]]
+    ] = {}
+    results: List[Union[Decimal, ExchangeRateUnavailable]] = []
+    for amount, currency_from, currency_to, date in dated_items:
+        key = (currency_from, currency_to, date)
+        if key not in rates:
+            rates[key] = table.latest_rate(currency_from, currency_to, date)
+        rate = rates[key]
+        if rate is None:
+            error = _no_rate_available(currency_from, currency_to, date)
+            if raise_exceptions:
+                raise error
+            results.append(error)
+            continue
+        amount *= rate[1]
+        results.append(amount.quantize(TWOPLACES))
+    return results
+
+
+def rate_series(
+    currency_from: str,
+    currency_to: str,
+    start: datetime.date,
+    end: datetime.date,
+) -> Iterator[Tuple[datetime.date, Optional[Decimal]]]:
+    """The latest rate from currency_from to currency_to as of each date,
+    from start to end (inclusive).
+
+    Yields (date, rate) for every day, carrying rates forward over
+    weekends and holidays, up to MAX_EXCHANGE_RATE_AGE. The rate is None
+    for days that have no rate available. The rates required are fetched
+    in a single query, on first iteration, rather than one per day.
+    """
+    if start > end:
+        return
+    table = get_rate_table()
+    if table is None:
+        table = _fetch_rate_table(
+            [(currency_from, currency_to, start), (currency_from, currency_to, end)]
+        )
+    day = datetime.timedelta(days=1)
+    date = start
+    while date <= end:
+        rate = table.latest_rate(currency_from, currency_to, date)
+        yield date, None if rate is None else rate[1]
+        date += day
+
+
+def _fetch_rate_table(
+    conversions: Iterable[Tuple[str, str, datetime.date]],
+) -> RateTable:
+    """Fetch a RateTable covering all the (currency_from, currency_to, date)
+    conversions.
+
+    Direct and triangulated conversions only ever use rates for the source
+    and target currencies, so we only need those, for the range of dates
+    that each currency is exchanged on.
+    """
+    date_ranges: Dict[str, Tuple[datetime.date, datetime.date]] = {}
+    for currency_from, currency_to, date in conversions:
+        if currency_from == currency_to:
+            continue
+        for currency in (currency_from, currency_to):
+            first, last = date_ranges.get(currency, (date, date))
+            date_ranges[currency] = (min(first, date), max(last, date))
+
+    if not date_ranges:
+        return RateTable()
+
+    max_age = datetime.timedelta(days=settings.MAX_EXCHANGE_RATE_AGE)
+    currencies_by_range: Dict[Tuple[datetime.date, datetime.date], List[str]] = {}
+    for currency, date_range in date_ranges.items():
+        currencies_by_range.setdefault(date_range, []).append(currency)
+
+    query = Q()
+    for (first, last), currencies in currencies_by_range.items():
+        query |= Q(
+            currency__in=currencies,
+            date__gte=first - max_age,
+            date__lte=last,
+        )
+    return RateTable.from_queryset(ExchangeRate.objects.filter(query))
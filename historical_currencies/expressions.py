@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+from typing import Union
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import (
+    Case,
+    DateField,
+    DecimalField,
+    Expression,
+    F,
+    Func,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast
+
+from historical_currencies.models import ExchangeRate
+
+
+class _Ratio(Func):
+    """Decimal division, even of integers on SQLite"""
+
+    arg_joiner = " / "
+    template = "(%(expressions)s)"
+    output_field = DecimalField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite stores integral NUMERIC values as INTEGERs, and would
+        # perform integer division
+        return self.as_sql(
+            compiler, connection, template="(1.0 * %(expressions)s)", **extra_context
+        )
+
+
+def _rate_window(date: Union[str, datetime.date]) -> Q:
+    """Filter ExchangeRates to those acceptable as of date (an outer field
+    name, or a constant date).
+    """
+    max_age = datetime.timedelta(days=settings.MAX_EXCHANGE_RATE_AGE)
+    if isinstance(date, str):
+        return Q(
+            date__lte=OuterRef(date),
+            date__gte=Cast(OuterRef(date) - max_age, output_field=DateField()),
+        )
+    return Q(date__lte=date, date__gte=date - max_age)
+
+
+def exchange_rate(
+    currency: str,
+    date: Union[str, datetime.date],
+    currency_to: str,
+) -> Expression:
+    """An expression for the latest exchange rate from the currency field to
+    currency_to, as of the date field (or a constant date).
+
+    The rules match historical_currencies.exchange.latest_rate: the most
+    recent direct conversion, or indirect conversion via a single base
+    currency. This is a single correlated subquery. It is NULL if no rate
+    is available.
+
+    Requires Django >= 3.0, which resolves outer references nested in
+    conditional expressions.
+    """
+    if django.VERSION < (3, 0):
+        raise ImproperlyConfigured("exchange_rate() requires Django >= 3.0")
+    # Every candidate rate has an "anchor" row: the rate for a direct
+    # conversion, the rate to convert back from currency_to, or the
+    # currency_to rate for a triangulation, with its currency rate as the
+    # divisor.
+    rates_from = ExchangeRate.objects.filter(
+        base_currency=OuterRef("base_currency"),
+        currency=OuterRef(OuterRef(currency)),
+        date=OuterRef("date"),
+    )
+    candidates = (
+        ExchangeRate.objects.filter(_rate_window(date))
+        .filter(
+            Q(currency=currency_to)
+            | Q(base_currency=currency_to, currency=OuterRef(currency))
+        )
+        .annotate(
+            cross_rate=Case(
+                When(base_currency=OuterRef(currency), then=F("rate")),
+                When(base_currency=currency_to, then=_Ratio(Value(1), F("rate"))),
+                default=_Ratio(F("rate"), Subquery(rates_from.values("rate")[:1])),
+                output_field=DecimalField(),
+            )
+        )
+        .filter(cross_rate__isnull=False)
+        .order_by("-date", "-cross_rate")
+    )
+    return Case(
+        When(**{currency: currency_to}, then=Value(Decimal(1))),
+        default=Subquery(candidates.values("cross_rate")[:1]),
+        output_field=DecimalField(),
+    )
+
+
+def exchanged_amount(
+    amount: str,
+    currency: str,
+    date: Union[str, datetime.date],
+    currency_to: str,
+) -> Expression:
+    """An expression for the amount field, in the currency field, exchanged
+    to currency_to as of the date field (or a constant date).
+
+    For example, to total invoices in EUR, in the database:
+
+        Invoice.objects.aggregate(
+            total=Sum(exchanged_amount("amount", "currency", "date", "EUR"))
+        )
+
+    Unlike historical_currencies.exchange.exchange, the result isn't
+    rounded, and is NULL if no rate is available. Requires Django >= 3.0.
+    """
+    return F(amount) * exchange_rate(currency, date, currency_to)
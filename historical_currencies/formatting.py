@@ -1,10 +1,45 @@
+import threading
 from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from iso4217 import Currency
 
+# currency_code: (code, quantization), built on first use
+_formats: Optional[Dict[str, Tuple[str, Optional[Decimal]]]] = None
+_formats_lock = threading.Lock()
+
+
+def _currency_format(currency: Currency) -> Tuple[str, Optional[Decimal]]:
+    # Some special currencies (e.g. XAU) have no minor unit
+    if currency.exponent is None:
+        return currency.code, None
+    return currency.code, Decimal(10) ** -currency.exponent
+
+
+def _get_format(currency_code: str) -> Tuple[str, Optional[Decimal]]:
+    global _formats
+    formats = _formats
+    if formats is None:
+        with _formats_lock:
+            if _formats is None:
+                _formats = {
+                    currency.code: _currency_format(currency) for currency in Currency
+                }
+            formats = _formats
+    try:
+        return formats[currency_code]
+    except KeyError:
+        # Raises ValueError for unknown currencies
+        return _currency_format(Currency(currency_code))
+
 
 def render_amount(amount, currency_code):
-    currency = Currency(currency_code)
-    quantization = Decimal(10) ** -currency.exponent
-    quantized = amount.quantize(quantization)
-    return f"{quantized} {currency.code}"
+    code, quantization = _get_format(currency_code)
+    if quantization is not None:
+        amount = amount.quantize(quantization)
+    return f"{amount} {code}"
+
+
+def render_amounts(amounts: Iterable[Tuple[Decimal, str]]) -> List[str]:
+    """render_amount() each (amount, currency_code)"""
+    return [render_amount(amount, currency_code) for amount, currency_code in amounts]
@@ -0,0 +1,235 @@
+"""Writing imported exchange rates to the database."""
+
+import datetime
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple
+from uuid import uuid4
+
+from django.db import connection, transaction
+
+from historical_currencies.crossrates import get_cross_pairs, refresh_cross_rates
+from historical_currencies.models import ExchangeRate, StagedExchangeRate
+from historical_currencies.providers import RateProvider
+from historical_currencies.signals import exchange_rates_updated
+
+RATE_FIELD = ExchangeRate._meta.get_field("rate")
+# Characters that must be escaped in COPY's text format
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class _CopyReader:
+    """A file-like object for psycopg2's copy_expert(), that formats rows in
+    COPY's text format as they are read, instead of buffering them all.
+    """
+
+    def __init__(self, rows: Iterable[Tuple]) -> None:
+        self.lines: Iterator[str] = (
+            "\t".join(str(value).translate(COPY_ESCAPES) for value in row) + "\n"
+            for row in rows
+        )
+        self.buffer = ""
+        # psycopg2 replaces errors in read() with QueryCanceled
+        self.error: Optional[Exception] = None
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            try:
+                line = next(self.lines, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _to_date(value) -> datetime.date:
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+class RatePipeline:
+    """Import rates from a RateProvider, atomically.
+
+    Rates are loaded into the StagedExchangeRate table (with COPY on
+    PostgreSQL, and in batches of batch_size elsewhere), then merged into
+    ExchangeRate with set-based statements, in a single transaction. So
+    readers never see a partial import, and a failed import leaves
+    ExchangeRate untouched.
+
+    By default, rates that already exist are left as they are. If upsert is
+    True, existing rates are replaced with the imported rate, when it
+    differs. Where a rate is staged more than once, the last one wins.
+    """
+
+    def __init__(self, upsert: bool = False, batch_size: int = 1000) -> None:
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.batch = uuid4().hex
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        # The oldest date with an updated rate
+        self.updated_since: Optional[datetime.date] = None
+        # The oldest date with a rate written (inserted or updated)
+        self.written_since: Optional[datetime.date] = None
+
+    def run(self, provider: RateProvider) -> None:
+        """Stage and merge the provider's rates, then bring the
+        materialized cross rates up to date.
+        """
+        try:
+            self.stage(provider.iter_rates())
+            self.merge()
+        finally:
+            self.discard()
+        if get_cross_pairs():
+            refresh_cross_rates(since=self.written_since)
+
+    def stage(self, rates: Iterable[ExchangeRate]) -> None:
+        rows = (
+            (
+                self.batch,
+                _to_date(rate.date),
+                rate.currency,
+                rate.base_currency,
+                RATE_FIELD.to_python(rate.rate),
+            )
+            for rate in rates
+        )
+        if connection.vendor == "postgresql":
+            self._copy(rows)
+            return
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            StagedExchangeRate.objects.bulk_create(
+                StagedExchangeRate(
+                    batch=batch_id,
+                    date=date,
+                    currency=currency,
+                    base_currency=base_currency,
+                    rate=rate,
+                )
+                for batch_id, date, currency, base_currency, rate in batch
+            )
+
+    def _copy(self, rows: Iterable[Tuple]) -> None:
+        sql = (
+            f"COPY {_table(StagedExchangeRate)} "
+            "(batch, date, currency, base_currency, rate) FROM STDIN"
+        )
+        # A provider error aborts the COPY, and with it the transaction, so
+        # roll back to a savepoint when called within a transaction.
+        with transaction.atomic(), connection.cursor() as cursor:
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, "copy"):  # psycopg 3
+                with raw_cursor.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                return
+            # psycopg2
+            reader = _CopyReader(rows)
+            try:
+                raw_cursor.copy_expert(sql, reader)
+            except Exception:
+                if reader.error is not None:
+                    raise reader.error
+                raise
+
+    def merge(self) -> None:
+        staged = _table(StagedExchangeRate)
+        target = _table(ExchangeRate)
+        matches = (
+            f"{target}.date = {staged}.date "
+            f"AND {target}.currency = {staged}.currency "
+            f"AND {target}.base_currency = {staged}.base_currency"
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Later rates replace earlier rates for the same key. MySQL can't
+            # DELETE with a subquery on the same table, so find them first.
+            cursor.execute(
+                f"SELECT id FROM {staged} WHERE batch = %s AND id NOT IN ("
+                f"SELECT MAX(id) FROM {staged} WHERE batch = %s "
+                "GROUP BY date, currency, base_currency)",
+                [self.batch, self.batch],
+            )
+            replaced = [pk for (pk,) in cursor.fetchall()]
+            for i in range(0, len(replaced), self.batch_size):
+                StagedExchangeRate.objects.filter(
+                    pk__in=replaced[i : i + self.batch_size]
+                ).delete()
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {staged} WHERE batch = %s", [self.batch]
+            )
+            (staged_count,) = cursor.fetchone()
+
+            if self.upsert:
+                cursor.execute(
+                    f"SELECT MIN({staged}.date) FROM {staged} "
+                    f"INNER JOIN {target} ON {matches} "
+                    f"WHERE {staged}.batch = %s AND {target}.rate <> {staged}.rate",
+                    [self.batch],
+                )
+                (self.updated_since,) = cursor.fetchone()
+            if self.updated_since is not None:
+                cursor.execute(
+                    f"UPDATE {target} SET rate = ("
+                    f"SELECT {staged}.rate FROM {staged} "
+                    f"WHERE {staged}.batch = %s AND {matches}"
+                    f") WHERE EXISTS ("
+                    f"SELECT 1 FROM {staged} WHERE {staged}.batch = %s "
+                    f"AND {matches} AND {target}.rate <> {staged}.rate)",
+                    [self.batch, self.batch],
+                )
+                self.updated = cursor.rowcount
+
+            new_rates = (
+                f"FROM {staged} WHERE {staged}.batch = %s AND NOT EXISTS ("
+                f"SELECT 1 FROM {target} WHERE {matches})"
+            )
+            cursor.execute(f"SELECT MIN({staged}.date) {new_rates}", [self.batch])
+            (inserted_since,) = cursor.fetchone()
+            if inserted_since is not None:
+                cursor.execute(
+                    f"INSERT INTO {target} (date, currency, base_currency, rate) "
+                    f"SELECT {staged}.date, {staged}.currency, "
+                    f"{staged}.base_currency, {staged}.rate {new_rates}",
+                    [self.batch],
+                )
+                self.inserted = cursor.rowcount
+            self.unchanged = staged_count - self.inserted - self.updated
+
+        # SQLite returns dates from aggregates as strings
+        if self.updated_since is not None:
+            self.updated_since = _to_date(self.updated_since)
+        if inserted_since is not None:
+            inserted_since = _to_date(inserted_since)
+        written = [date for date in (self.updated_since, inserted_since) if date]
+        self.written_since = min(written, default=None)
+        if written:
+            exchange_rates_updated.send(sender=ExchangeRate, since=self.written_since)
+
+    def discard(self) -> None:
+        """Delete this import's staged rates"""
+        StagedExchangeRate.objects.filter(batch=self.batch).delete()
+
+    def summary(self) -> str:
+        return (
+            f"Inserted {self.inserted}, updated {self.updated}, "
+            f"unchanged {self.unchanged} rates"
+        )
+
+
+def _table(model) -> str:
+    return connection.ops.quote_name(model._meta.db_table)
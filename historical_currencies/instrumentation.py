@@ -0,0 +1,224 @@
+"""Instrumentation of exchange rate resolution.
+
+latest_rate() and alatest_rate() send the rate_resolved and
+rate_unavailable signals, when they have receivers. RateMetrics aggregates them into counters and latency
+histograms, that can be exported to a metrics system:
+
+    metrics = RateMetrics()
+    metrics.connect()
+    ...
+    metrics.snapshot()
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+from django.db import connection
+
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.signals import rate_resolved, rate_unavailable
+
+
+class Resolution:
+    """What happened while resolving a single exchange rate"""
+
+    def __init__(self) -> None:
+        self.cache: Optional[str] = None
+        self.source: Optional[str] = None
+        self.method: Optional[str] = None
+        self.queries: Optional[int] = 0
+
+
+_resolution: "ContextVar[Optional[Resolution]]" = ContextVar("resolution", default=None)
+
+
+def enabled() -> bool:
+    """Are there any receivers for the instrumentation signals?"""
+    return rate_resolved.has_listeners() or rate_unavailable.has_listeners()
+
+
+def record(**fields: Any) -> None:
+    """Record fields of the Resolution in progress, if instrumented"""
+    resolution = _resolution.get()
+    if resolution is not None:
+        for name, value in fields.items():
+            setattr(resolution, name, value)
+
+
+@contextmanager
+def resolving(
+    sender: Any,
+    currency_from: str,
+    currency_to: str,
+    date: Any,
+    count_queries: bool = True,
+) -> Iterator[Resolution]:
+    """Instrument resolving a rate, sending rate_resolved when done.
+
+    If count_queries is False, queries is reported as None.
+    """
+    resolution = Resolution()
+    if not count_queries:
+        resolution.queries = None
+
+    def count_query(execute, sql, params, many, context):
+        resolution.queries += 1
+        return execute(sql, params, many, context)
+
+    token = _resolution.set(resolution)
+    available = True
+    start = time.perf_counter()
+    try:
+        if count_queries:
+            with connection.execute_wrapper(count_query):
+                yield resolution
+        else:
+            yield resolution
+    except ExchangeRateUnavailable as e:
+        available = False
+        rate_unavailable.send(
+            sender=sender,
+            currency_from=currency_from,
+            currency_to=currency_to,
+            date=date,
+            exception=e,
+        )
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _resolution.reset(token)
+        rate_resolved.send(
+            sender=sender,
+            currency_from=currency_from,
+            currency_to=currency_to,
+            date=date,
+            cache=resolution.cache,
+            source=resolution.source,
+            method=resolution.method,
+            queries=resolution.queries,
+            duration=duration,
+            available=available,
+        )
+
+
+CACHE_COUNTERS = {
+    "hit": "cache_hits",
+    "shared_hit": "cache_shared_hits",
+    "miss": "cache_misses",
+    "coalesced": "cache_coalesced",
+}
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram:
+    """A latency histogram, with cumulative buckets (like Prometheus)"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            "buckets": dict(zip((*self.buckets, float("inf")), cumulative)),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class RateMetrics:
+    """Counters and latency histograms of exchange rate resolution.
+
+    Counters:
+    * resolutions: latest_rate() calls.
+    * cache_hits, cache_shared_hits, cache_misses, cache_coalesced.
+    * queries: Database queries made (by synchronous lookups).
+    * source_<source>: Cache misses resolved from each source.
+    * method_<method>: Resolutions by method (direct, triangulated).
+    * unavailable: ExchangeRateUnavailable raised.
+
+    Latency histograms, by cache outcome: hit, shared_hit, miss, coalesced.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: Counter = Counter()
+            self.latency: Dict[str, Histogram] = {}
+
+    def connect(self) -> None:
+        rate_resolved.connect(self.rate_resolved, dispatch_uid=str(id(self)))
+
+    def disconnect(self) -> None:
+        rate_resolved.disconnect(dispatch_uid=str(id(self)))
+
+    def rate_resolved(
+        self,
+        cache: Optional[str],
+        source: Optional[str],
+        method: Optional[str],
+        queries: Optional[int],
+        duration: float,
+        available: bool,
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            counters = self.counters
+            counters["resolutions"] += 1
+            if queries is not None:
+                counters["queries"] += queries
+            if cache is not None:
+                counters[CACHE_COUNTERS[cache]] += 1
+            if source is not None:
+                counters[f"source_{source}"] += 1
+            if method is not None:
+                counters[f"method_{method}"] += 1
+            if not available:
+                counters["unavailable"] += 1
+            histogram = self.latency.get(cache or "none")
+            if histogram is None:
+                histogram = self.latency[cache or "none"] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def hit_ratio(self) -> Optional[float]:
+        """The fraction of resolutions answered by either cache, or by
+        waiting for a concurrent miss
+        """
+        with self._lock:
+            hits = (
+                self.counters["cache_hits"]
+                + self.counters["cache_shared_hits"]
+                + self.counters["cache_coalesced"]
+            )
+            total = hits + self.counters["cache_misses"]
+        return hits / total if total else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latency": {
+                    cache: histogram.snapshot()
+                    for cache, histogram in self.latency.items()
+                },
+            }
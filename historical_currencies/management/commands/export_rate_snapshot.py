@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from historical_currencies.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Export all exchange rates to a memory-mappable snapshot file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            help="Snapshot file to write (default: settings.EXCHANGE_RATE_SNAPSHOT)",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"] or getattr(settings, "EXCHANGE_RATE_SNAPSHOT", None)
+        if not path:
+            raise CommandError(
+                "A path must be provided, or settings.EXCHANGE_RATE_SNAPSHOT"
+            )
+        rates = write_snapshot(path)
+        self.stdout.write(f"Exported {rates} rates to {path}")
@@ -1,62 +1,108 @@
-import xml.etree.ElementTree as ET
-from urllib.request import urlopen
+import datetime
 
 from django.core.management.base import BaseCommand, CommandError
 
+from historical_currencies.importing import RatePipeline
 from historical_currencies.models import ExchangeRate
+from historical_currencies.providers import ECBProvider
 
-NAMESPACE = {
-    "eurofxref": "http://www.ecb.int/vocabulary/2002-08-01/eurofxref",
-    "gesmes": "http://www.gesmes.org/xml/2002-08-01",
-}
+DAILY_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
+HIST_90D_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.xml"
+HISTORICAL_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml"
 
 
 class Command(BaseCommand):
     help = "Import daily or historical exchange rate data from the ECB"
 
     def add_arguments(self, parser):
-        parser.add_argument(
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument(
             "--url",
             metavar="URL",
             help="Load from a custom URL",
         )
-        parser.add_argument(
+        source.add_argument(
             "--daily",
             dest="url",
             action="store_const",
-            const="https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml",
+            const=DAILY_URL,
             help="Load the daily exchange rates",
         )
-        parser.add_argument(
+        source.add_argument(
             "--historical",
             dest="url",
             action="store_const",
-            const="https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml",
+            const=HISTORICAL_URL,
             help="Load the full set of historical exchange rates",
         )
+        source.add_argument(
+            "--update",
+            action="store_true",
+            help=(
+                "Load exchange rates since the latest in the database, from "
+                "the smallest feed that covers them"
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            metavar="N",
+            type=int,
+            default=1000,
+            help="Stage rates in the database in batches of N (default: 1000)",
+        )
+        parser.add_argument(
+            "--upsert",
+            action="store_true",
+            help="Replace existing rates that have been revised",
+        )
 
-    def iter_rates(self, url):
-        with urlopen(url) as f:
-            data = ET.parse(f)
-        root = data.getroot()
-        for day in root.iterfind("./eurofxref:Cube/eurofxref:Cube[@time]", NAMESPACE):
-            date = day.get("time")
-            for rate in day.iterfind("eurofxref:Cube", NAMESPACE):
-                currency = rate.get("currency")
-                exchange_rate = rate.get("rate")
-                yield ExchangeRate(
-                    date=date,
-                    base_currency="EUR",
-                    currency=currency,
-                    rate=exchange_rate,
-                )
+    def update_url(self, latest, today):
+        """The smallest feed containing all rates published since latest"""
+        if latest is None:
+            return HISTORICAL_URL
+        # The daily feed only contains the most recent publication
+        missing_weekdays = sum(
+            1
+            for days in range(1, (today - latest).days + 1)
+            if (latest + datetime.timedelta(days=days)).weekday() < 5
+        )
+        if missing_weekdays <= 1:
+            return DAILY_URL
+        # With a few days' margin, to be safe
+        if (today - latest).days <= 85:
+            return HIST_90D_URL
+        return HISTORICAL_URL
+
+    def iter_rates(self, url, since=None):
+        """Stream ExchangeRates from the ECB XML at url (see ECBProvider)"""
+        return ECBProvider(url, since=since).iter_rates()
 
     def handle(self, *args, **options):
-        if not options["url"]:
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        url = options["url"]
+        since = None
+        if options["update"]:
+            latest = (
+                ExchangeRate.objects.filter(base_currency="EUR")
+                .order_by("-date")
+                .first()
+            )
+            if latest is not None:
+                since = latest.date
+            today = datetime.date.today()
+            if since is not None and since >= today:
+                self.stdout.write("Already up to date")
+                return
+            url = self.update_url(since, today)
+        if not url:
             raise CommandError(
-                "A URL must be provided with --daily, --historical, or --url"
+                "A URL must be provided with --daily, --historical, --update, "
+                "or --url"
             )
-        ExchangeRate.objects.bulk_create(
-            self.iter_rates(options["url"]),
-            ignore_conflicts=True,
+        pipeline = RatePipeline(
+            upsert=options["upsert"], batch_size=options["batch_size"]
         )
+        pipeline.run(ECBProvider(url, since=since))
+        if options["upsert"]:
+            self.stdout.write(pipeline.summary())
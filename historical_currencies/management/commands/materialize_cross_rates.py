@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from historical_currencies.crossrates import (
+    cross_rate_status,
+    get_cross_pairs,
+    refresh_cross_rates,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Materialize cross rates for the currency pairs in "
+        "settings.EXCHANGE_RATE_CROSS_PAIRS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild all cross rates, rather than only the new dates",
+        )
+        parser.add_argument(
+            "--status",
+            action="store_true",
+            help="Report how fresh the materialized cross rates are",
+        )
+
+    def handle(self, *args, **options):
+        if not get_cross_pairs():
+            raise CommandError("No EXCHANGE_RATE_CROSS_PAIRS configured")
+        if options["status"]:
+            for status in cross_rate_status():
+                pair = f"{status['currency_from']}-{status['currency_to']}"
+                if status["lag"] is None:
+                    self.stdout.write(f"{pair}: not materialized")
+                    continue
+                freshness = "fresh" if status["lag"] == 0 else "stale"
+                if status["stale_since"] is not None:
+                    freshness = f"stale since {status['stale_since']}"
+                self.stdout.write(
+                    f"{pair}: materialized through "
+                    f"{status['materialized_through']}, refreshed at "
+                    f"{status['refreshed_at'].isoformat()}, "
+                    f"{status['lag']} days behind ({freshness})"
+                )
+            return
+        for (currency_from, currency_to), count in refresh_cross_rates(
+            full=options["full"]
+        ):
+            self.stdout.write(
+                f"{currency_from}-{currency_to}: materialized {count} rates"
+            )
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("historical_currencies", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="exchangerate",
+            index=models.Index(
+                fields=["base_currency", "currency", "-date"],
+                name="exchangerate_pair_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("historical_currencies", "0002_exchangerate_pair_date_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CrossExchangeRate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("currency_from", models.CharField(max_length=3)),
+                ("currency_to", models.CharField(max_length=3)),
+                ("rate", models.DecimalField(decimal_places=15, max_digits=30)),
+            ],
+            options={
+                "unique_together": {("currency_from", "currency_to", "date")},
+            },
+        ),
+        migrations.CreateModel(
+            name="CrossExchangeRateStatus",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("currency_from", models.CharField(max_length=3)),
+                ("currency_to", models.CharField(max_length=3)),
+                ("materialized_through", models.DateField()),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name_plural": "cross exchange rate statuses",
+                "unique_together": {("currency_from", "currency_to")},
+            },
+        ),
+    ]
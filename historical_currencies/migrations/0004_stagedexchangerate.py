@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("historical_currencies", "0003_crossexchangerate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StagedExchangeRate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("batch", models.CharField(max_length=32)),
+                ("date", models.DateField()),
+                ("currency", models.CharField(max_length=3)),
+                ("base_currency", models.CharField(max_length=3)),
+                ("rate", models.DecimalField(decimal_places=5, max_digits=15)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["batch", "date", "currency", "base_currency"],
+                        name="stagedexchangerate_batch_idx",
+                    )
+                ],
+            },
+        ),
+    ]
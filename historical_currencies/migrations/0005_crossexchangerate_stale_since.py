@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("historical_currencies", "0004_stagedexchangerate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crossexchangeratestatus",
+            name="stale_since",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="crossexchangerate",
+            name="rate",
+            field=models.DecimalField(decimal_places=22, max_digits=38),
+        ),
+    ]
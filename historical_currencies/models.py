@@ -1,8 +1,82 @@
 from datetime import date, timedelta
+from typing import Optional
 
 from django.conf import settings
 from django.core.checks import Error, Tags, register
 from django.db import models
+from django.db.models import Min
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from historical_currencies.signals import exchange_rates_updated
+
+
+def _oldest(dates) -> Optional[date]:
+    """The oldest of dates (which may be ISO format strings), or None"""
+    field = ExchangeRate._meta.get_field("date")
+    return min(
+        (field.to_python(value) for value in dates if value is not None),
+        default=None,
+    )
+
+
+def _tracks_dates() -> bool:
+    """Do exchange_rates_updated receivers need the dates written?
+
+    Only materialized cross rates do, so querying for them is skipped
+    without any.
+    """
+    return bool(getattr(settings, "EXCHANGE_RATE_CROSS_PAIRS", None))
+
+
+class ExchangeRateQuerySet(models.QuerySet):
+    """QuerySet that sends exchange_rates_updated after bulk modifications"""
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        since = _oldest(obj.date for obj in objs) if _tracks_dates() else None
+        exchange_rates_updated.send(sender=self.model, since=since)
+        return objs
+
+    bulk_create.alters_data = True  # type: ignore[attr-defined]
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        since = None
+        if _tracks_dates():
+            dates = [obj.date for obj in objs]
+            if "date" in fields:
+                dates.append(self._oldest_date(pk__in=[obj.pk for obj in objs]))
+            since = _oldest(dates)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        exchange_rates_updated.send(sender=self.model, since=since)
+        return rows
+
+    bulk_update.alters_data = True  # type: ignore[attr-defined]
+
+    def update(self, **kwargs):
+        since = None
+        if _tracks_dates():
+            since = _oldest([self._oldest_date(), kwargs.get("date")])
+        rows = super().update(**kwargs)
+        exchange_rates_updated.send(sender=self.model, since=since)
+        return rows
+
+    update.alters_data = True  # type: ignore[attr-defined]
+
+    def delete(self):
+        since = self._oldest_date() if _tracks_dates() else None
+        # Without a post_delete receiver, Django can delete in a single
+        # query, rather than fetching and deleting each row
+        deleted = super().delete()
+        exchange_rates_updated.send(sender=self.model, since=since)
+        return deleted
+
+    delete.alters_data = True  # type: ignore[attr-defined]
+    delete.queryset_only = True  # type: ignore[attr-defined]
+
+    def _oldest_date(self, **filters) -> Optional[date]:
+        return self.filter(**filters).aggregate(oldest=Min("date"))["oldest"]
 
 
 class ExchangeRate(models.Model):
@@ -11,14 +85,102 @@ class ExchangeRate(models.Model):
     base_currency = models.CharField(max_length=3)
     rate = models.DecimalField(decimal_places=5, max_digits=15)
 
+    objects = ExchangeRateQuerySet.as_manager()
+
     class Meta:
         unique_together = [
             ["date", "currency", "base_currency"],
         ]
+        indexes = [
+            # For latest rate lookups
+            models.Index(
+                fields=["base_currency", "currency", "-date"],
+                name="exchangerate_pair_date_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Exchange Rate: {self.base_currency}-{self.currency} @ {self.date}: {self.rate}"
 
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        exchange_rates_updated.send(sender=type(self), since=_oldest([self.date]))
+        return deleted
+
+
+class CrossExchangeRate(models.Model):
+    """Materialized latest_rate() results for a currency pair.
+
+    One row per date that has a direct or triangulated rate from
+    currency_from to currency_to, dated that day.
+    """
+
+    date = models.DateField()
+    currency_from = models.CharField(max_length=3)
+    currency_to = models.CharField(max_length=3)
+    # Enough integer digits for the largest cross rate between ExchangeRate
+    # rates (9999999999.99999 / 0.00001), and 15 significant digits for
+    # rates down to 1e-7, within Oracle's limit of 38 digits
+    rate = models.DecimalField(decimal_places=22, max_digits=38)
+
+    class Meta:
+        unique_together = [
+            ["currency_from", "currency_to", "date"],
+        ]
+
+    def __str__(self):
+        return f"Cross Exchange Rate: {self.currency_from}-{self.currency_to} @ {self.date}: {self.rate}"
+
+
+class CrossExchangeRateStatus(models.Model):
+    """How fresh the CrossExchangeRates for a currency pair are"""
+
+    currency_from = models.CharField(max_length=3)
+    currency_to = models.CharField(max_length=3)
+    materialized_through = models.DateField()
+    refreshed_at = models.DateTimeField()
+    # The oldest date that ExchangeRates have been written for since the
+    # last refresh, from which the materialized rates can't be used
+    stale_since = models.DateField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [
+            ["currency_from", "currency_to"],
+        ]
+        verbose_name_plural = "cross exchange rate statuses"
+
+    def __str__(self):
+        return f"Cross Exchange Rates: {self.currency_from}-{self.currency_to} through {self.materialized_through}"
+
+
+class StagedExchangeRate(models.Model):
+    """ExchangeRates being imported, before they are merged into ExchangeRate.
+
+    Each import stages its rates under its own batch id.
+    """
+
+    batch = models.CharField(max_length=32)
+    date = models.DateField()
+    currency = models.CharField(max_length=3)
+    base_currency = models.CharField(max_length=3)
+    rate = models.DecimalField(decimal_places=5, max_digits=15)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["batch", "date", "currency", "base_currency"],
+                name="stagedexchangerate_batch_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Staged Exchange Rate: {self.base_currency}-{self.currency} @ {self.date}: {self.rate}"
+
+
+@receiver(post_save, sender=ExchangeRate)
+def exchange_rate_saved(sender, instance, **kwargs):
+    exchange_rates_updated.send(sender=sender, since=_oldest([instance.date]))
+
 
 @register(Tags.database, deploy=True)
 def check_fresh_exchange_rate_data(app_configs, **kwargs):
@@ -0,0 +1,245 @@
+"""Exchange rate providers, for the import pipeline in
+historical_currencies.importing.
+
+A provider fetches and parses rates from a source, streaming them as
+unsaved ExchangeRates from iter_rates(). It doesn't write to the database.
+"""
+
+import datetime
+import json
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+
+from historical_currencies.models import ExchangeRate
+
+ECB_NAMESPACE = {
+    "eurofxref": "http://www.ecb.int/vocabulary/2002-08-01/eurofxref",
+    "gesmes": "http://www.gesmes.org/xml/2002-08-01",
+}
+ECB_CUBE = f"{{{ECB_NAMESPACE['eurofxref']}}}Cube"
+
+DEFAULT_OXR_API_URL = "https://openexchangerates.org/api/"
+
+
+class ProviderError(Exception):
+    pass
+
+
+class RateProvider:
+    """A source of exchange rates"""
+
+    def iter_rates(self) -> Iterator[ExchangeRate]:
+        """Stream unsaved ExchangeRates"""
+        raise NotImplementedError
+
+
+class ECBProvider(RateProvider):
+    """Rates from a European Central Bank eurofxref XML feed.
+
+    If since is specified, only rates for dates after since are produced.
+    """
+
+    def __init__(self, url: str, since: Optional[datetime.date] = None) -> None:
+        self.url = url
+        self.since = since
+
+    def iter_rates(self) -> Iterator[ExchangeRate]:
+        """Stream ExchangeRates from the ECB XML.
+
+        Each day's Cube is discarded once its rates have been produced, so
+        memory use doesn't grow with the size of the file.
+
+        ECB feeds are ordered newest first, so we stop reading at since.
+        """
+        with urlopen(self.url) as f:
+            days = None
+            for event, element in ET.iterparse(f, events=("start", "end")):
+                if element.tag != ECB_CUBE:
+                    continue
+                if event == "start":
+                    if days is None:
+                        # The outer Cube, containing one Cube per day
+                        days = element
+                    continue
+                time = element.get("time")
+                if time is None:
+                    continue
+                date = datetime.date.fromisoformat(time)
+                if self.since is not None and date <= self.since:
+                    return
+                for rate in element.iterfind("eurofxref:Cube", ECB_NAMESPACE):
+                    yield ExchangeRate(
+                        date=date,
+                        base_currency="EUR",
+                        currency=rate.get("currency"),
+                        rate=rate.get("rate"),
+                    )
+                if days is not None:
+                    days.clear()
+
+
+class OpenExchangeRatesProvider(RateProvider):
+    """Rates from the OpenExchangeRates.org API, for start_date to end_date.
+
+    Uses time-series requests if the plan supports them. Otherwise, each day
+    is fetched separately, up to concurrency days in parallel. Failed
+    requests are retried up to retries times, with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        concurrency: int = 1,
+        retries: int = 3,
+        retry_backoff: float = 1.0,
+    ) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.requests_remaining: Optional[int] = None
+        self.quota_lock = threading.Lock()
+        self.plan: Optional[Dict[str, Any]] = None
+
+    def iter_month_ranges(
+        self, start_date: datetime.date, end_date: datetime.date
+    ) -> Iterator[Tuple[datetime.date, datetime.date]]:
+        month_start = start_date
+        month_end = month_start + datetime.timedelta(days=31)
+        while month_end < end_date:
+            yield (month_start, month_end)
+            month_start = month_end + datetime.timedelta(days=1)
+            month_end = month_start + datetime.timedelta(days=31)
+        yield (month_start, end_date)
+
+    def iter_days(
+        self, start_date: datetime.date, end_date: datetime.date
+    ) -> Iterator[datetime.date]:
+        day = start_date
+        while day <= end_date:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def oxr_request(self, endpoint: str, query: Optional[Dict[str, str]] = None):
+        if query is None:
+            query = {}
+        query["app_id"] = settings.OPEN_EXCHANGE_RATES_APP_ID
+        api_url = getattr(settings, "OPEN_EXCHANGE_RATES_API_URL", DEFAULT_OXR_API_URL)
+        url = f"{api_url}{endpoint}?{urlencode(query)}"
+        attempt = 0
+        while True:
+            self.use_quota()
+            try:
+                with urlopen(url) as f:
+                    if f.status != 200:
+                        raise Exception("Request failed")
+                    return json.load(f)
+            except (HTTPError, URLError) as e:
+                retryable = not isinstance(e, HTTPError) or (
+                    e.code == 429 or e.code >= 500
+                )
+                if not retryable or attempt >= self.retries:
+                    raise
+            time.sleep(self.retry_backoff * 2**attempt)
+            attempt += 1
+
+    def use_quota(self) -> None:
+        """Account for a request against the quota found by check_usage"""
+        with self.quota_lock:
+            if self.requests_remaining is None:
+                return
+            if self.requests_remaining <= 0:
+                raise ProviderError("OpenExchangeRates request quota exhausted")
+            self.requests_remaining -= 1
+
+    def check_usage(self) -> None:
+        usage = self.oxr_request("usage.json")["data"]
+        plan = usage["plan"]
+        requests_remaining = usage["usage"]["requests_remaining"]
+        days_to_query = (self.end_date - self.start_date).days + 1
+        if days_to_query > requests_remaining:
+            raise Exception(
+                f"Insufficient quota: days: {days_to_query}, "
+                f"requests remaining: {requests_remaining}"
+            )
+        if (
+            not plan["features"]["base"]
+            and settings.OPEN_EXCHANGE_RATES_BASE_CURRENCY != "USD"
+        ):
+            raise Exception(
+                "OpenExchangeRates plan doesn't support non-USD " "base currency"
+            )
+        self.plan = plan
+        with self.quota_lock:
+            self.requests_remaining = requests_remaining
+
+    def iter_historical_rates(self, day: datetime.date) -> Iterator[ExchangeRate]:
+        rates = self.oxr_request(
+            f"historical/{day.isoformat()}.json",
+            {
+                "base": settings.OPEN_EXCHANGE_RATES_BASE_CURRENCY,
+            },
+        )
+        for currency, rate in rates["rates"].items():
+            yield ExchangeRate(
+                date=day,
+                base_currency=rates["base"],
+                currency=currency,
+                rate=rate,
+            )
+
+    def fetch_historical_rates(self, day: datetime.date) -> List[ExchangeRate]:
+        return list(self.iter_historical_rates(day))
+
+    def iter_time_series_rates(
+        self, start_date: datetime.date, end_date: datetime.date
+    ) -> Iterator[ExchangeRate]:
+        historic_rates = self.oxr_request(
+            "time-series.json",
+            {
+                "start": start_date.isoformat(),
+                "end": end_date.isoformat(),
+                "base": settings.OPEN_EXCHANGE_RATES_BASE_CURRENCY,
+            },
+        )
+        for day, rates in historic_rates["rates"].items():
+            date = datetime.date.fromisoformat(day)
+            for currency, rate in rates.items():
+                yield ExchangeRate(
+                    date=date,
+                    base_currency=historic_rates["base"],
+                    currency=currency,
+                    rate=rate,
+                )
+
+    def iter_rates(self) -> Iterator[ExchangeRate]:
+        if self.plan is None:
+            self.check_usage()
+        assert self.plan is not None
+        if self.plan["features"]["time-series"]:
+            for month_range in self.iter_month_ranges(self.start_date, self.end_date):
+                yield from self.iter_time_series_rates(*month_range)
+            return
+        # Fetch in parallel, but produce rates from this thread only
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(self.fetch_historical_rates, day)
+                for day in self.iter_days(self.start_date, self.end_date)
+            ]
+            try:
+                for future in futures:
+                    yield from future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
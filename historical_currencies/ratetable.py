@@ -0,0 +1,391 @@
+import datetime
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, cast
+
+from django.conf import settings
+from django.db.models import Count, Max, QuerySet
+
+from historical_currencies.cache import get_shared_cache
+from historical_currencies.models import ExchangeRate
+
+RATE_DECIMAL_PLACES = ExchangeRate._meta.get_field("rate").decimal_places
+DEFAULT_SNAPSHOT_CHECK = 10
+DEFAULT_TABLE_CHECK = 10
+
+RateRow = Tuple[datetime.date, str, str, Decimal]
+
+
+class RateTable:
+    """An in-memory table of exchange rates.
+
+    Rates are held per (base_currency, currency) pair, as a sorted array of
+    date ordinals and a parallel array of rates, scaled to integers. Lookups
+    bisect these arrays, rather than querying the database.
+
+    The lookup rules match historical_currencies.exchange.latest_rate: a
+    direct conversion, or an indirect conversion via a single base currency,
+    whichever is the most recent.
+    """
+
+    def __init__(self, decimal_places: int = RATE_DECIMAL_PLACES) -> None:
+        self.decimal_places = decimal_places
+        self._pairs: Dict[Tuple[str, str], Tuple[Sequence[int], Sequence[int]]] = {}
+        self._bases: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[RateRow]) -> "RateTable":
+        """Build a RateTable from (date, base_currency, currency, rate) rows"""
+        table = cls()
+        table.add_rows(rows)
+        return table
+
+    @classmethod
+    def from_queryset(cls, queryset: Optional[QuerySet] = None) -> "RateTable":
+        """Build a RateTable from a queryset of ExchangeRates (default: all)"""
+        if queryset is None:
+            queryset = ExchangeRate.objects.all()
+        return cls.from_rows(
+            queryset.order_by("base_currency", "currency", "date")
+            .values_list("date", "base_currency", "currency", "rate")
+            .iterator()
+        )
+
+    @classmethod
+    def from_pairs(
+        cls,
+        pairs: Iterable[Tuple[str, str, Sequence[int], Sequence[int]]],
+        decimal_places: int = RATE_DECIMAL_PLACES,
+    ) -> "RateTable":
+        """Build a RateTable from (base_currency, currency, dates, rates),
+        where dates are sorted ordinals, and rates are scaled to integers by
+        decimal_places.
+
+        The sequences are used as they are, so they can be views of a
+        memory-mapped file. Such a table is read-only.
+        """
+        table = cls(decimal_places)
+        for base_currency, currency, dates, rates in pairs:
+            table._pairs[(base_currency, currency)] = (dates, rates)
+            table._bases.setdefault(currency, set()).add(base_currency)
+        return table
+
+    def pairs(self) -> Iterator[Tuple[str, str, Sequence[int], Sequence[int]]]:
+        """(base_currency, currency, dates, rates) for each pair, in order.
+
+        The inverse of from_pairs().
+        """
+        for (base_currency, currency), (dates, rates) in sorted(self._pairs.items()):
+            yield base_currency, currency, dates, rates
+
+    def add_rows(self, rows: Iterable[RateRow]) -> None:
+        unsorted = set()
+        for date, base_currency, currency, rate in rows:
+            key = (base_currency, currency)
+            pair = self._pairs.get(key)
+            if pair is None:
+                pair = self._pairs[key] = (array("i"), array("q"))
+                self._bases.setdefault(currency, set()).add(base_currency)
+            # Only tables built from rows are extended
+            dates, rates = cast(Tuple[array, array], pair)
+            ordinal = date.toordinal()
+            if dates and dates[-1] >= ordinal:
+                unsorted.add(key)
+            dates.append(ordinal)
+            rates.append(
+                int(Decimal(rate).scaleb(self.decimal_places).to_integral_value())
+            )
+        for key in unsorted:
+            self._sort_pair(key)
+
+    def _sort_pair(self, key: Tuple[str, str]) -> None:
+        dates, rates = self._pairs[key]
+        # Later rows replace earlier rows for the same date
+        merged = dict(zip(dates, rates))
+        ordinals = sorted(merged)
+        self._pairs[key] = (
+            array("i", ordinals),
+            array("q", (merged[ordinal] for ordinal in ordinals)),
+        )
+
+    def dates(self) -> List[datetime.date]:
+        """All the dates that have rates, in order"""
+        ordinals: Set[int] = set()
+        for dates, rates in self._pairs.values():
+            ordinals.update(dates)
+        return [datetime.date.fromordinal(ordinal) for ordinal in sorted(ordinals)]
+
+    def next_date(
+        self, currencies: Iterable[str], date: datetime.date
+    ) -> Optional[datetime.date]:
+        """The first date after date with a rate for any of currencies"""
+        after = date.toordinal()
+        first = None
+        for currency in currencies:
+            for base_currency in self._bases.get(currency, ()):
+                dates, rates = self._pairs[(base_currency, currency)]
+                i = bisect_right(dates, after)
+                if i < len(dates) and (first is None or dates[i] < first):
+                    first = dates[i]
+        if first is None:
+            return None
+        return datetime.date.fromordinal(first)
+
+    def __len__(self) -> int:
+        return sum(len(dates) for dates, rates in self._pairs.values())
+
+    def _rate(self, scaled: int) -> Decimal:
+        return Decimal(scaled).scaleb(-self.decimal_places)
+
+    def _latest_direct(
+        self,
+        base_currency: str,
+        currency: str,
+        newest: int,
+        oldest: int,
+    ) -> Optional[Tuple[int, Decimal]]:
+        pair = self._pairs.get((base_currency, currency))
+        if pair is None:
+            return None
+        dates, rates = pair
+        i = bisect_right(dates, newest) - 1
+        if i < 0 or dates[i] < oldest:
+            return None
+        return dates[i], self._rate(rates[i])
+
+    def _latest_common(
+        self,
+        base_currency: str,
+        currency_from: str,
+        currency_to: str,
+        newest: int,
+        oldest: int,
+    ) -> Optional[Tuple[int, Decimal]]:
+        """Latest date that both currencies have a rate against base_currency"""
+        dates_from, rates_from = self._pairs[(base_currency, currency_from)]
+        dates_to, rates_to = self._pairs[(base_currency, currency_to)]
+        i = bisect_right(dates_from, newest) - 1
+        j = bisect_right(dates_to, newest) - 1
+        while i >= 0 and j >= 0:
+            date_from = dates_from[i]
+            date_to = dates_to[j]
+            if date_from < oldest or date_to < oldest:
+                return None
+            if date_from == date_to:
+                return date_from, self._rate(rates_to[j]) / self._rate(rates_from[i])
+            if date_from > date_to:
+                i = bisect_right(dates_from, date_to, 0, i) - 1
+            else:
+                j = bisect_right(dates_to, date_from, 0, j) - 1
+        return None
+
+    def _candidates(
+        self,
+        currency_from: str,
+        currency_to: str,
+        date: datetime.date,
+        max_age: Optional[int],
+    ) -> List[Tuple[int, Decimal, str]]:
+        if max_age is None:
+            max_age = settings.MAX_EXCHANGE_RATE_AGE
+        newest = date.toordinal()
+        oldest = newest - max_age
+
+        candidates = []
+        direct = self._latest_direct(currency_from, currency_to, newest, oldest)
+        if direct:
+            candidates.append((*direct, "direct"))
+        inverse = self._latest_direct(currency_to, currency_from, newest, oldest)
+        if inverse:
+            candidates.append((inverse[0], 1 / inverse[1], "direct"))
+
+        bases = self._bases.get(currency_from, set()) & self._bases.get(
+            currency_to, set()
+        )
+        for base_currency in bases:
+            triangulated = self._latest_common(
+                base_currency, currency_from, currency_to, newest, oldest
+            )
+            if triangulated:
+                candidates.append((*triangulated, "triangulated"))
+        return candidates
+
+    def iter_available_rates(
+        self,
+        currency_from: str,
+        currency_to: str,
+        date: datetime.date,
+        max_age: Optional[int] = None,
+    ) -> List[Tuple[datetime.date, Decimal]]:
+        """The latest direct rate, and latest rate via each base currency"""
+        return [
+            (datetime.date.fromordinal(ordinal), rate)
+            for ordinal, rate, method in self._candidates(
+                currency_from, currency_to, date, max_age
+            )
+        ]
+
+    def resolve(
+        self,
+        currency_from: str,
+        currency_to: str,
+        date: datetime.date,
+        max_age: Optional[int] = None,
+    ) -> Optional[Tuple[datetime.date, Decimal, str]]:
+        """Like latest_rate(), but also returning how the rate was found:
+        "direct" or "triangulated" (or "identity", from a currency to itself).
+        """
+        if currency_from == currency_to:
+            return (date, Decimal(1), "identity")
+        candidates = self._candidates(currency_from, currency_to, date, max_age)
+        if not candidates:
+            return None
+        ordinal, rate, method = max(candidates, key=lambda candidate: candidate[:2])
+        return datetime.date.fromordinal(ordinal), rate, method
+
+    def latest_rate(
+        self,
+        currency_from: str,
+        currency_to: str,
+        date: datetime.date,
+        max_age: Optional[int] = None,
+    ) -> Optional[Tuple[datetime.date, Decimal]]:
+        """The latest exchange rate from currency_from to currency_to as of
+        date, or None if there isn't one within max_age days.
+        """
+        resolved = self.resolve(currency_from, currency_to, date, max_age)
+        if resolved is None:
+            return None
+        return resolved[:2]
+
+
+_rate_table: Optional[RateTable] = None
+_rate_table_lock = threading.Lock()
+_snapshot_stat: Optional[Tuple[int, int]] = None
+_snapshot_checked = 0.0
+# The _data_stamp() when _rate_table was loaded from the database
+_table_stamp: Optional[Tuple[Optional[str], int, Optional[int]]] = None
+_table_checked = 0.0
+
+
+def get_rate_table() -> Optional[RateTable]:
+    """The process-wide RateTable, if enabled by settings.EXCHANGE_RATE_TABLE
+    or settings.EXCHANGE_RATE_SNAPSHOT
+
+    The table is loaded from the snapshot file, or the database, on first
+    use. A snapshot is reloaded when the file is replaced, which is checked
+    at most every EXCHANGE_RATE_SNAPSHOT_CHECK seconds. A table loaded from
+    the database is reloaded when another process has written rates, which
+    is checked at most every EXCHANGE_RATE_TABLE_CHECK seconds.
+    """
+    global _rate_table, _table_stamp, _table_checked
+    snapshot = getattr(settings, "EXCHANGE_RATE_SNAPSHOT", None)
+    if snapshot is None and not getattr(settings, "EXCHANGE_RATE_TABLE", False):
+        return None
+    if snapshot is not None:
+        _check_snapshot(snapshot)
+    elif _table_check_due():
+        _check_table()
+    table = _rate_table
+    if table is None:
+        with _rate_table_lock:
+            if _rate_table is None:
+                if snapshot is not None:
+                    from historical_currencies.snapshot import load_snapshot
+
+                    _rate_table = load_snapshot(snapshot)
+                else:
+                    # Before loading, so that writes during the load are
+                    # noticed by the next check
+                    _table_stamp = _data_stamp()
+                    _table_checked = time.monotonic()
+                    _rate_table = RateTable.from_queryset()
+            table = _rate_table
+    return table
+
+
+async def aget_rate_table() -> Optional[RateTable]:
+    """Async get_rate_table(), loading the table in a thread"""
+    snapshot = getattr(settings, "EXCHANGE_RATE_SNAPSHOT", None)
+    if snapshot is None and not getattr(settings, "EXCHANGE_RATE_TABLE", False):
+        return None
+    if snapshot is not None:
+        _check_snapshot(snapshot)
+    table = _rate_table
+    if table is None or (snapshot is None and _table_check_due()):
+        from asgiref.sync import sync_to_async
+
+        table = await sync_to_async(get_rate_table)()
+    return table
+
+
+def _check_snapshot(path: str) -> None:
+    """Invalidate the cached exchange rate data in this process, if the
+    snapshot at path has been replaced since we last checked.
+
+    Every process sees the new snapshot itself, so the shared cache is left
+    alone.
+    """
+    global _snapshot_stat, _snapshot_checked
+    interval = getattr(settings, "EXCHANGE_RATE_SNAPSHOT_CHECK", DEFAULT_SNAPSHOT_CHECK)
+    now = time.monotonic()
+    if _snapshot_stat is not None and now - _snapshot_checked < interval:
+        return
+    _snapshot_checked = now
+    stat = os.stat(path)
+    snapshot_stat = (stat.st_ino, stat.st_mtime_ns)
+    if snapshot_stat != _snapshot_stat:
+        if _snapshot_stat is not None:
+            from historical_currencies.exchange import invalidate_local_caches
+
+            invalidate_local_caches()
+        _snapshot_stat = snapshot_stat
+
+
+def _data_stamp() -> Tuple[Optional[str], int, Optional[int]]:
+    """A stamp that changes when any process writes exchange rates: the
+    shared cache version (if there is a shared cache), which changes on
+    every write (and again when it commits), and the number of
+    ExchangeRates and the latest id, which change on inserts and deletes.
+    """
+    shared = get_shared_cache()
+    counts = ExchangeRate.objects.aggregate(Count("id"), Max("id"))
+    return (
+        None if shared is None else shared.version(),
+        counts["id__count"],
+        counts["id__max"],
+    )
+
+
+def _table_check_due() -> bool:
+    if _rate_table is None or _table_stamp is None:
+        return False
+    interval = getattr(settings, "EXCHANGE_RATE_TABLE_CHECK", DEFAULT_TABLE_CHECK)
+    return interval is not None and time.monotonic() - _table_checked >= interval
+
+
+def _check_table() -> None:
+    """Invalidate the cached exchange rate data in this process, if rates
+    have been written since the RateTable was loaded.
+
+    The process that wrote them has already invalidated the shared cache.
+    """
+    global _table_checked
+    stamp = _table_stamp
+    _table_checked = time.monotonic()
+    if stamp is not None and _data_stamp() != stamp:
+        from historical_currencies.exchange import invalidate_local_caches
+
+        invalidate_local_caches()
+
+
+def clear_rate_table() -> None:
+    """Discard the process-wide RateTable, it will be reloaded on next use"""
+    global _rate_table, _table_stamp
+    with _rate_table_lock:
+        _rate_table = None
+        _table_stamp = None
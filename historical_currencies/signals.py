@@ -0,0 +1,28 @@
+from django.dispatch import Signal
+
+# Sent when ExchangeRates are created, modified, or deleted (inside the
+# writer's transaction, if any: use transaction.on_commit() to act on the
+# committed rates), with:
+# since: The oldest date of the rates written, when known (it is only
+#   tracked with EXCHANGE_RATE_CROSS_PAIRS), otherwise None.
+exchange_rates_updated = Signal()
+
+# Sent after each latest_rate() or alatest_rate() call, when there are
+# receivers, with:
+# currency_from, currency_to, date: The arguments.
+# cache: "hit", "shared_hit", "miss", or "coalesced" (waited for a
+#   concurrent miss).
+# source: Where a cache miss was resolved from: "interval" (the interval
+#   cache), "rate_table", "materialized" or "database" (None for hits, and
+#   conversions from a currency to itself).
+# method: "direct", "triangulated", or "identity" (None if not known).
+# queries: The number of database queries made (None for alatest_rate(),
+#   whose queries run in another thread).
+# duration: Seconds taken.
+# available: False if ExchangeRateUnavailable was raised.
+rate_resolved = Signal()
+
+# Sent when latest_rate() or alatest_rate() raises ExchangeRateUnavailable,
+# when there are receivers, with currency_from, currency_to, date, and
+# exception.
+rate_unavailable = Signal()
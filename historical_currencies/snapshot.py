@@ -0,0 +1,166 @@
+"""Compact binary snapshots of all exchange rates, for read-only workers.
+
+A snapshot is written by the export_rate_snapshot management command, and
+memory-mapped by load_snapshot(), so every process on a host shares the same
+page-cached copy. All integers are little-endian:
+
+* Header: magic, format version, rate decimal places, number of currencies,
+  pairs and rates.
+* Currency table: 3 bytes per currency code, padded to 8 bytes.
+* Pair table: (base currency index, currency index, rate count, offset) per
+  (base_currency, currency) pair, in order.
+* Dates: int32 date ordinals, sorted within each pair, padded to 8 bytes.
+* Rates: int64 rates, scaled to integers by the decimal places.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+from historical_currencies.ratetable import RateTable
+
+MAGIC = b"HCRS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIQ")
+PAIR = struct.Struct("<HHIQ")
+CURRENCY_SIZE = 3
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % 8)
+
+
+def _little_endian(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_snapshot(path: Union[str, Path], table: Optional[RateTable] = None) -> int:
+    """Write table (default: all rates, from the database) to path.
+
+    The file is replaced atomically, so processes that have the previous
+    snapshot mapped keep a consistent view of it.
+
+    Returns the number of rates written.
+    """
+    if table is None:
+        table = RateTable.from_queryset()
+    pairs = list(table.pairs())
+    currencies = sorted(
+        {base_currency for base_currency, *rest in pairs}
+        | {currency for base_currency, currency, *rest in pairs}
+    )
+    index = {currency: i for i, currency in enumerate(currencies)}
+
+    currency_table = b"".join(
+        currency.encode("ascii").ljust(CURRENCY_SIZE, b"\0") for currency in currencies
+    )
+    pair_table = []
+    all_dates = array("i")
+    all_rates = array("q")
+    for base_currency, currency, dates, rates in pairs:
+        pair_table.append(
+            PAIR.pack(index[base_currency], index[currency], len(dates), len(all_dates))
+        )
+        all_dates.extend(dates)
+        all_rates.extend(rates)
+
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    table.decimal_places,
+                    len(currencies),
+                    len(pairs),
+                    len(all_dates),
+                )
+            )
+            f.write(currency_table + _padding(len(currency_table)))
+            f.write(b"".join(pair_table))
+            dates_bytes = _little_endian(all_dates)
+            f.write(dates_bytes + _padding(len(dates_bytes)))
+            f.write(_little_endian(all_rates))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(all_dates)
+
+
+def load_snapshot(path: Union[str, Path]) -> RateTable:
+    """Memory-map the snapshot at path, as a read-only RateTable"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise SnapshotError(f"{path} is not an exchange rate snapshot")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, decimal_places, n_currencies, n_pairs, n_rates = HEADER.unpack_from(
+        data
+    )
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not an exchange rate snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"{path} has unsupported snapshot version {version}")
+
+    offset = HEADER.size
+    currencies: List[str] = []
+    for i in range(n_currencies):
+        code = data[offset + i * CURRENCY_SIZE : offset + (i + 1) * CURRENCY_SIZE]
+        currencies.append(code.rstrip(b"\0").decode("ascii"))
+    offset += n_currencies * CURRENCY_SIZE
+    offset += -offset % 8
+
+    pair_entries = [
+        PAIR.unpack_from(data, offset + i * PAIR.size) for i in range(n_pairs)
+    ]
+    offset += n_pairs * PAIR.size
+
+    dates_size = n_rates * 4
+    rates_offset = offset + dates_size + (-dates_size % 8)
+    if rates_offset + n_rates * 8 != size:
+        raise SnapshotError(f"{path} is truncated")
+
+    view = memoryview(data)
+    all_dates: Sequence[int]
+    all_rates: Sequence[int]
+    if sys.byteorder == "little":
+        all_dates = view[offset : offset + dates_size].cast("i")
+        all_rates = view[rates_offset:].cast("q")
+    else:
+        # Convert to native order in memory, rather than sharing the mapping
+        dates = array("i", view[offset : offset + dates_size].tobytes())
+        dates.byteswap()
+        rates = array("q", view[rates_offset:].tobytes())
+        rates.byteswap()
+        all_dates, all_rates = dates, rates
+
+    return RateTable.from_pairs(
+        (
+            (
+                currencies[base_index],
+                currencies[currency_index],
+                all_dates[start : start + count],
+                all_rates[start : start + count],
+            )
+            for base_index, currency_index, count, start in pair_entries
+        ),
+        decimal_places=decimal_places,
+    )
@@ -1,9 +1,16 @@
+from functools import lru_cache
+
 from django import template
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.loader import get_template
 
-from historical_currencies.choices import currency_choices
+from historical_currencies.choices import currency_choices, sorted_choices
 
 register = template.Library()
 
+OPTIONS_TEMPLATE = "historical_currencies/currency_choices_options.html"
+
 
 @register.simple_tag
 def currency_choices_list(exclude_special=True):
@@ -11,10 +18,33 @@ def currency_choices_list(exclude_special=True):
     return currency_choices(exclude_special=exclude_special)
 
 
-@register.inclusion_tag("historical_currencies/currency_choices_options.html")
+@register.simple_tag
 def currency_choices_options(exclude_special=True, selected=None):
-    """Return a rendered set of <option> tags."""
-    return {
-        "currency_choices": currency_choices(exclude_special=exclude_special),
-        "selected": selected,
-    }
+    """Return a rendered set of <option> tags.
+
+    The options are rendered once for each selected currency, and reused.
+    """
+    exclude_special = bool(exclude_special)
+    if not (isinstance(selected, str) and selected in _codes(exclude_special)):
+        # No option is selected
+        selected = None
+    return _render_options(exclude_special, selected)
+
+
+@lru_cache(maxsize=None)
+def _codes(exclude_special):
+    return frozenset(code for code, name in sorted_choices(exclude_special))
+
+
+# Each rendering is ~10KiB
+@lru_cache(maxsize=64)
+def _render_options(exclude_special, selected):
+    return get_template(OPTIONS_TEMPLATE).render(
+        {"currency_choices": sorted_choices(exclude_special), "selected": selected}
+    )
+
+
+@receiver(setting_changed)
+def clear_rendered_options(setting, **kwargs):
+    if setting == "TEMPLATES":
+        _render_options.cache_clear()
@@ -4,7 +4,7 @@ from django import template
 from django.utils.translation import gettext_lazy as _
 
 from historical_currencies.exceptions import ExchangeRateUnavailable
-from historical_currencies.exchange import exchange
+from historical_currencies.exchange import exchange, prefetch_rates
 from historical_currencies.formatting import render_amount
 
 register = template.Library()
@@ -30,3 +30,28 @@ def exchange_filter(amount, target_currency):
             "target_currency": target_currency
         }
     return render_amount(amount, target_currency)
+
+
+class PrefetchRatesNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        with prefetch_rates():
+            return self.nodelist.render(context)
+
+
+@register.tag("prefetch_rates")
+def do_prefetch_rates(parser, token):
+    """Exchange amounts within the block with rates fetched in a single query
+
+    {% prefetch_rates %}
+      {% for line in statement %}{{ line.amount|exchange:"EUR" }}{% endfor %}
+    {% endprefetch_rates %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 1:
+        raise template.TemplateSyntaxError(f"{bits[0]} tag takes no arguments")
+    nodelist = parser.parse(("endprefetch_rates",))
+    parser.delete_first_token()
+    return PrefetchRatesNode(nodelist)
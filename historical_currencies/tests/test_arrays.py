@@ -0,0 +1,103 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from django.test import TestCase
+
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.exchange import exchange
+from historical_currencies.models import ExchangeRate
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None  # type: ignore[assignment]
+else:
+    from historical_currencies.arrays import exchange_array
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ExchangeArrayTestCase(TestCase):
+    date_1 = datetime.date(2021, 12, 30)
+    date_2 = datetime.date(2021, 12, 31)
+    date_3 = datetime.date(2022, 1, 3)
+
+    def setUp(self):
+        for date, base_currency, currency, rate in (
+            (self.date_1, "USD", "EUR", "0.8823"),
+            (self.date_1, "USD", "ZAR", "15.897"),
+            (self.date_1, "EUR", "AUD", "1.5594"),
+            (self.date_2, "EUR", "USD", "1.1326"),
+            (self.date_2, "EUR", "ZAR", "18.0625"),
+            (self.date_3, "EUR", "USD", "1.1355"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency=base_currency, currency=currency, rate=rate
+            )
+        self.amounts = [Decimal(10), Decimal("12.34"), 100, Decimal(7), Decimal(5)]
+        self.currencies_from = ["USD", "EUR", "ZAR", "EUR", "USD"]
+        self.currencies_to = ["EUR", "USD", "USD", "EUR", "ZAR"]
+        self.dates = [self.date_1, self.date_3, self.date_2, self.date_2, self.date_2]
+
+    def expected(self):
+        return [
+            exchange(*item)
+            for item in zip(
+                self.amounts, self.currencies_from, self.currencies_to, self.dates
+            )
+        ]
+
+    def test_exact(self):
+        expected = self.expected()
+        with self.assertNumQueries(1):
+            result = exchange_array(
+                self.amounts, self.currencies_from, self.currencies_to, self.dates
+            )
+        self.assertEqual(result.dtype, object)
+        self.assertEqual(list(result), expected)
+
+    def test_float(self):
+        result = exchange_array(
+            np.array([10, 12.34, 100, 7, 5], dtype=np.float64),
+            np.array(self.currencies_from),
+            np.array(self.currencies_to),
+            np.array(self.dates, dtype="datetime64[D]"),
+            exact=False,
+        )
+        self.assertEqual(result.dtype, np.float64)
+        np.testing.assert_allclose(
+            result, [float(amount) for amount in self.expected()], atol=0.01
+        )
+
+    def test_scalar_arguments(self):
+        result = exchange_array([1, 2, 3], "EUR", "USD", self.date_2)
+        self.assertEqual(
+            list(result), [Decimal("1.13"), Decimal("2.27"), Decimal("3.40")]
+        )
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(len(exchange_array([], [], [], [])), 0)
+
+    def test_raises_exception(self):
+        with self.assertRaisesMessage(
+            ExchangeRateUnavailable,
+            "No exchange rate available between USD and AUD for 2021-12-30",
+        ):
+            exchange_array([1, 1], ["EUR", "USD"], ["USD", "AUD"], self.date_1)
+
+    def test_missing_rates(self):
+        result = exchange_array(
+            [1, 1], ["USD", "EUR"], ["AUD", "USD"], self.date_2, raise_exceptions=False
+        )
+        self.assertEqual(list(result), [None, Decimal("1.13")])
+        result = exchange_array(
+            [1, 1],
+            ["USD", "EUR"],
+            ["AUD", "USD"],
+            self.date_2,
+            exact=False,
+            raise_exceptions=False,
+        )
+        self.assertTrue(np.isnan(result[0]))
+        self.assertEqual(result[1], 1.13)
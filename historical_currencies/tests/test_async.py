@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import django
+from django.test import TestCase
+
+from historical_currencies import exchange as exchange_module
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.exchange import (
+    aexchange,
+    alatest_rate,
+    exchange,
+    latest_rate,
+)
+from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import clear_rate_table
+
+
+@unittest.skipIf(django.VERSION < (4, 1), "Async ORM requires Django >= 4.1")
+class AsyncExchangeTestCase(TestCase):
+    date = datetime.date(2021, 12, 31)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        for base_currency, currency, rate in (
+            ("EUR", "USD", "1.1326"),
+            ("EUR", "ZAR", "18.0625"),
+        ):
+            ExchangeRate.objects.create(
+                date=self.date,
+                base_currency=base_currency,
+                currency=currency,
+                rate=rate,
+            )
+        latest_rate.cache_clear()
+
+    def test_matches_sync(self):
+        from asgiref.sync import async_to_sync
+
+        for currency_from, currency_to in (
+            ("EUR", "USD"),
+            ("USD", "EUR"),
+            ("USD", "ZAR"),
+            ("ZAR", "ZAR"),
+        ):
+            with self.subTest(pair=(currency_from, currency_to)):
+                expected = latest_rate(currency_from, currency_to, self.date)
+                latest_rate.cache_clear()
+                self.assertEqual(
+                    async_to_sync(alatest_rate)(currency_from, currency_to, self.date),
+                    expected,
+                )
+
+    async def test_aexchange(self):
+        self.assertEqual(
+            await aexchange(10, "USD", "ZAR", date=self.date), Decimal("159.48")
+        )
+        self.assertEqual(
+            await aexchange(10, "ZAR", "ZAR", date=self.date), Decimal("10.00")
+        )
+
+    async def test_unavailable(self):
+        with self.assertRaises(ExchangeRateUnavailable):
+            await alatest_rate("USD", "JPY", self.date)
+        with self.assertRaises(ExchangeRateUnavailable):
+            await aexchange(10, "USD", "ZAR", date=datetime.date(2022, 3, 1))
+
+    async def test_shares_cache_with_sync(self):
+        await alatest_rate("EUR", "USD", self.date)
+        with mock.patch.object(exchange_module, "_find_latest_rate") as find:
+            self.assertEqual(
+                latest_rate("EUR", "USD", self.date), (self.date, Decimal("1.1326"))
+            )
+        find.assert_not_called()
+        info = latest_rate.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    async def test_concurrent_lookups_share_a_fetch(self):
+        calls = []
+        find = exchange_module._afind_latest_rate
+
+        async def counting_find(*args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return await find(*args)
+
+        with mock.patch.object(exchange_module, "_afind_latest_rate", counting_find):
+            rates = await asyncio.gather(
+                *(alatest_rate("USD", "ZAR", self.date) for i in range(10)),
+                alatest_rate("EUR", "USD", self.date),
+            )
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(set(rates[:10])), 1)
+        self.assertEqual(rates[10], (self.date, Decimal("1.1326")))
+
+    async def test_concurrent_failures(self):
+        results = await asyncio.gather(
+            *(alatest_rate("USD", "JPY", self.date) for i in range(3)),
+            return_exceptions=True,
+        )
+        for result in results:
+            self.assertIsInstance(result, ExchangeRateUnavailable)
+
+    async def test_invalidated_while_in_flight(self):
+        find = exchange_module._afind_latest_rate
+
+        async def invalidating_find(*args):
+            latest_rate.invalidate()
+            return await find(*args)
+
+        with mock.patch.object(
+            exchange_module, "_afind_latest_rate", invalidating_find
+        ):
+            await alatest_rate("EUR", "USD", self.date)
+        self.assertEqual(latest_rate.cache_info().currsize, 0)
+
+    async def test_rate_table(self):
+        self.addCleanup(clear_rate_table)
+        with self.settings(EXCHANGE_RATE_TABLE=True):
+            self.assertEqual(
+                await aexchange(10, "USD", "ZAR", date=self.date), Decimal("159.48")
+            )
+
+    def test_sync_unaffected(self):
+        self.assertEqual(exchange(10, "USD", "ZAR", date=self.date), Decimal("159.48"))
@@ -0,0 +1,541 @@
+import datetime
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from historical_currencies.cache import (
+    _MISSING,
+    RateIntervals,
+    SharedCache,
+    rate_cache,
+)
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.exchange import (
+    exchange,
+    latest_rate,
+)
+from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import clear_rate_table, get_rate_table
+from historical_currencies.signals import exchange_rates_updated
+
+
+class RateCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+        @rate_cache
+        def double(value):
+            """Double value"""
+            self.calls.append(value)
+            return value * 2
+
+        self.double = double
+
+    def test_caches(self):
+        self.assertEqual(self.double(1), 2)
+        self.assertEqual(self.double(1), 2)
+        self.assertEqual(self.calls, [1])
+        info = self.double.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_wraps(self):
+        self.assertEqual(self.double.__name__, "double")
+        self.assertEqual(self.double.__doc__, "Double value")
+
+    def test_maxsize(self):
+        with self.settings(EXCHANGE_RATE_CACHE_SIZE=2):
+            for i in (1, 2, 3, 1):
+                self.double(i)
+        self.assertEqual(self.calls, [1, 2, 3, 1])
+        self.assertEqual(self.double.cache_info().currsize, 2)
+
+    def test_unbounded(self):
+        with self.settings(EXCHANGE_RATE_CACHE_SIZE=None):
+            for i in range(500):
+                self.double(i)
+        self.assertEqual(self.double.cache_info().currsize, 500)
+
+    def test_invalidate(self):
+        self.double(1)
+        self.double.invalidate()
+        self.double(1)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(self.double.cache_info().version, 1)
+
+    def test_invalidate_during_call(self):
+        @rate_cache
+        def invalidating(value):
+            invalidating.invalidate()
+            return value
+
+        invalidating(1)
+        self.assertEqual(invalidating.cache_info().currsize, 0)
+
+
+class CacheInvalidationTestCase(TestCase):
+    date = datetime.date(2021, 12, 31)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+
+    def test_bulk_create_invalidates(self):
+        with self.assertRaises(ExchangeRateUnavailable):
+            exchange(1, "USD", "ZAR", date=self.date)
+        ExchangeRate.objects.bulk_create(
+            [
+                ExchangeRate(
+                    date=self.date, base_currency="EUR", currency="USD", rate=1.1326
+                ),
+                ExchangeRate(
+                    date=self.date, base_currency="EUR", currency="ZAR", rate=18.0625
+                ),
+            ]
+        )
+        self.assertEqual(exchange(1, "USD", "ZAR", date=self.date), Decimal("15.95"))
+
+    def test_save_invalidates(self):
+        rate = ExchangeRate.objects.create(
+            date=self.date, base_currency="EUR", currency="USD", rate=1.1326
+        )
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.13"))
+        rate.rate = Decimal("1.2")
+        rate.save()
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.20"))
+
+    def test_update_invalidates(self):
+        ExchangeRate.objects.create(
+            date=self.date, base_currency="EUR", currency="USD", rate=1.1326
+        )
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.13"))
+        ExchangeRate.objects.update(rate=Decimal("1.2"))
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.20"))
+
+    def test_delete_invalidates(self):
+        rate = ExchangeRate.objects.create(
+            date=self.date, base_currency="EUR", currency="USD", rate=1.1326
+        )
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.13"))
+        rate.delete()
+        with self.assertRaises(ExchangeRateUnavailable):
+            exchange(1, "EUR", "USD", date=self.date)
+
+    def test_queryset_delete_invalidates_once(self):
+        ExchangeRate.objects.bulk_create(
+            ExchangeRate(
+                date=self.date - datetime.timedelta(days=days),
+                base_currency="EUR",
+                currency="USD",
+                rate=1.1326,
+            )
+            for days in range(5)
+        )
+        self.assertEqual(exchange(1, "EUR", "USD", date=self.date), Decimal("1.13"))
+        receiver = mock.Mock()
+        exchange_rates_updated.connect(receiver)
+        self.addCleanup(exchange_rates_updated.disconnect, receiver)
+        with self.assertNumQueries(1):
+            ExchangeRate.objects.filter(currency="USD").delete()
+        receiver.assert_called_once()
+        with self.assertRaises(ExchangeRateUnavailable):
+            exchange(1, "EUR", "USD", date=self.date)
+
+    def test_signal_invalidates(self):
+        latest_rate("EUR", "EUR", self.date)
+        self.assertEqual(latest_rate.cache_info().currsize, 1)
+        exchange_rates_updated.send(sender=None)
+        self.assertEqual(latest_rate.cache_info().currsize, 0)
+
+
+@unittest.skipIf(
+    connection.vendor == "sqlite", "SQLite locks tables with uncommitted writes"
+)
+class CommitInvalidationTestCase(TransactionTestCase):
+    date = datetime.date(2021, 12, 31)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        self.rate = ExchangeRate.objects.create(
+            date=self.date, base_currency="EUR", currency="USD", rate=Decimal("1.1")
+        )
+
+    def read_from_another_connection(self):
+        rates = []
+
+        def read():
+            try:
+                rates.append(latest_rate("EUR", "USD", self.date)[1])
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        return rates
+
+    def test_write_in_transaction(self):
+        with transaction.atomic():
+            self.rate.rate = Decimal("2")
+            self.rate.save()
+            # Caches the rate committed before the write
+            self.assertEqual(self.read_from_another_connection(), [Decimal("1.1")])
+        self.assertEqual(latest_rate("EUR", "USD", self.date)[1], Decimal("2"))
+        self.assertEqual(self.read_from_another_connection(), [Decimal("2")])
+
+    def test_write_in_transaction_with_rate_table(self):
+        self.addCleanup(clear_rate_table)
+        with self.settings(EXCHANGE_RATE_TABLE=True, EXCHANGE_RATE_TABLE_CHECK=0):
+            self.test_write_in_transaction()
+            self.assertEqual(
+                get_rate_table().latest_rate("EUR", "USD", self.date)[1],
+                Decimal("2"),
+            )
+
+
+class RateIntervalsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.intervals = RateIntervals()
+        self.intervals.add(
+            0, "key", datetime.date(2021, 1, 1), datetime.date(2021, 1, 3), "a"
+        )
+        self.intervals.add(
+            0, "key", datetime.date(2021, 1, 5), datetime.date(2021, 1, 5), "b"
+        )
+
+    def test_get(self):
+        self.assertIsNone(self.intervals.get("key", datetime.date(2020, 12, 31)))
+        self.assertEqual(self.intervals.get("key", datetime.date(2021, 1, 1)), "a")
+        self.assertEqual(self.intervals.get("key", datetime.date(2021, 1, 3)), "a")
+        self.assertIsNone(self.intervals.get("key", datetime.date(2021, 1, 4)))
+        self.assertEqual(self.intervals.get("key", datetime.date(2021, 1, 5)), "b")
+        self.assertIsNone(self.intervals.get("key", datetime.date(2021, 1, 6)))
+        self.assertIsNone(self.intervals.get("other", datetime.date(2021, 1, 1)))
+        self.assertEqual(self.intervals.hits, 3)
+
+    def test_maxsize(self):
+        self.intervals.get("key", datetime.date(2021, 1, 1))
+        with self.settings(EXCHANGE_RATE_INTERVAL_CACHE_SIZE=2):
+            self.intervals.add(
+                0, "other", datetime.date(2021, 1, 1), datetime.date(2021, 1, 1), "c"
+            )
+        self.assertEqual(len(self.intervals), 2)
+        self.assertEqual(self.intervals.get("key", datetime.date(2021, 1, 1)), "a")
+        self.assertIsNone(self.intervals.get("key", datetime.date(2021, 1, 5)))
+
+    def test_stale_version_discarded(self):
+        self.intervals.invalidate()
+        self.intervals.add(
+            0, "key", datetime.date(2021, 1, 1), datetime.date(2021, 1, 3), "a"
+        )
+        self.assertEqual(len(self.intervals), 0)
+
+
+class IntervalCacheTestCase(TestCase):
+    friday = datetime.date(2021, 12, 3)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        clear_rate_table()
+        self.addCleanup(clear_rate_table)
+        for date, usd, zar in (
+            (self.friday, "1.1", "17.6"),
+            (self.friday + datetime.timedelta(days=3), "1.2", "18"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency="USD", rate=usd
+            )
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency="ZAR", rate=zar
+            )
+
+    def days(self, n):
+        return self.friday + datetime.timedelta(days=n)
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True)
+    def test_hits_until_next_rate(self):
+        self.assertEqual(latest_rate("USD", "ZAR", self.friday), (self.friday, 16))
+        with self.assertNumQueries(0):
+            self.assertEqual(latest_rate("USD", "ZAR", self.days(1)), (self.friday, 16))
+            self.assertEqual(latest_rate("USD", "ZAR", self.days(2)), (self.friday, 16))
+        self.assertEqual(latest_rate.intervals.hits, 2)
+        self.assertEqual(latest_rate("USD", "ZAR", self.days(3)), (self.days(3), 15))
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True)
+    def test_hits_earlier_dates(self):
+        latest_rate("EUR", "USD", self.days(2))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                latest_rate("EUR", "USD", self.friday),
+                (self.friday, Decimal("1.1")),
+            )
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True)
+    def test_misses_after_max_age(self):
+        latest_rate("EUR", "USD", self.days(3))
+        with self.assertNumQueries(0):
+            latest_rate("EUR", "USD", self.days(33))
+        with self.assertRaises(ExchangeRateUnavailable):
+            latest_rate("EUR", "USD", self.days(34))
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True)
+    def test_new_rate_invalidates(self):
+        latest_rate("EUR", "USD", self.friday)
+        ExchangeRate.objects.create(
+            date=self.days(1), base_currency="EUR", currency="USD", rate="1.15"
+        )
+        self.assertEqual(
+            latest_rate("EUR", "USD", self.days(2)),
+            (self.days(1), Decimal("1.15")),
+        )
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True, EXCHANGE_RATE_TABLE=True)
+    def test_rate_table(self):
+        latest_rate("USD", "ZAR", self.friday)
+        with self.assertNumQueries(0):
+            self.assertEqual(latest_rate("USD", "ZAR", self.days(2)), (self.friday, 16))
+            self.assertEqual(
+                latest_rate("USD", "ZAR", self.days(3)), (self.days(3), 15)
+            )
+        self.assertEqual(latest_rate.intervals.hits, 1)
+
+    def test_disabled(self):
+        latest_rate("EUR", "USD", self.friday)
+        self.assertEqual(len(latest_rate.intervals), 0)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    threads = 8
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+
+        @rate_cache
+        def slow(value):
+            self.calls.append(value)
+            self.release.wait(5)
+            if value < 0:
+                raise ValueError(value)
+            return value * 2
+
+        self.slow = slow
+
+    def call_concurrently(self, value):
+        results = [None] * self.threads
+
+        def call(i):
+            try:
+                results[i] = self.slow(value)
+            except ValueError as e:
+                results[i] = e
+
+        threads = [
+            threading.Thread(target=call, args=(i,)) for i in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        # Wait for the followers to queue up behind the leader
+        deadline = time.monotonic() + 5
+        while (
+            self.slow.cache_info().coalesced < self.threads - 1
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesces_concurrent_misses(self):
+        self.assertEqual(self.call_concurrently(1), [2] * self.threads)
+        self.assertEqual(self.calls, [1])
+        info = self.slow.cache_info()
+        self.assertEqual((info.misses, info.coalesced), (1, self.threads - 1))
+
+    def test_errors_shared_with_followers(self):
+        results = self.call_concurrently(-1)
+        self.assertEqual(self.calls, [-1])
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        # Errors aren't cached
+        with self.assertRaises(ValueError):
+            self.slow(-1)
+        self.assertEqual(self.calls, [-1, -1])
+
+    def test_different_keys_not_coalesced(self):
+        self.release.set()
+        self.assertEqual(self.slow(1), 2)
+        self.assertEqual(self.slow(2), 4)
+        self.assertEqual(self.calls, [1, 2])
+
+
+class SharedCacheLockTestCase(SimpleTestCase):
+    caches = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "historical-currencies-lock-tests",
+        },
+    }
+
+    def setUp(self):
+        settings = self.settings(
+            CACHES=self.caches,
+            EXCHANGE_RATE_SHARED_CACHE="default",
+            EXCHANGE_RATE_SHARED_CACHE_LOCK=True,
+            EXCHANGE_RATE_SHARED_CACHE_LOCK_TIMEOUT=5,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+        self.calls = []
+
+        @rate_cache
+        def double(value):
+            self.calls.append(value)
+            return value * 2
+
+        self.double = double
+        self.shared = SharedCache("default")
+        self.shared_key = self.shared.make_key(self.shared.version(), "double", (1,))
+
+    def test_lock_released(self):
+        self.assertEqual(self.double(1), 2)
+        self.assertIsNone(caches["default"].get(f"{self.shared_key}:lock"))
+        self.assertEqual(self.shared.get(self.shared_key), 2)
+
+    def test_waits_for_other_process(self):
+        # Another process holds the lock, and stores its result shortly
+        caches["default"].add(f"{self.shared_key}:lock", 1)
+        timer = threading.Timer(0.1, self.shared.set, (self.shared_key, 2))
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual(self.double(1), 2)
+        self.assertEqual(self.calls, [])
+
+    def test_lock_timeout(self):
+        caches["default"].add(f"{self.shared_key}:lock", 1)
+        with self.settings(EXCHANGE_RATE_SHARED_CACHE_LOCK_TIMEOUT=0.1):
+            self.assertEqual(self.double(1), 2)
+        self.assertEqual(self.calls, [1])
+        # The other process still holds its lock
+        self.assertEqual(caches["default"].get(f"{self.shared_key}:lock"), 1)
+
+
+class SharedCacheTestCase(TestCase):
+    date = datetime.date(2021, 12, 31)
+    caches = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "historical-currencies-tests",
+        },
+    }
+
+    def setUp(self):
+        settings = self.settings(
+            CACHES=self.caches,
+            EXCHANGE_RATE_SHARED_CACHE="default",
+            EXCHANGE_RATE_SHARED_CACHE_VERSION_CHECK=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+        latest_rate.cache_clear()
+        ExchangeRate.objects.create(
+            date=self.date, base_currency="EUR", currency="USD", rate=1.1326
+        )
+
+    def make_worker(self):
+        """A RateCache with its own L1, as if in another process"""
+        return rate_cache(latest_rate.__wrapped__)
+
+    def test_shared_between_workers(self):
+        worker_1 = self.make_worker()
+        worker_2 = self.make_worker()
+        rate = worker_1("EUR", "USD", self.date)
+        with self.assertNumQueries(0):
+            self.assertEqual(worker_2("EUR", "USD", self.date), rate)
+            self.assertEqual(worker_2("EUR", "USD", self.date), rate)
+        info = worker_2.cache_info()
+        self.assertEqual((info.hits, info.shared_hits, info.misses), (1, 1, 0))
+
+    def test_import_invalidates_workers(self):
+        worker_1 = self.make_worker()
+        worker_2 = self.make_worker()
+        self.assertEqual(worker_1("EUR", "USD", self.date)[1], Decimal("1.1326"))
+        self.assertEqual(worker_2("EUR", "USD", self.date)[1], Decimal("1.1326"))
+        ExchangeRate.objects.update(rate=Decimal("1.2"))
+        self.assertEqual(worker_1("EUR", "USD", self.date)[1], Decimal("1.2"))
+        self.assertEqual(worker_2("EUR", "USD", self.date)[1], Decimal("1.2"))
+
+    def test_other_process_import_reloads_rate_table(self):
+        self.addCleanup(clear_rate_table)
+        with self.settings(EXCHANGE_RATE_TABLE=True):
+            self.assertEqual(latest_rate("EUR", "USD", self.date)[1], Decimal("1.1326"))
+            # Another process updates the rates, and invalidates the
+            # shared cache, without signalling this one
+            QuerySet(ExchangeRate).update(rate=Decimal("1.5"))
+            SharedCache("default").invalidate()
+            self.assertEqual(latest_rate("EUR", "USD", self.date)[1], Decimal("1.5"))
+            worker = self.make_worker()
+            self.assertEqual(worker("EUR", "USD", self.date)[1], Decimal("1.5"))
+
+    def test_version_check_interval(self):
+        worker = self.make_worker()
+        with self.settings(EXCHANGE_RATE_SHARED_CACHE_VERSION_CHECK=3600):
+            worker("EUR", "USD", self.date)
+            SharedCache("default").invalidate()
+            with self.assertNumQueries(0):
+                worker("EUR", "USD", self.date)
+
+    @override_settings(EXCHANGE_RATE_INTERVAL_CACHE=True)
+    def test_interval_hits_not_shared(self):
+        worker = self.make_worker()
+        latest_rate.intervals.invalidate()
+        next_day = self.date + datetime.timedelta(days=1)
+        shared = SharedCache("default")
+        worker("EUR", "USD", self.date)
+        with self.assertNumQueries(0):
+            worker("EUR", "USD", next_day)
+        version = shared.version()
+        self.assertIsNot(
+            shared.get(
+                shared.make_key(version, "latest_rate", ("EUR", "USD", self.date))
+            ),
+            _MISSING,
+        )
+        self.assertIs(
+            shared.get(
+                shared.make_key(version, "latest_rate", ("EUR", "USD", next_day))
+            ),
+            _MISSING,
+        )
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            file_caches = {
+                "default": self.caches["default"],
+                "rates": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": location,
+                },
+            }
+            with self.settings(CACHES=file_caches, EXCHANGE_RATE_SHARED_CACHE="rates"):
+                worker_1 = self.make_worker()
+                worker_2 = self.make_worker()
+                rate = worker_1("EUR", "USD", self.date)
+                with self.assertNumQueries(0):
+                    self.assertEqual(worker_2("EUR", "USD", self.date), rate)
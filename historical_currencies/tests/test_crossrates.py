@@ -0,0 +1,232 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+from itertools import permutations
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from historical_currencies.crossrates import (
+    materialized_latest_rate,
+    refresh_cross_rates,
+)
+from historical_currencies.exchange import (
+    _iter_available_rates,
+    latest_rate,
+)
+from historical_currencies.models import (
+    CrossExchangeRate,
+    CrossExchangeRateStatus,
+    ExchangeRate,
+)
+from historical_currencies.tests.test_importers import DATA_DIR
+
+CROSS_PAIRS = list(permutations(["AUD", "EUR", "USD", "ZAR"], 2))
+
+
+@override_settings(EXCHANGE_RATE_CROSS_PAIRS=CROSS_PAIRS)
+class CrossRatesTestCase(TestCase):
+    dates = [
+        datetime.date(2021, 12, 29),
+        datetime.date(2021, 12, 30),
+        datetime.date(2021, 12, 31),
+        datetime.date(2022, 1, 1),
+        datetime.date(2022, 1, 3),
+    ]
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        for date, base_currency, currency, rate in (
+            (datetime.date(2021, 12, 30), "USD", "EUR", "0.8823"),
+            (datetime.date(2021, 12, 30), "USD", "ZAR", "15.897"),
+            (datetime.date(2021, 12, 30), "EUR", "AUD", "1.5594"),
+            (datetime.date(2021, 12, 31), "EUR", "USD", "1.1326"),
+            (datetime.date(2021, 12, 31), "EUR", "ZAR", "18.0625"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency=base_currency, currency=currency, rate=rate
+            )
+
+    def assertMatchesLive(self, currency_from, currency_to, date):
+        expected = max(
+            _iter_available_rates(currency_from, currency_to, date), default=None
+        )
+        materialized, rate = materialized_latest_rate(currency_from, currency_to, date)
+        self.assertTrue(materialized)
+        if expected is None:
+            self.assertIsNone(rate)
+        else:
+            self.assertEqual(rate[0], expected[0])
+            self.assertAlmostEqual(rate[1], expected[1], places=12)
+
+    def test_matches_live_triangulation(self):
+        refresh_cross_rates()
+        for currency_from, currency_to in CROSS_PAIRS:
+            for date in self.dates:
+                with self.subTest(pair=(currency_from, currency_to), date=date):
+                    self.assertMatchesLive(currency_from, currency_to, date)
+
+    def test_single_query(self):
+        refresh_cross_rates()
+        with self.assertNumQueries(1):
+            date, rate = latest_rate("USD", "ZAR", datetime.date(2021, 12, 31))
+        self.assertEqual(date, datetime.date(2021, 12, 31))
+        self.assertAlmostEqual(rate, Decimal("18.0625") / Decimal("1.1326"), places=12)
+
+    def test_unmaterialized_falls_back(self):
+        self.assertEqual(
+            materialized_latest_rate("USD", "ZAR", datetime.date(2021, 12, 31)),
+            (False, None),
+        )
+
+    @override_settings(EXCHANGE_RATE_CROSS_PAIRS=[])
+    def test_unconfigured_pair(self):
+        refresh_cross_rates()
+        self.assertFalse(CrossExchangeRate.objects.exists())
+        self.assertEqual(
+            materialized_latest_rate("USD", "ZAR", datetime.date(2021, 12, 31)),
+            (False, None),
+        )
+
+    def test_stale_falls_back(self):
+        refresh_cross_rates()
+        ExchangeRate.objects.create(
+            date=datetime.date(2022, 1, 3),
+            base_currency="EUR",
+            currency="USD",
+            rate="1.1355",
+        )
+        self.assertEqual(
+            materialized_latest_rate("EUR", "USD", datetime.date(2022, 1, 3)),
+            (False, None),
+        )
+        self.assertEqual(
+            latest_rate("EUR", "USD", datetime.date(2022, 1, 3)),
+            (datetime.date(2022, 1, 3), Decimal("1.1355")),
+        )
+
+    def test_edit_before_materialized_through(self):
+        refresh_cross_rates()
+        date = datetime.date(2021, 12, 31)
+        rate = ExchangeRate.objects.get(date=date, currency="ZAR")
+        rate.rate = Decimal("20")
+        rate.save()
+        self.assertEqual(materialized_latest_rate("USD", "ZAR", date), (False, None))
+        # Earlier dates are unaffected
+        self.assertMatchesLive("USD", "ZAR", datetime.date(2021, 12, 30))
+        self.assertAlmostEqual(
+            latest_rate("USD", "ZAR", date)[1],
+            Decimal("20") / Decimal("1.1326"),
+            places=12,
+        )
+        refresh_cross_rates()
+        self.assertMatchesLive("USD", "ZAR", date)
+
+    def test_delete_before_materialized_through(self):
+        refresh_cross_rates()
+        ExchangeRate.objects.filter(date=datetime.date(2021, 12, 31)).delete()
+        self.assertEqual(
+            materialized_latest_rate("USD", "ZAR", datetime.date(2021, 12, 31)),
+            (False, None),
+        )
+        refresh_cross_rates()
+        for date in self.dates:
+            with self.subTest(date=date):
+                self.assertMatchesLive("USD", "ZAR", date)
+
+    @override_settings(EXCHANGE_RATE_CROSS_PAIRS=[("IDR", "XBT")])
+    def test_tiny_rates_keep_significant_digits(self):
+        date = datetime.date(2021, 12, 31)
+        for currency, rate in (("IDR", "16123.45678"), ("XBT", "0.00002")):
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency=currency, rate=rate
+            )
+        refresh_cross_rates()
+        materialized, (rate_date, rate) = materialized_latest_rate("IDR", "XBT", date)
+        self.assertTrue(materialized)
+        expected = Decimal("0.00002") / Decimal("16123.45678")
+        self.assertLess(abs(rate - expected) / expected, Decimal("1e-12"))
+
+    def test_incremental_refresh(self):
+        refresh_cross_rates()
+        ExchangeRate.objects.create(
+            date=datetime.date(2022, 1, 3),
+            base_currency="EUR",
+            currency="USD",
+            rate="1.1355",
+        )
+        counts = dict(refresh_cross_rates())
+        self.assertEqual(counts[("EUR", "USD")], 1)
+        self.assertEqual(counts[("EUR", "ZAR")], 0)
+        self.assertMatchesLive("EUR", "USD", datetime.date(2022, 1, 3))
+        self.assertMatchesLive("USD", "EUR", datetime.date(2022, 1, 3))
+        self.assertMatchesLive("ZAR", "USD", datetime.date(2022, 1, 3))
+
+    def test_full_refresh(self):
+        refresh_cross_rates()
+        count = CrossExchangeRate.objects.count()
+        refresh_cross_rates(full=True)
+        self.assertEqual(CrossExchangeRate.objects.count(), count)
+
+
+@override_settings(EXCHANGE_RATE_CROSS_PAIRS=[("USD", "ZAR"), ("GBP", "JPY")])
+class MaterializeCrossRatesCommandTestCase(TestCase):
+    url = (DATA_DIR / "eurofxref-hist.xml").as_uri()
+
+    def test_refreshed_after_import(self):
+        out = StringIO()
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=out)
+        status = CrossExchangeRateStatus.objects.get(
+            currency_from="GBP", currency_to="JPY"
+        )
+        self.assertEqual(status.materialized_through, datetime.date(2022, 1, 3))
+        self.assertEqual(
+            CrossExchangeRate.objects.filter(
+                currency_from="GBP", currency_to="JPY"
+            ).count(),
+            3,
+        )
+
+    def test_status(self):
+        out = StringIO()
+        call_command("materialize_cross_rates", "--status", stdout=out)
+        self.assertIn("USD-ZAR: not materialized", out.getvalue())
+
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=out)
+        out = StringIO()
+        call_command("materialize_cross_rates", "--status", stdout=out)
+        self.assertIn(
+            "USD-ZAR: materialized through 2022-01-03, refreshed at",
+            out.getvalue(),
+        )
+        self.assertIn("0 days behind (fresh)", out.getvalue())
+
+        ExchangeRate.objects.create(
+            date=datetime.date(2022, 1, 4),
+            base_currency="EUR",
+            currency="USD",
+            rate="1.1300",
+        )
+        out = StringIO()
+        call_command("materialize_cross_rates", "--status", stdout=out)
+        self.assertIn("1 days behind (stale)", out.getvalue())
+
+        ExchangeRate.objects.filter(date=datetime.date(2022, 1, 3)).update(
+            rate=Decimal("1")
+        )
+        out = StringIO()
+        call_command("materialize_cross_rates", "--status", stdout=out)
+        self.assertIn("1 days behind (stale since 2022-01-03)", out.getvalue())
+
+        # 2022-01-03 is rematerialized; 2022-01-04 has no ZAR rate
+        out = StringIO()
+        call_command("materialize_cross_rates", stdout=out)
+        self.assertIn("USD-ZAR: materialized 1 rates", out.getvalue())
+        out = StringIO()
+        call_command("materialize_cross_rates", "--status", stdout=out)
+        self.assertIn("0 days behind (fresh)", out.getvalue())
+
+    @override_settings(EXCHANGE_RATE_CROSS_PAIRS=[])
+    def test_no_pairs(self):
+        with self.assertRaises(CommandError):
+            call_command("materialize_cross_rates")
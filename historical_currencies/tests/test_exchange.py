@@ -8,9 +8,10 @@ import historical_currencies.exchange  # imported for mock patching # noqa: F401
 from historical_currencies.choices import currency_choices
 from historical_currencies.exceptions import ExchangeRateUnavailable
 from historical_currencies.exchange import (
-    _possible_base_currencies,
     exchange,
+    exchange_many,
     latest_rate,
+    rate_series,
 )
 from historical_currencies.models import ExchangeRate
 
@@ -33,7 +34,6 @@ class SimpleExchangeTestCase(TestCase):
 
     def setUp(self):
         latest_rate.cache_clear()
-        _possible_base_currencies.cache_clear()
         ExchangeRate.objects.create(
             date=self.date, base_currency="EUR", currency="USD", rate=1.1326
         )
@@ -90,7 +90,6 @@ class ComplexExchangeTestCase(TestCase):
 
     def setUp(self):
         latest_rate.cache_clear()
-        _possible_base_currencies.cache_clear()
         ExchangeRate.objects.create(
             date=self.date_1, base_currency="USD", currency="EUR", rate=0.8823
         )
@@ -137,6 +136,21 @@ class ComplexExchangeTestCase(TestCase):
         self.assertEqual(exchange(100, "ZAR", "USD", date=self.date_2), Decimal("6.27"))
         self.assertEqual(exchange(100, "ZAR", "USD", date=self.date_3), Decimal("6.32"))
 
+    def test_fixed_number_of_queries(self):
+        for base_currency in ("GBP", "JPY", "CHF"):
+            ExchangeRate.objects.create(
+                date=self.date_1, base_currency=base_currency, currency="ZAR", rate=10
+            )
+            ExchangeRate.objects.create(
+                date=self.date_1, base_currency=base_currency, currency="USD", rate=1
+            )
+        latest_rate.cache_clear()
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                latest_rate("USD", "ZAR", self.date_3),
+                (self.date_3, Decimal("17.966") / Decimal("1.1355")),
+            )
+
     def test_cant_exchange_across_multiple_bases(self):
         with self.assertRaises(ExchangeRateUnavailable):
             exchange(1, "USD", "AUD", date=self.date_1)
@@ -144,6 +158,135 @@ class ComplexExchangeTestCase(TestCase):
             exchange(1, "ZAR", "AUD", date=self.date_1)
 
 
+class ExchangeManyTestCase(TestCase):
+    date_1 = datetime.date(2021, 12, 30)
+    date_2 = datetime.date(2021, 12, 31)
+    date_3 = datetime.date(2022, 1, 3)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        ExchangeRate.objects.create(
+            date=self.date_1, base_currency="USD", currency="EUR", rate=0.8823
+        )
+        ExchangeRate.objects.create(
+            date=self.date_1, base_currency="USD", currency="ZAR", rate=15.897
+        )
+        ExchangeRate.objects.create(
+            date=self.date_1, base_currency="EUR", currency="AUD", rate=1.5594
+        )
+        ExchangeRate.objects.create(
+            date=self.date_2, base_currency="EUR", currency="USD", rate=1.1326
+        )
+        ExchangeRate.objects.create(
+            date=self.date_2, base_currency="EUR", currency="ZAR", rate=18.0625
+        )
+        ExchangeRate.objects.create(
+            date=self.date_3, base_currency="EUR", currency="USD", rate=1.1355
+        )
+
+    def test_matches_exchange(self):
+        items = [
+            (10, "USD", "EUR", self.date_1),
+            (10, "EUR", "USD", self.date_2),
+            (10, "EUR", "USD", self.date_3),
+            (10, "EUR", "ZAR", self.date_1),
+            (100, "ZAR", "USD", self.date_2),
+            (100, "ZAR", "USD", self.date_3),
+            (100, "ZAR", "ZAR", self.date_3),
+            (1, "USD", "EUR", datetime.date(2022, 1, 15)),
+        ]
+        expected = [exchange(*item) for item in items]
+        with self.assertNumQueries(1):
+            self.assertEqual(exchange_many(items), expected)
+
+    def test_noop_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                exchange_many([(1, "EUR", "EUR", self.date_1)]), [Decimal("1")]
+            )
+
+    def test_without_date(self):
+        today = datetime.date.today()
+        ExchangeRate.objects.create(
+            date=today, base_currency="EUR", currency="USD", rate=1.1
+        )
+        self.assertEqual(exchange_many([(1, "EUR", "USD", None)]), [Decimal("1.10")])
+
+    def test_raises_exception(self):
+        with self.assertRaisesMessage(
+            ExchangeRateUnavailable,
+            "No exchange rate available between USD and AUD for 2021-12-30",
+        ):
+            exchange_many(
+                [
+                    (1, "EUR", "USD", self.date_2),
+                    (1, "USD", "AUD", self.date_1),
+                ]
+            )
+
+    def test_returns_exceptions(self):
+        results = exchange_many(
+            [
+                (1, "EUR", "USD", self.date_2),
+                (1, "USD", "AUD", self.date_1),
+                (1, "EUR", "USD", datetime.date(2022, 2, 3)),
+            ],
+            raise_exceptions=False,
+        )
+        self.assertEqual(results[0], Decimal("1.13"))
+        self.assertIsInstance(results[1], ExchangeRateUnavailable)
+        self.assertEqual(
+            str(results[1]),
+            "No exchange rate available between USD and AUD for 2021-12-30",
+        )
+        self.assertIsInstance(results[2], ExchangeRateUnavailable)
+
+
+class RateSeriesTestCase(TestCase):
+    start = datetime.date(2021, 12, 29)
+    end = datetime.date(2022, 2, 3)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        for date, usd, zar in (
+            (datetime.date(2021, 12, 30), "1.1326", "18.0625"),
+            (datetime.date(2022, 1, 3), "1.1355", "18.1"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency="USD", rate=usd
+            )
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency="ZAR", rate=zar
+            )
+
+    def test_matches_latest_rate(self):
+        with self.assertNumQueries(1):
+            series = list(rate_series("USD", "ZAR", self.start, self.end))
+        self.assertEqual(len(series), 37)
+        for date, rate in series:
+            try:
+                expected = latest_rate("USD", "ZAR", date)[1]
+            except ExchangeRateUnavailable:
+                expected = None
+            self.assertEqual(rate, expected, date)
+
+    def test_forward_fills(self):
+        series = dict(rate_series("EUR", "USD", self.start, self.end))
+        self.assertIsNone(series[datetime.date(2021, 12, 29)])
+        self.assertEqual(series[datetime.date(2022, 1, 2)], Decimal("1.1326"))
+        self.assertEqual(series[datetime.date(2022, 2, 2)], Decimal("1.1355"))
+        self.assertIsNone(series[datetime.date(2022, 2, 3)])
+
+    def test_lazy(self):
+        with self.assertNumQueries(0):
+            series = rate_series("EUR", "USD", self.start, self.end)
+        with self.assertNumQueries(1):
+            next(series)
+
+    def test_empty_range(self):
+        self.assertEqual(list(rate_series("EUR", "USD", self.end, self.start)), [])
+
+
 class CurrencyChoicesTestCase(SimpleTestCase):
     def test_expected_contents(self):
         choices = currency_choices()
@@ -162,3 +305,7 @@ class CurrencyChoicesTestCase(SimpleTestCase):
         self.assertIn("XTS", codes)
         self.assertIn("XXX", codes)
         self.assertIn("XCD", codes)
+
+    def test_returns_copies(self):
+        currency_choices().clear()
+        self.assertTrue(currency_choices())
@@ -0,0 +1,108 @@
+import datetime
+import unittest
+from decimal import Decimal
+from itertools import product
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase
+
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.exchange import exchange
+from historical_currencies.expressions import exchange_rate, exchanged_amount
+from historical_currencies.models import ExchangeRate
+from tests.models import Invoice
+
+
+@unittest.skipIf(django.VERSION < (3, 0), "Requires Django >= 3.0")
+class ExchangedAmountTestCase(TestCase):
+    date_1 = datetime.date(2021, 12, 30)
+    date_2 = datetime.date(2021, 12, 31)
+    date_3 = datetime.date(2022, 1, 3)
+
+    def setUp(self):
+        for date, base_currency, currency, rate in (
+            (self.date_1, "USD", "EUR", "0.8823"),
+            (self.date_1, "USD", "ZAR", "15.897"),
+            (self.date_1, "EUR", "AUD", "1.5594"),
+            (self.date_2, "EUR", "USD", "1.1326"),
+            (self.date_2, "EUR", "ZAR", "18.0625"),
+            (self.date_3, "EUR", "USD", "1.1355"),
+            (self.date_3, "EUR", "ZAR", "17.966"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency=base_currency, currency=currency, rate=rate
+            )
+
+    def test_matches_exchange(self):
+        dates = [
+            self.date_1,
+            self.date_2,
+            self.date_3,
+            datetime.date(2022, 1, 20),
+            datetime.date(2022, 3, 1),
+        ]
+        currencies = ["AUD", "EUR", "USD", "ZAR"]
+        for date, currency in product(dates, currencies):
+            Invoice.objects.create(
+                amount=Decimal("123.45"), currency=currency, date=date
+            )
+
+        for currency_to in currencies:
+            invoices = Invoice.objects.annotate(
+                converted=exchanged_amount("amount", "currency", "date", currency_to)
+            )
+            for invoice in invoices:
+                with self.subTest(
+                    currency=invoice.currency, date=invoice.date, to=currency_to
+                ):
+                    try:
+                        expected = exchange(
+                            invoice.amount, invoice.currency, currency_to, invoice.date
+                        )
+                    except ExchangeRateUnavailable:
+                        self.assertIsNone(invoice.converted)
+                    else:
+                        self.assertEqual(invoice.converted.quantize(expected), expected)
+
+    def test_aggregate(self):
+        Invoice.objects.create(amount=Decimal(10), currency="USD", date=self.date_2)
+        Invoice.objects.create(amount=Decimal(10), currency="ZAR", date=self.date_3)
+        Invoice.objects.create(amount=Decimal(10), currency="EUR", date=self.date_1)
+        with self.assertNumQueries(1):
+            total = Invoice.objects.aggregate(
+                total=Sum(exchanged_amount("amount", "currency", "date", "EUR"))
+            )["total"]
+        expected = (
+            Decimal(10) / Decimal("1.1326") + Decimal(10) / Decimal("17.966") + 10
+        )
+        self.assertAlmostEqual(total, expected, places=6)
+
+    def test_integral_rates(self):
+        ExchangeRate.objects.create(
+            date=self.date_3, base_currency="EUR", currency="JPY", rate=130
+        )
+        Invoice.objects.create(amount=Decimal(100), currency="JPY", date=self.date_3)
+        invoice = Invoice.objects.annotate(
+            rate=exchange_rate("currency", "date", "EUR")
+        ).get()
+        self.assertAlmostEqual(invoice.rate, Decimal(1) / 130, places=10)
+
+    def test_constant_date(self):
+        Invoice.objects.create(amount=Decimal(10), currency="USD", date=self.date_1)
+        invoice = Invoice.objects.annotate(
+            converted=exchanged_amount("amount", "currency", self.date_3, "ZAR")
+        ).get()
+        self.assertAlmostEqual(
+            invoice.converted,
+            10 * Decimal("17.966") / Decimal("1.1355"),
+            places=6,
+        )
+
+
+@unittest.skipUnless(django.VERSION < (3, 0), "Supported on Django >= 3.0")
+class UnsupportedDjangoTestCase(SimpleTestCase):
+    def test_exchange_rate(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "Django >= 3.0"):
+            exchange_rate("currency", "date", "EUR")
@@ -2,7 +2,7 @@ from decimal import Decimal
 
 from django.test import SimpleTestCase
 
-from historical_currencies.formatting import render_amount
+from historical_currencies.formatting import render_amount, render_amounts
 
 
 class CurrencyRenderTestCase(SimpleTestCase):
@@ -11,3 +11,19 @@ class CurrencyRenderTestCase(SimpleTestCase):
 
     def test_renders_yen(self):
         self.assertEqual(render_amount(Decimal(1000), "JPY"), "1000 JPY")
+
+    def test_renders_dinar(self):
+        self.assertEqual(render_amount(Decimal("1.2346"), "KWD"), "1.235 KWD")
+
+    def test_renders_gold(self):
+        self.assertEqual(render_amount(Decimal("1.2345"), "XAU"), "1.2345 XAU")
+
+    def test_unknown_currency(self):
+        with self.assertRaises(ValueError):
+            render_amount(Decimal(1), "ZZZ")
+
+    def test_renders_amounts(self):
+        self.assertEqual(
+            render_amounts([(Decimal(1000), "ZAR"), (Decimal("1000.4"), "JPY")]),
+            ["1000.00 ZAR", "1000 JPY"],
+        )
@@ -1,11 +1,568 @@
 import datetime
+import json
+import threading
+import unittest
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlparse
 
 from django.conf import settings
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase, tag
+from django.test.utils import CaptureQueriesContext
 
-from historical_currencies.models import ExchangeRate
+from historical_currencies.crossrates import (
+    materialized_latest_rate,
+    refresh_cross_rates,
+)
+from historical_currencies.importing import RatePipeline, _CopyReader
+from historical_currencies.management.commands import (
+    import_ecb_exchangerates,
+    import_openexchangerates,
+)
+from historical_currencies.models import (
+    CrossExchangeRate,
+    ExchangeRate,
+    StagedExchangeRate,
+)
+from historical_currencies.providers import RateProvider
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+STAGING_INSERT = f'INSERT INTO "{StagedExchangeRate._meta.db_table}"'
+EXCHANGE_RATE_WRITES = (
+    f'INSERT INTO "{ExchangeRate._meta.db_table}"',
+    f'UPDATE "{ExchangeRate._meta.db_table}"',
+)
+
+
+class ECBFileImportTestCase(TestCase):
+    url = (DATA_DIR / "eurofxref-hist.xml").as_uri()
+
+    def test_ecb_file_import(self):
+        out = StringIO()
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=out)
+        self.assertEqual(ExchangeRate.objects.count(), 12)
+        rate = ExchangeRate.objects.get(
+            date=datetime.date(2021, 12, 31), base_currency="EUR", currency="ZAR"
+        )
+        self.assertEqual(rate.rate, Decimal("18.0625"))
+
+    @unittest.skipIf(connection.vendor == "postgresql", "Staged with COPY")
+    def test_ecb_file_import_batches(self):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "import_ecb_exchangerates",
+                "--url",
+                self.url,
+                "--batch-size",
+                "5",
+                stdout=out,
+            )
+        staged = [q for q in queries if q["sql"].startswith(STAGING_INSERT)]
+        self.assertEqual(len(staged), 3)
+        self.assertEqual(ExchangeRate.objects.count(), 12)
+
+    def test_ecb_file_import_is_idempotent(self):
+        out = StringIO()
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=out)
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=out)
+        self.assertEqual(ExchangeRate.objects.count(), 12)
+
+    def test_ecb_invalid_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "import_ecb_exchangerates", "--url", self.url, "--batch-size", "0"
+            )
+
+
+class ECBUpsertTestCase(TestCase):
+    url = (DATA_DIR / "eurofxref-hist.xml").as_uri()
+
+    def setUp(self):
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=StringIO())
+        ExchangeRate.objects.filter(
+            date=datetime.date(2021, 12, 31), currency="ZAR"
+        ).update(rate=Decimal("1"))
+        ExchangeRate.objects.filter(
+            date=datetime.date(2022, 1, 3), currency="USD"
+        ).delete()
+
+    def upsert(self, *args):
+        out = StringIO()
+        call_command(
+            "import_ecb_exchangerates", "--url", self.url, "--upsert", *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_without_upsert(self):
+        call_command("import_ecb_exchangerates", "--url", self.url, stdout=StringIO())
+        zar = ExchangeRate.objects.get(date=datetime.date(2021, 12, 31), currency="ZAR")
+        self.assertEqual(zar.rate, Decimal("1"))
+
+    def test_upsert(self):
+        self.assertEqual(self.upsert(), "Inserted 1, updated 1, unchanged 10 rates\n")
+        self.assertEqual(ExchangeRate.objects.count(), 12)
+        zar = ExchangeRate.objects.get(date=datetime.date(2021, 12, 31), currency="ZAR")
+        self.assertEqual(zar.rate, Decimal("18.0625"))
+
+    def test_upsert_skips_unchanged(self):
+        self.upsert()
+        with CaptureQueriesContext(connection) as queries:
+            output = self.upsert()
+        self.assertEqual(output, "Inserted 0, updated 0, unchanged 12 rates\n")
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith(EXCHANGE_RATE_WRITES)]
+        )
+
+    @unittest.skipIf(connection.vendor == "postgresql", "Staged with COPY")
+    def test_upsert_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.upsert("--batch-size", "4")
+        staged = [q for q in queries if q["sql"].startswith(STAGING_INSERT)]
+        self.assertEqual(len(staged), 3)
+
+    def test_upsert_refreshes_cross_rates(self):
+        with self.settings(EXCHANGE_RATE_CROSS_PAIRS=[("USD", "ZAR")]):
+            call_command("materialize_cross_rates", stdout=StringIO())
+            cross_rate = CrossExchangeRate.objects.get(date=datetime.date(2021, 12, 31))
+            self.assertAlmostEqual(cross_rate.rate, 1 / Decimal("1.1326"), places=12)
+            self.upsert()
+        cross_rate = CrossExchangeRate.objects.get(date=datetime.date(2021, 12, 31))
+        self.assertAlmostEqual(
+            cross_rate.rate, Decimal("18.0625") / Decimal("1.1326"), places=12
+        )
+
+
+class ListProvider(RateProvider):
+    def __init__(self, rates, error=None):
+        self.rates = rates
+        self.error = error
+
+    def iter_rates(self):
+        yield from self.rates
+        if self.error:
+            raise self.error
+
+
+class RatePipelineTestCase(TestCase):
+    def rate(self, day, currency, rate):
+        return ExchangeRate(
+            date=datetime.date(2022, 1, day),
+            base_currency="EUR",
+            currency=currency,
+            rate=Decimal(rate),
+        )
+
+    def test_run(self):
+        pipeline = RatePipeline()
+        pipeline.run(
+            ListProvider([self.rate(3, "USD", "1.1355"), self.rate(4, "USD", "1.13")])
+        )
+        self.assertEqual(pipeline.inserted, 2)
+        self.assertEqual(pipeline.written_since, datetime.date(2022, 1, 3))
+        self.assertIsNone(pipeline.updated_since)
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+        self.assertFalse(StagedExchangeRate.objects.exists())
+
+    def test_last_duplicate_wins(self):
+        pipeline = RatePipeline(upsert=True)
+        pipeline.run(
+            ListProvider([self.rate(3, "USD", "1.1"), self.rate(3, "USD", "1.2")])
+        )
+        self.assertEqual(pipeline.summary(), "Inserted 1, updated 0, unchanged 0 rates")
+        self.assertEqual(ExchangeRate.objects.get().rate, Decimal("1.2"))
+
+    def test_duplicates_replaced_in_batches(self):
+        pipeline = RatePipeline(upsert=True, batch_size=1)
+        pipeline.run(
+            ListProvider(
+                [
+                    self.rate(3, "USD", "1.1"),
+                    self.rate(3, "USD", "1.2"),
+                    self.rate(4, "USD", "1.13"),
+                    self.rate(3, "USD", "1.3"),
+                ]
+            )
+        )
+        self.assertEqual(pipeline.summary(), "Inserted 2, updated 0, unchanged 0 rates")
+        self.assertEqual(
+            ExchangeRate.objects.get(date=datetime.date(2022, 1, 3)).rate,
+            Decimal("1.3"),
+        )
+
+    def test_upsert(self):
+        self.rate(3, "USD", "1").save()
+        self.rate(4, "USD", "1.13").save()
+        pipeline = RatePipeline(upsert=True)
+        pipeline.run(
+            ListProvider(
+                [
+                    self.rate(3, "USD", "1.1355"),
+                    self.rate(4, "USD", "1.13"),
+                    self.rate(5, "USD", "1.12"),
+                ]
+            )
+        )
+        self.assertEqual(pipeline.summary(), "Inserted 1, updated 1, unchanged 1 rates")
+        self.assertEqual(pipeline.updated_since, datetime.date(2022, 1, 3))
+        self.assertEqual(
+            ExchangeRate.objects.get(date=datetime.date(2022, 1, 3)).rate,
+            Decimal("1.1355"),
+        )
+
+    def test_backfill_refreshes_cross_rates(self):
+        with self.settings(EXCHANGE_RATE_CROSS_PAIRS=[("USD", "ZAR")]):
+            RatePipeline().run(
+                ListProvider([self.rate(4, "USD", "1.13"), self.rate(4, "ZAR", "18")])
+            )
+            with mock.patch(
+                "historical_currencies.importing.refresh_cross_rates",
+                wraps=refresh_cross_rates,
+            ) as refresh:
+                RatePipeline().run(
+                    ListProvider(
+                        [self.rate(3, "USD", "1.1"), self.rate(3, "ZAR", "17")]
+                    )
+                )
+            refresh.assert_called_once_with(since=datetime.date(2022, 1, 3))
+            materialized, rate = materialized_latest_rate(
+                "USD", "ZAR", datetime.date(2022, 1, 3)
+            )
+        self.assertTrue(materialized)
+        self.assertEqual(rate[0], datetime.date(2022, 1, 3))
+        self.assertAlmostEqual(rate[1], Decimal("17") / Decimal("1.1"), places=12)
+
+    def test_failed_import_is_not_merged(self):
+        pipeline = RatePipeline(batch_size=1)
+        provider = ListProvider(
+            [self.rate(3, "USD", "1.1355")], error=RuntimeError("feed truncated")
+        )
+        with self.assertRaises(RuntimeError):
+            pipeline.run(provider)
+        self.assertFalse(ExchangeRate.objects.exists())
+        self.assertFalse(StagedExchangeRate.objects.exists())
+
+
+class CopyReaderTestCase(unittest.TestCase):
+    def test_read(self):
+        rows = [("a", 1), ("b\tc", Decimal("1.5")), ("d\\e", None)]
+        reader = _CopyReader(rows)
+        self.assertEqual(reader.read(3), "a\t1")
+        self.assertEqual(reader.read(), "\nb\\tc\t1.5\nd\\\\e\tNone\n")
+        self.assertEqual(reader.read(8192), "")
+
+    def test_reads_rows_as_needed(self):
+        consumed = []
+
+        def rows():
+            for i in range(10):
+                consumed.append(i)
+                yield (i,)
+
+        reader = _CopyReader(rows())
+        self.assertEqual(reader.read(4), "0\n1\n")
+        self.assertEqual(consumed, [0, 1])
+        self.assertEqual(reader.read(1), "2")
+        self.assertEqual(consumed, [0, 1, 2])
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "COPY requires PostgreSQL")
+class PostgreSQLCopyTestCase(TestCase):
+    def test_stage(self):
+        pipeline = RatePipeline()
+        rates = [
+            ExchangeRate(
+                date=datetime.date(2022, 1, 3),
+                base_currency="EUR",
+                currency=currency,
+                rate=Decimal("1.1355"),
+            )
+            for currency in ("USD", "A\tB", "C\\D", "E\nF")
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            pipeline.stage(rates)
+        self.assertFalse([q for q in queries if q["sql"].startswith(STAGING_INSERT)])
+        self.assertEqual(
+            sorted(
+                StagedExchangeRate.objects.filter(batch=pipeline.batch).values_list(
+                    "currency", "rate"
+                )
+            ),
+            sorted((rate.currency, rate.rate) for rate in rates),
+        )
+
+    def test_failed_copy_rolls_back_to_savepoint(self):
+        pipeline = RatePipeline()
+        provider = ListProvider([], error=RuntimeError("feed truncated"))
+        with self.assertRaises(RuntimeError):
+            pipeline.run(provider)
+        # The test's transaction is still usable
+        self.assertFalse(StagedExchangeRate.objects.exists())
+
+
+class ECBUpdateTestCase(TestCase):
+    url = (DATA_DIR / "eurofxref-hist.xml").as_uri()
+
+    def setUp(self):
+        self.command = import_ecb_exchangerates.Command()
+
+    def test_update_url_empty(self):
+        self.assertEqual(
+            self.command.update_url(None, datetime.date(2022, 1, 4)),
+            import_ecb_exchangerates.HISTORICAL_URL,
+        )
+
+    def test_update_url_daily(self):
+        # Friday -> Monday
+        self.assertEqual(
+            self.command.update_url(
+                datetime.date(2021, 12, 31), datetime.date(2022, 1, 3)
+            ),
+            import_ecb_exchangerates.DAILY_URL,
+        )
+
+    def test_update_url_90_days(self):
+        # Thursday -> Monday
+        self.assertEqual(
+            self.command.update_url(
+                datetime.date(2021, 12, 30), datetime.date(2022, 1, 3)
+            ),
+            import_ecb_exchangerates.HIST_90D_URL,
+        )
+
+    def test_update_url_historical(self):
+        self.assertEqual(
+            self.command.update_url(
+                datetime.date(2021, 9, 1), datetime.date(2022, 1, 3)
+            ),
+            import_ecb_exchangerates.HISTORICAL_URL,
+        )
+
+    def test_update_imports_new_rates(self):
+        ExchangeRate.objects.create(
+            date=datetime.date(2021, 12, 30),
+            base_currency="EUR",
+            currency="USD",
+            rate=Decimal("1.1"),
+        )
+        with mock.patch.object(
+            import_ecb_exchangerates, "HISTORICAL_URL", self.url
+        ), mock.patch.object(import_ecb_exchangerates, "HIST_90D_URL", self.url):
+            call_command("import_ecb_exchangerates", "--update", stdout=StringIO())
+        self.assertEqual(ExchangeRate.objects.count(), 9)
+        self.assertEqual(
+            ExchangeRate.objects.get(date=datetime.date(2021, 12, 30)).rate,
+            Decimal("1.1"),
+        )
+        self.assertEqual(
+            ExchangeRate.objects.filter(date=datetime.date(2022, 1, 3)).count(), 4
+        )
+
+    def test_update_empty_database(self):
+        with mock.patch.object(import_ecb_exchangerates, "HISTORICAL_URL", self.url):
+            call_command("import_ecb_exchangerates", "--update", stdout=StringIO())
+        self.assertEqual(ExchangeRate.objects.count(), 12)
+
+    def test_update_up_to_date(self):
+        ExchangeRate.objects.create(
+            date=datetime.date.today(),
+            base_currency="EUR",
+            currency="USD",
+            rate=Decimal("1.1"),
+        )
+        out = StringIO()
+        call_command("import_ecb_exchangerates", "--update", stdout=out)
+        self.assertEqual(out.getvalue(), "Already up to date\n")
+
+    def test_update_conflicts_with_url(self):
+        with self.assertRaises(CommandError):
+            call_command("import_ecb_exchangerates", "--update", "--url", self.url)
+
+
+class StubOXRHandler(BaseHTTPRequestHandler):
+    """Serves canned OpenExchangeRates.org API responses"""
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        with server.lock:
+            server.requests.append(path)
+            failures = server.failures.get(path)
+            status = failures.pop(0) if failures else 200
+        if status != 200:
+            self.send_error(status)
+            return
+        if path == "/api/usage.json":
+            body = {
+                "data": {
+                    "plan": {
+                        "features": {
+                            "base": False,
+                            "time-series": server.time_series,
+                        }
+                    },
+                    "usage": {"requests_remaining": server.requests_remaining},
+                }
+            }
+        elif path.startswith("/api/historical/"):
+            day = datetime.date.fromisoformat(path.rsplit("/", 1)[1][:-5])
+            body = {
+                "base": "USD",
+                "rates": {"USD": 1, "EUR": 0.8 + day.day / 1000},
+            }
+        elif path == "/api/time-series.json":
+            query = parse_qs(urlparse(self.path).query)
+            start = datetime.date.fromisoformat(query["start"][0])
+            end = datetime.date.fromisoformat(query["end"][0])
+            rates = {}
+            while start <= end:
+                rates[start.isoformat()] = {"EUR": 0.8 + start.day / 1000}
+                start += datetime.timedelta(days=1)
+            body = {
+                "start_date": query["start"][0],
+                "end_date": query["end"][0],
+                "base": "USD",
+                "rates": rates,
+            }
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class OXRStubImportTestCase(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOXRHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.requests_remaining = 1000
+        self.server.time_series = False
+        thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={"poll_interval": 0.01},
+            daemon=True,
+        )
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        port = self.server.server_address[1]
+        settings = self.settings(
+            OPEN_EXCHANGE_RATES_API_URL=f"http://127.0.0.1:{port}/api/",
+            OPEN_EXCHANGE_RATES_APP_ID="test",
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        backoff = mock.patch.object(
+            import_openexchangerates.Command, "retry_backoff", 0
+        )
+        backoff.start()
+        self.addCleanup(backoff.stop)
+
+    def import_since(self, since, *args):
+        call_command(
+            "import_openexchangerates",
+            "--since",
+            since.isoformat(),
+            *args,
+            stdout=StringIO(),
+        )
+
+    def test_concurrent_import(self):
+        since = datetime.date.today() - datetime.timedelta(days=10)
+        self.import_since(since, "--concurrency", "4")
+        self.assertEqual(
+            ExchangeRate.objects.filter(base_currency="USD", currency="EUR").count(),
+            10,
+        )
+        day = datetime.date.today() - datetime.timedelta(days=3)
+        rate = ExchangeRate.objects.get(date=day, currency="EUR")
+        self.assertEqual(rate.rate, Decimal("0.8") + Decimal(day.day) / 1000)
+        self.assertEqual(len(self.server.requests), 11)
+
+    def test_time_series_import(self):
+        self.server.time_series = True
+        since = datetime.date.today() - datetime.timedelta(days=40)
+        self.import_since(since)
+        rates = ExchangeRate.objects.filter(base_currency="USD", currency="EUR")
+        self.assertEqual(rates.count(), 40)
+        day = datetime.date.today() - datetime.timedelta(days=3)
+        rate = rates.get(date=day)
+        self.assertEqual(rate.rate, Decimal("0.8") + Decimal(day.day) / 1000)
+        self.assertEqual(
+            [path for path in self.server.requests if path != "/api/usage.json"],
+            ["/api/time-series.json"] * 2,
+        )
+
+    def test_upsert(self):
+        day = datetime.date.today() - datetime.timedelta(days=2)
+        ExchangeRate.objects.create(
+            date=day, base_currency="USD", currency="EUR", rate=Decimal("2")
+        )
+        out = StringIO()
+        call_command(
+            "import_openexchangerates",
+            "--since",
+            day.isoformat(),
+            "--upsert",
+            stdout=out,
+        )
+        self.assertEqual(out.getvalue(), "Inserted 3, updated 1, unchanged 0 rates\n")
+        rate = ExchangeRate.objects.get(date=day, currency="EUR")
+        self.assertEqual(rate.rate, Decimal("0.8") + Decimal(day.day) / 1000)
+
+    def test_retries_server_errors(self):
+        day = datetime.date.today() - datetime.timedelta(days=1)
+        self.server.failures[f"/api/historical/{day.isoformat()}.json"] = [503, 429]
+        self.import_since(day)
+        self.assertTrue(ExchangeRate.objects.filter(date=day).exists())
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_gives_up_after_retries(self):
+        day = datetime.date.today() - datetime.timedelta(days=1)
+        self.server.failures[f"/api/historical/{day.isoformat()}.json"] = [503] * 3
+        with self.assertRaises(HTTPError):
+            self.import_since(day, "--retries", "2")
+        self.assertFalse(ExchangeRate.objects.exists())
+
+    def test_doesnt_retry_client_errors(self):
+        day = datetime.date.today() - datetime.timedelta(days=1)
+        self.server.failures[f"/api/historical/{day.isoformat()}.json"] = [403]
+        with self.assertRaises(HTTPError):
+            self.import_since(day)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_retries_respect_quota(self):
+        day = datetime.date.today() - datetime.timedelta(days=2)
+        self.server.requests_remaining = 2
+        self.server.failures[f"/api/historical/{day.isoformat()}.json"] = [503]
+        with self.assertRaisesMessage(CommandError, "quota exhausted"):
+            self.import_since(day)
+
+    def test_insufficient_quota(self):
+        since = datetime.date.today() - datetime.timedelta(days=10)
+        self.server.requests_remaining = 5
+        with self.assertRaisesMessage(Exception, "Insufficient quota"):
+            self.import_since(since, "--concurrency", "4")
+        self.assertEqual(self.server.requests, ["/api/usage.json"])
 
 
 @tag("internet")
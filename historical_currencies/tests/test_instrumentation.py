@@ -0,0 +1,160 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+import django
+from django.test import SimpleTestCase, TestCase
+
+from historical_currencies.exceptions import ExchangeRateUnavailable
+from historical_currencies.exchange import alatest_rate, latest_rate
+from historical_currencies.instrumentation import Histogram, RateMetrics
+from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import clear_rate_table
+from historical_currencies.signals import rate_resolved, rate_unavailable
+
+
+class InstrumentationTestCase(TestCase):
+    date = datetime.date(2021, 12, 31)
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        for currency, rate in (("USD", "1.1326"), ("ZAR", "18.0625")):
+            ExchangeRate.objects.create(
+                date=self.date, base_currency="EUR", currency=currency, rate=rate
+            )
+        latest_rate.cache_clear()
+        self.resolved = []
+        self.unavailable = []
+        rate_resolved.connect(self.on_resolved)
+        self.addCleanup(rate_resolved.disconnect, self.on_resolved)
+        rate_unavailable.connect(self.on_unavailable)
+        self.addCleanup(rate_unavailable.disconnect, self.on_unavailable)
+
+    def on_resolved(self, sender, **kwargs):
+        self.resolved.append(kwargs)
+
+    def on_unavailable(self, sender, **kwargs):
+        self.unavailable.append(kwargs)
+
+    def test_direct_miss_then_hit(self):
+        latest_rate("EUR", "USD", self.date)
+        latest_rate("EUR", "USD", self.date)
+        miss, hit = self.resolved
+        self.assertEqual(
+            (miss["currency_from"], miss["currency_to"], miss["date"]),
+            ("EUR", "USD", self.date),
+        )
+        self.assertEqual(
+            (miss["cache"], miss["source"], miss["method"]),
+            ("miss", "database", "direct"),
+        )
+        self.assertEqual(miss["queries"], 3)
+        self.assertTrue(miss["available"])
+        self.assertEqual(
+            (hit["cache"], hit["source"], hit["method"], hit["queries"]),
+            ("hit", None, None, 0),
+        )
+        self.assertGreaterEqual(miss["duration"], 0)
+
+    def test_triangulated(self):
+        latest_rate("USD", "ZAR", self.date)
+        (resolution,) = self.resolved
+        self.assertEqual(resolution["method"], "triangulated")
+
+    def test_rate_table(self):
+        self.addCleanup(clear_rate_table)
+        with self.settings(EXCHANGE_RATE_TABLE=True):
+            latest_rate("USD", "ZAR", self.date)
+        (resolution,) = self.resolved
+        self.assertEqual(
+            (resolution["source"], resolution["method"]),
+            ("rate_table", "triangulated"),
+        )
+        # The latest id, for the freshness check, then the table
+        self.assertEqual(resolution["queries"], 2)
+
+    def test_unavailable(self):
+        with self.assertRaises(ExchangeRateUnavailable):
+            latest_rate("USD", "JPY", self.date)
+        (unavailable,) = self.unavailable
+        self.assertEqual(unavailable["currency_to"], "JPY")
+        self.assertIsInstance(unavailable["exception"], ExchangeRateUnavailable)
+        (resolution,) = self.resolved
+        self.assertFalse(resolution["available"])
+        self.assertEqual(resolution["source"], "database")
+        self.assertIsNone(resolution["method"])
+
+    def test_keyword_arguments(self):
+        latest_rate("EUR", "USD", date=self.date)
+        self.assertEqual(self.resolved[0]["date"], self.date)
+
+    @unittest.skipIf(django.VERSION < (4, 1), "Async ORM requires Django >= 4.1")
+    async def test_async(self):
+        await alatest_rate("USD", "ZAR", self.date)
+        await alatest_rate("USD", "ZAR", self.date)
+        with self.assertRaises(ExchangeRateUnavailable):
+            await alatest_rate("USD", "JPY", self.date)
+        miss, hit, unavailable = self.resolved
+        self.assertEqual(
+            (miss["cache"], miss["source"], miss["method"], miss["queries"]),
+            ("miss", "database", "triangulated", None),
+        )
+        self.assertEqual(hit["cache"], "hit")
+        self.assertFalse(unavailable["available"])
+        (error,) = self.unavailable
+        self.assertEqual(error["currency_to"], "JPY")
+
+    def test_metrics(self):
+        metrics = RateMetrics()
+        metrics.connect()
+        self.addCleanup(metrics.disconnect)
+        self.assertIsNone(metrics.hit_ratio())
+        latest_rate("EUR", "USD", self.date)
+        latest_rate("EUR", "USD", self.date)
+        latest_rate("USD", "ZAR", self.date)
+        latest_rate("EUR", "EUR", self.date)
+        with self.assertRaises(ExchangeRateUnavailable):
+            latest_rate("USD", "JPY", self.date)
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot["counters"],
+            {
+                "resolutions": 5,
+                "cache_hits": 1,
+                "cache_misses": 4,
+                "queries": 9,
+                "source_database": 3,
+                "method_direct": 1,
+                "method_triangulated": 1,
+                "method_identity": 1,
+                "unavailable": 1,
+            },
+        )
+        self.assertEqual(metrics.hit_ratio(), 0.2)
+        self.assertEqual(snapshot["latency"]["miss"]["count"], 4)
+        self.assertEqual(snapshot["latency"]["hit"]["count"], 1)
+
+
+class UninstrumentedTestCase(TestCase):
+    def test_no_receivers(self):
+        latest_rate.cache_clear()
+        self.assertFalse(rate_resolved.has_listeners())
+        self.assertEqual(
+            latest_rate("EUR", "EUR", datetime.date(2021, 12, 31)),
+            (datetime.date(2021, 12, 31), Decimal(1)),
+        )
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_cumulative_buckets(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.snapshot(),
+            {
+                "buckets": {0.1: 2, 1: 3, float("inf"): 4},
+                "count": 4,
+                "sum": 2.65,
+            },
+        )
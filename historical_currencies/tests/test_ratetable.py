@@ -0,0 +1,186 @@
+import datetime
+from decimal import Decimal
+from itertools import permutations
+
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase
+
+from historical_currencies.exchange import (
+    _iter_available_rates,
+    exchange,
+    latest_rate,
+)
+from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import (
+    RateTable,
+    clear_rate_table,
+    get_rate_table,
+)
+
+
+class RateTableTestCase(SimpleTestCase):
+    date = datetime.date(2021, 12, 31)
+
+    def setUp(self):
+        self.table = RateTable.from_rows(
+            [
+                (self.date, "EUR", "USD", Decimal("1.1326")),
+                (self.date, "EUR", "ZAR", Decimal("18.0625")),
+            ]
+        )
+
+    def test_len(self):
+        self.assertEqual(len(self.table), 2)
+
+    def test_noop(self):
+        self.assertEqual(
+            self.table.latest_rate("USD", "USD", self.date), (self.date, Decimal(1))
+        )
+
+    def test_direct(self):
+        self.assertEqual(
+            self.table.latest_rate("EUR", "USD", self.date),
+            (self.date, Decimal("1.1326")),
+        )
+
+    def test_inverse(self):
+        self.assertEqual(
+            self.table.latest_rate("USD", "EUR", self.date),
+            (self.date, 1 / Decimal("1.1326")),
+        )
+
+    def test_triangulated(self):
+        self.assertEqual(
+            self.table.latest_rate("USD", "ZAR", self.date),
+            (self.date, Decimal("18.0625") / Decimal("1.1326")),
+        )
+
+    def test_too_old(self):
+        self.assertIsNone(
+            self.table.latest_rate("EUR", "USD", datetime.date(2022, 2, 1), max_age=30)
+        )
+
+    def test_too_new(self):
+        self.assertIsNone(
+            self.table.latest_rate("EUR", "USD", datetime.date(2021, 12, 30))
+        )
+
+    def test_unsorted_rows(self):
+        self.table.add_rows(
+            [
+                (datetime.date(2022, 1, 3), "EUR", "USD", Decimal("1.1355")),
+                (datetime.date(2021, 12, 30), "EUR", "USD", Decimal("1.1300")),
+            ]
+        )
+        self.assertEqual(
+            self.table.latest_rate("EUR", "USD", self.date),
+            (self.date, Decimal("1.1326")),
+        )
+        self.assertEqual(
+            self.table.latest_rate("EUR", "USD", datetime.date(2021, 12, 30)),
+            (datetime.date(2021, 12, 30), Decimal("1.13")),
+        )
+
+
+class RateTableDatabaseTestCase(TestCase):
+    currencies = ("AUD", "EUR", "USD", "ZAR")
+    dates = [
+        datetime.date(2021, 12, 29),
+        datetime.date(2021, 12, 30),
+        datetime.date(2021, 12, 31),
+        datetime.date(2022, 1, 1),
+        datetime.date(2022, 1, 3),
+        datetime.date(2022, 1, 31),
+        datetime.date(2022, 2, 3),
+    ]
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        clear_rate_table()
+        self.addCleanup(clear_rate_table)
+        for date, base_currency, currency, rate in (
+            (datetime.date(2021, 12, 30), "USD", "EUR", "0.8823"),
+            (datetime.date(2021, 12, 30), "USD", "ZAR", "15.897"),
+            (datetime.date(2021, 12, 30), "EUR", "AUD", "1.5594"),
+            (datetime.date(2021, 12, 31), "EUR", "USD", "1.1326"),
+            (datetime.date(2021, 12, 31), "EUR", "ZAR", "18.0625"),
+            (datetime.date(2022, 1, 3), "EUR", "USD", "1.1355"),
+            (datetime.date(2022, 1, 3), "EUR", "ZAR", "17.966"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency=base_currency, currency=currency, rate=rate
+            )
+
+    def test_matches_database(self):
+        table = RateTable.from_queryset()
+        for currency_from, currency_to in permutations(self.currencies, 2):
+            for date in self.dates:
+                with self.subTest(pair=(currency_from, currency_to), date=date):
+                    expected = max(
+                        _iter_available_rates(currency_from, currency_to, date),
+                        default=None,
+                    )
+                    self.assertEqual(
+                        table.latest_rate(currency_from, currency_to, date),
+                        expected,
+                    )
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(get_rate_table())
+
+    def test_exchange_without_queries(self):
+        with self.settings(EXCHANGE_RATE_TABLE=True):
+            self.assertIsNotNone(get_rate_table())
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    exchange(10, "USD", "ZAR", date=datetime.date(2021, 12, 31)),
+                    Decimal("159.48"),
+                )
+                self.assertEqual(
+                    exchange(10, "EUR", "ZAR", date=datetime.date(2021, 12, 30)),
+                    Decimal("180.18"),
+                )
+
+    def insert_from_another_process(self):
+        """Insert a rate without signalling this process"""
+        QuerySet(ExchangeRate).bulk_create(
+            [
+                ExchangeRate(
+                    date=datetime.date(2022, 1, 4),
+                    base_currency="EUR",
+                    currency="USD",
+                    rate="1.13",
+                )
+            ]
+        )
+
+    def test_reloads_after_other_process_writes(self):
+        date = datetime.date(2022, 1, 4)
+        with self.settings(EXCHANGE_RATE_TABLE=True, EXCHANGE_RATE_TABLE_CHECK=0):
+            self.assertEqual(
+                latest_rate("EUR", "USD", date)[0], datetime.date(2022, 1, 3)
+            )
+            self.insert_from_another_process()
+            self.assertEqual(
+                get_rate_table().latest_rate("EUR", "USD", date),
+                (date, Decimal("1.13")),
+            )
+            self.assertEqual(latest_rate("EUR", "USD", date), (date, Decimal("1.13")))
+
+    def test_reloads_after_other_process_deletes(self):
+        date = datetime.date(2021, 12, 31)
+        with self.settings(EXCHANGE_RATE_TABLE=True, EXCHANGE_RATE_TABLE_CHECK=0):
+            self.assertEqual(latest_rate("EUR", "USD", date)[0], date)
+            # Not the latest id
+            QuerySet(ExchangeRate).filter(date=date, currency="USD").delete()
+            self.assertEqual(
+                get_rate_table().latest_rate("EUR", "USD", date)[0],
+                datetime.date(2021, 12, 30),
+            )
+
+    def test_check_interval(self):
+        with self.settings(EXCHANGE_RATE_TABLE=True, EXCHANGE_RATE_TABLE_CHECK=3600):
+            table = get_rate_table()
+            self.insert_from_another_process()
+            with self.assertNumQueries(0):
+                self.assertIs(get_rate_table(), table)
@@ -0,0 +1,144 @@
+import datetime
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from itertools import permutations
+from pathlib import Path
+
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from historical_currencies.cache import SharedCache
+from historical_currencies.exchange import (
+    exchange,
+    latest_rate,
+)
+from historical_currencies.models import ExchangeRate
+from historical_currencies.ratetable import RateTable, clear_rate_table
+from historical_currencies.snapshot import SnapshotError, load_snapshot, write_snapshot
+
+
+class SnapshotTestCase(TestCase):
+    currencies = ("AUD", "EUR", "USD", "ZAR")
+    dates = [
+        datetime.date(2021, 12, 29),
+        datetime.date(2021, 12, 30),
+        datetime.date(2021, 12, 31),
+        datetime.date(2022, 1, 3),
+        datetime.date(2022, 2, 3),
+    ]
+
+    def setUp(self):
+        latest_rate.cache_clear()
+        clear_rate_table()
+        self.addCleanup(clear_rate_table)
+        for date, base_currency, currency, rate in (
+            (datetime.date(2021, 12, 30), "USD", "EUR", "0.8823"),
+            (datetime.date(2021, 12, 30), "USD", "ZAR", "15.897"),
+            (datetime.date(2021, 12, 30), "EUR", "AUD", "1.5594"),
+            (datetime.date(2021, 12, 31), "EUR", "USD", "1.1326"),
+            (datetime.date(2021, 12, 31), "EUR", "ZAR", "18.0625"),
+            (datetime.date(2022, 1, 3), "EUR", "USD", "1.1355"),
+            (datetime.date(2022, 1, 3), "EUR", "ZAR", "17.966"),
+        ):
+            ExchangeRate.objects.create(
+                date=date, base_currency=base_currency, currency=currency, rate=rate
+            )
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = Path(tmpdir.name) / "rates.snapshot"
+
+    def test_round_trip(self):
+        self.assertEqual(write_snapshot(self.path), 7)
+        expected = RateTable.from_queryset()
+        table = load_snapshot(self.path)
+        self.assertEqual(len(table), 7)
+        for currency_from, currency_to in permutations(self.currencies, 2):
+            for date in self.dates:
+                with self.subTest(pair=(currency_from, currency_to), date=date):
+                    self.assertEqual(
+                        table.latest_rate(currency_from, currency_to, date),
+                        expected.latest_rate(currency_from, currency_to, date),
+                    )
+
+    def test_memory_mapped(self):
+        write_snapshot(self.path)
+        table = load_snapshot(self.path)
+        for base_currency, currency, dates, rates in table.pairs():
+            self.assertIsInstance(dates, memoryview)
+            self.assertIsInstance(rates, memoryview)
+
+    def test_empty(self):
+        self.assertEqual(write_snapshot(self.path, RateTable()), 0)
+        table = load_snapshot(self.path)
+        self.assertEqual(len(table), 0)
+        self.assertIsNone(table.latest_rate("EUR", "USD", self.dates[0]))
+
+    def test_invalid(self):
+        self.path.write_bytes(b"not a snapshot, at all")
+        with self.assertRaises(SnapshotError):
+            load_snapshot(self.path)
+
+    def test_truncated(self):
+        write_snapshot(self.path)
+        self.path.write_bytes(self.path.read_bytes()[:-8])
+        with self.assertRaises(SnapshotError):
+            load_snapshot(self.path)
+
+    def test_exchange_without_queries(self):
+        write_snapshot(self.path)
+        with self.settings(EXCHANGE_RATE_SNAPSHOT=str(self.path)):
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    exchange(10, "USD", "ZAR", date=datetime.date(2021, 12, 31)),
+                    Decimal("159.48"),
+                )
+
+    def test_reloaded_when_replaced(self):
+        write_snapshot(self.path)
+        with self.settings(
+            EXCHANGE_RATE_SNAPSHOT=str(self.path), EXCHANGE_RATE_SNAPSHOT_CHECK=0
+        ):
+            date = datetime.date(2022, 1, 4)
+            self.assertEqual(latest_rate("EUR", "USD", date)[0], self.dates[3])
+            # Replaced without modifying the database (e.g. by another host)
+            write_snapshot(
+                self.path,
+                RateTable.from_rows([(date, "EUR", "USD", Decimal("1.13"))]),
+            )
+            self.assertEqual(latest_rate("EUR", "USD", date), (date, Decimal("1.13")))
+
+    def test_reload_leaves_shared_cache(self):
+        write_snapshot(self.path)
+        with self.settings(
+            EXCHANGE_RATE_SNAPSHOT=str(self.path),
+            EXCHANGE_RATE_SNAPSHOT_CHECK=0,
+            EXCHANGE_RATE_SHARED_CACHE="default",
+        ):
+            self.addCleanup(caches["default"].clear)
+            shared = SharedCache("default")
+            date = datetime.date(2022, 1, 4)
+            latest_rate("EUR", "USD", date)
+            version = shared.version()
+            write_snapshot(
+                self.path,
+                RateTable.from_rows([(date, "EUR", "USD", Decimal("1.13"))]),
+            )
+            latest_rate("EUR", "USD", date)
+            # Every worker notices the new snapshot, and shouldn't invalidate
+            # the shared cache for the others
+            self.assertEqual(shared.version(), version)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_rate_snapshot", str(self.path), stdout=out)
+        self.assertEqual(out.getvalue(), f"Exported 7 rates to {self.path}\n")
+        self.assertEqual(len(load_snapshot(self.path)), 7)
+
+    def test_command_default_path(self):
+        with self.settings(EXCHANGE_RATE_SNAPSHOT=str(self.path)):
+            call_command("export_rate_snapshot", stdout=StringIO())
+        self.assertTrue(self.path.exists())
+        with self.assertRaises(CommandError):
+            call_command("export_rate_snapshot", stdout=StringIO())
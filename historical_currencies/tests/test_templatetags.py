@@ -1,11 +1,17 @@
 import datetime
 from decimal import Decimal
 
-from django.template import Context, Template
+from django.template import Context, Template, TemplateSyntaxError
 from django.test import SimpleTestCase, TestCase
 from iso4217 import Currency
 
+from historical_currencies.exchange import (
+    exchange,
+    latest_rate,
+    prefetch_rates,
+)
 from historical_currencies.models import ExchangeRate
+from historical_currencies.templatetags.currency_choices import _render_options
 
 
 class CurrencyTagTestCase(SimpleTestCase):
@@ -49,6 +55,63 @@ class ExchangeRateTagTestCase(TestCase):
         self.assertEqual(log.message, "Missing Exchange Rate: EUR:USD")
 
 
+class PrefetchRatesTagTestCase(TestCase):
+    def setUp(self):
+        latest_rate.cache_clear()
+        date = datetime.date.today() - datetime.timedelta(days=1)
+        for currency, rate in (("USD", "1.1326"), ("ZAR", "18.0625"), ("GBP", "0.84")):
+            ExchangeRate.objects.create(
+                date=date, base_currency="EUR", currency=currency, rate=rate
+            )
+
+    def render(self, body, context):
+        if isinstance(context, dict):
+            context = Context(context)
+        body = "{% load currency_format %}" + body
+        return Template(body).render(context)
+
+    def test_prefetch_rates(self):
+        amounts = [
+            (Decimal(1), "EUR"),
+            (Decimal(10), "USD"),
+            (Decimal(100), "ZAR"),
+            (Decimal(1), "AUD"),
+        ]
+        with self.assertLogs(
+            "historical_currencies.templatetags.currency_format", level="WARNING"
+        ):
+            with self.assertNumQueries(1):
+                rendered = self.render(
+                    "{% prefetch_rates %}"
+                    "{% for amount in amounts %}"
+                    "{{ amount|exchange:'GBP' }}\n"
+                    "{% endfor %}"
+                    "{% endprefetch_rates %}",
+                    {"amounts": amounts},
+                )
+        self.assertEqual(
+            rendered.splitlines(),
+            ["0.84 GBP", "7.42 GBP", "4.65 GBP", "? (no rate) GBP"],
+        )
+
+    def test_prefetch_rates_unused(self):
+        with self.assertNumQueries(0):
+            rendered = self.render("{% prefetch_rates %}-{% endprefetch_rates %}", {})
+        self.assertEqual(rendered, "-")
+
+    def test_prefetch_rates_arguments(self):
+        with self.assertRaises(TemplateSyntaxError):
+            self.render("{% prefetch_rates 'EUR' %}{% endprefetch_rates %}", {})
+
+    def test_prefetch_rates_context_manager(self):
+        with prefetch_rates():
+            with self.assertNumQueries(1):
+                self.assertEqual(exchange(10, "USD", "ZAR"), Decimal("159.48"))
+                self.assertEqual(exchange(10, "ZAR", "USD"), Decimal("0.63"))
+        with self.assertNumQueries(3):
+            exchange(10, "USD", "ZAR")
+
+
 class CurrencyChoicesListTagTestCase(SimpleTestCase):
     def render(self, body, context):
         if isinstance(context, dict):
@@ -89,3 +152,16 @@ class CurrencyChoicesOptionsTagTestCase(SimpleTestCase):
             f'<option value="USD" selected>USD ({Currency("USD").currency_name})</option>',
             rendered,
         )
+
+    def test_currency_choices_options_unknown_selected(self):
+        rendered = self.render("{% currency_choices_options selected='ZZZ' %}\n", {})
+        self.assertNotIn("selected", rendered)
+
+    def test_currency_choices_options_reused(self):
+        _render_options.cache_clear()
+        for i in range(3):
+            rendered = self.render(
+                "{% currency_choices_options selected='USD' %}\n", {}
+            )
+        self.assertEqual(_render_options.cache_info().hits, 2)
+        self.assertEqual(rendered.count("selected"), 1)
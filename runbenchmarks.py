@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Run the benchmark suite, and optionally compare against earlier results.
+
+Usage: runbenchmarks.py [--rows 1k 100k 10m] [--output results.json]
+                        [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import django
+
+SIZES = {
+    "1k": 1_000,
+    "100k": 100_000,
+    "10m": 10_000_000,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the change from baseline, returning the number of regressions.
+
+    A regression is a throughput drop of more than threshold percent, or any
+    increase in queries.
+    """
+    previous = {(result["name"], result["rows"]): result for result in baseline}
+    regressions = 0
+    for result in results:
+        before = previous.get((result["name"], result["rows"]))
+        if before is None:
+            continue
+        change = (result["ops_per_second"] / before["ops_per_second"] - 1) * 100
+        queries = result["queries"] - before["queries"]
+        regressed = change < -threshold or queries > 0
+        regressions += regressed
+        print(
+            f"{result['name']} [{result['rows']}]: {change:+.1f}% ops/s, "
+            f"{queries:+d} queries, "
+            f"{(result['peak_memory'] - before['peak_memory']) / 2**20:+.1f} MiB"
+            + (" REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument(
+        "--rows",
+        nargs="+",
+        choices=SIZES,
+        default=["1k"],
+        help="Dataset sizes to benchmark (default: 1k)",
+    )
+    p.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        help="Only run benchmarks whose names contain PATTERN",
+    )
+    p.add_argument("--repeat", type=int, default=3, help="Timing repetitions")
+    p.add_argument("--output", metavar="PATH", help="Write results as JSON to PATH")
+    p.add_argument(
+        "--compare",
+        metavar="PATH",
+        help="Compare against results previously written with --output",
+    )
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Throughput drop (in percent) reported as a regression (default: 10)",
+    )
+    args = p.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+    from django.db import connection
+
+    from benchmarks.suite import BENCHMARKS, run_suite
+
+    names = [
+        name
+        for name in BENCHMARKS
+        if not args.patterns or any(pattern in name for pattern in args.patterns)
+    ]
+    results = []
+    for size in args.rows:
+        results += run_suite(SIZES[size], names, args.repeat)
+    results = [result.as_dict() for result in results]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "database": connection.vendor,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared to {baseline['revision'] or args.compare}:")
+        sys.exit(bool(compare(results, baseline["results"], args.threshold)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+from django.db import models
+
+
+class Invoice(models.Model):
+    """A model with amounts in different currencies, to test against"""
+
+    amount = models.DecimalField(decimal_places=2, max_digits=15)
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
@@ -7,6 +7,7 @@ SECRET_KEY = "fake-key"
 
 INSTALLED_APPS = [
     "historical_currencies",
+    "tests",
 ]
 
 DATABASES = {
@@ -16,6 +17,18 @@ DATABASES = {
     }
 }
 
+# Set TEST_DATABASE=postgresql to test against PostgreSQL, configured by the
+# standard libpq environment variables (PGHOST, etc.)
+if os.environ.get("TEST_DATABASE") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("PGDATABASE", "historical_currencies"),
+        }
+    }
+
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",